@@ -0,0 +1,22 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_stripe_account_id'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='otprequest',
+            index=models.Index(fields=['ref', 'otp', '-created_at'], name='otp_request_lookup_idx'),
+        ),
+        migrations.AlterField(
+            model_name='otprequest',
+            name='ref',
+            field=models.CharField(max_length=300),
+        ),
+    ]
@@ -80,7 +80,7 @@ class TimeStampedBaseModel(models.Model):
 
 
 class OTPRequest(TimeStampedBaseModel):
-    ref = models.CharField(max_length=300, db_index=True)
+    ref = models.CharField(max_length=300)
     # Hashed random token for device identity
     device_identity = models.CharField(max_length=255)
     otp = models.CharField(max_length=6)
@@ -89,6 +89,10 @@ class OTPRequest(TimeStampedBaseModel):
     class Meta:
         verbose_name = _("OTP Request")
         verbose_name_plural = _("OTP Requests")
+        indexes = [
+            # Serves the latest-OTP lookups by ref, with or without the code.
+            models.Index(fields=['ref', 'otp', '-created_at'], name='otp_request_lookup_idx'),
+        ]
     
     def __str__(self):
         return f"{self.ref} - {self.otp}"
@@ -1,3 +1,32 @@
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from rest_framework.test import APIClient
 
-# Create your tests here.
+
+User = get_user_model()
+
+
+class UserListPaginationTests(TestCase):
+
+    def test_walks_pages_ordered_by_uuid_in_both_directions(self):
+        for index in range(5):
+            User.objects.create_user(email=f"user{index}@example.com", password='password', first_name='User')
+        expected = [str(pk) for pk in User.objects.order_by('id').values_list('id', flat=True)]
+        client = APIClient()
+
+        pages, url = [], '/accounts/?page_size=2'
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.json())
+            url = pages[-1]['next']
+        self.assertEqual([user['id'] for page in pages for user in page['results']], expected)
+        self.assertEqual(len(pages), 3)
+
+        previous, url = [], pages[-1]['previous']
+        while url:
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            previous.insert(0, response.json())
+            url = previous[0]['previous']
+        self.assertEqual([user['id'] for page in previous for user in page['results']], expected[:4])
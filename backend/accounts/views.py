@@ -46,11 +46,14 @@ User = get_user_model()
 class UserViewSet(viewsets.mixins.ListModelMixin,
                   viewsets.mixins.RetrieveModelMixin,
                   viewsets.GenericViewSet):
-    queryset = User.objects.all()
+    # has_phone_number and get_phone_number read the phone number of every listed user.
+    queryset = User.objects.select_related('phone_number')
     lookup_field = 'pk'
     lookup_url_kwarg = 'pk'
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
+    ordering = ('id',)
+    page_size = 50
 
     @action(methods=['POST'], detail=False, url_path='signup')
     def signup(self, request: Request, *args, **kwargs):
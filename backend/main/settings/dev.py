@@ -38,6 +38,9 @@ CORS_ALLOWED_ORIGINS = CORS_ALLOWED_ORIGINS_str.split(',') if CORS_ALLOWED_ORIGI
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Paginated contribution lists return their totals in these headers.
+CORS_EXPOSE_HEADERS = ['X-Contributions-Count', 'X-Contributions-Amount', 'X-Contributions-Fees']
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -181,6 +184,9 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
+    # Views set their own sort key and page size with `ordering` and `page_size`.
+    'DEFAULT_PAGINATION_CLASS': 'utilities.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
 }
 
 
@@ -233,6 +239,24 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Cache settings
+# Redis is used when REDIS_URL is set, so cached data and locks are shared by every worker.
+# Without it, each process falls back to its own in-memory cache.
+REDIS_URL = os.environ.get('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
 EMAIL_HOST = os.getenv("EMAIL_HOST")
@@ -309,4 +333,12 @@ FIREBASE_CRED_FILE = os.getenv("FIREBASE_CRED_FILE")
 
 # Stripe settings (for local development, loaded from .env)
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
-STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
\ No newline at end of file
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+# Use the offline fake Stripe gateway for background lookups (see registries/stripe_gateway.py)
+STRIPE_FAKE_MODE = os.environ.get('STRIPE_FAKE_MODE', 'False') == 'True'
+# Maximum number of concurrent Stripe lookups when enriching contributions
+STRIPE_ENRICHMENT_WORKERS = int(os.environ.get('STRIPE_ENRICHMENT_WORKERS', 4))
+# Number of worker threads processing stored Stripe webhook events
+STRIPE_EVENT_WORKERS = int(os.environ.get('STRIPE_EVENT_WORKERS', 4))
+# Seconds a checkout holds its share of a service's remaining funding before it is released
+FUNDING_RESERVATION_TTL = int(os.environ.get('FUNDING_RESERVATION_TTL', 30 * 60))
\ No newline at end of file
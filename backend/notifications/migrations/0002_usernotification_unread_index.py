@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='usernotification',
+            index=models.Index(fields=['user', 'is_read'], name='user_notification_unread_idx'),
+        ),
+    ]
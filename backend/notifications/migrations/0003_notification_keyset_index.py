@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_usernotification_unread_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['created_at', 'id'], name='notification_keyset_idx'),
+        ),
+    ]
@@ -40,6 +40,11 @@ class Notification(models.Model):
         help_text=_("The date and time when the notification was last updated."),
     )
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='notification_keyset_idx'),
+        ]
+
 
 class GeneralNotification(Notification):
     """
@@ -94,6 +99,9 @@ class UserNotification(Notification):
     class Meta:
         verbose_name = _("User Notification")
         verbose_name_plural = _("User Notifications")
+        indexes = [
+            models.Index(fields=['user', 'is_read'], name='user_notification_unread_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         """
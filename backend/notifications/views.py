@@ -19,6 +19,8 @@ class NotificationViewSet(
     queryset = models.Notification.objects.all()
     serializer_class = serializers.NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    ordering = ('-created_at', '-id')
+    page_size = 20
 
     def get_queryset(self):
         """
@@ -1,38 +1,77 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
-from .models import (Registry, Service, SharedRegistry, Contribution, DefaultRegistry, DefaultService, Withdrawal)
+from .models import (Registry, Service, SharedRegistry, Contribution, DefaultRegistry, DefaultService, Withdrawal, StripeSyncState, StripeEvent,
+                     FundingReservation, RegistryLedgerEntry, RegistryLedgerBalance)
 
 
 @admin.register(Registry)
 class RegistryAdmin(admin.ModelAdmin):
     list_display = ('name', 'is_first_time', 'babies_count', 'shareable_id', 'arrival_date', 'created_by', 'created_at', 'updated_at')
+    list_select_related = ('created_by',)
     search_fields = ('name', 'shareable_id', 'created_by__email')
     list_filter = ('is_first_time', 'arrival_date', 'created_at')
 
 @admin.register(Service)
 class ServiceAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'total_cost', 'is_active', 'created_at', 'updated_at')
+    list_select_related = ('registry',)
     search_fields = ('name', 'registry__name')
     list_filter = ('is_active', 'created_at')
 
 @admin.register(SharedRegistry)
 class SharedRegistryAdmin(admin.ModelAdmin):
     list_display = ('registry', 'shared_with', 'created_at')
+    list_select_related = ('registry', 'shared_with')
     search_fields = ('registry__name', 'shared_with__email')
     list_filter = ('created_at',)
 
 @admin.register(Contribution)
 class ContributionAdmin(admin.ModelAdmin):
     list_display = ('service', 'contributor_name', 'amount', 'status', 'created_at')
+    list_select_related = ('service__registry',)
     search_fields = ('service__name', 'contributor_name', 'contributor_email', 'stripe_payment_intent_id')
     list_filter = ('created_at', 'status')
 
+@admin.register(FundingReservation)
+class FundingReservationAdmin(admin.ModelAdmin):
+    list_display = ('service', 'amount', 'status', 'stripe_payment_intent_id', 'expires_at', 'created_at')
+    list_select_related = ('service__registry',)
+    search_fields = ('stripe_payment_intent_id', 'service__name')
+    list_filter = ('status', 'created_at')
+
 @admin.register(Withdrawal)
 class WithdrawalAdmin(admin.ModelAdmin):
     list_display = ('registry', 'amount', 'status', 'stripe_transfer_id', 'created_at')
+    list_select_related = ('registry',)
     search_fields = ('registry__name', 'stripe_transfer_id')
     list_filter = ('status', 'created_at')
 
+@admin.register(RegistryLedgerEntry)
+class RegistryLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ('registry', 'entry_type', 'amount', 'available_on', 'is_settled', 'created_at')
+    list_select_related = ('registry',)
+    search_fields = ('registry__name',)
+    list_filter = ('entry_type', 'is_settled', 'created_at')
+
+@admin.register(RegistryLedgerBalance)
+class RegistryLedgerBalanceAdmin(admin.ModelAdmin):
+    list_display = ('registry', 'available', 'pending', 'fees', 'withdrawn', 'checkpointed_at')
+    list_select_related = ('registry',)
+    search_fields = ('registry__name',)
+
+@admin.register(StripeSyncState)
+class StripeSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('name', 'cursor', 'processed_count', 'updated_count', 'failed_count', 'last_run_at')
+    search_fields = ('name',)
+    readonly_fields = ('last_run_at',)
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ('event_id', 'event_type', 'status', 'attempts', 'next_attempt_at', 'stripe_created_at', 'processed_at')
+    search_fields = ('event_id',)
+    list_filter = ('status', 'event_type', 'stripe_created_at')
+    readonly_fields = ('event_id', 'event_type', 'payload', 'stripe_created_at', 'processed_at')
+
 # @admin.register(VolunteerContribution)
 # class VolunteerContributionAdmin(admin.ModelAdmin):
 #     list_display = ('service', 'volunteer', 'timeframe_from', 'timeframe_to', 'created_at')
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class RegistriesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'registries'
+
+    def ready(self):
+        from . import signals  # noqa: F401
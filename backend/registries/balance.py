@@ -0,0 +1,67 @@
+from decimal import Decimal
+from django.db.models import Q, Sum
+from django.utils import timezone
+from .models import Contribution, Withdrawal
+
+
+class RegistryBalance:
+    """
+    The financial summary of a registry.
+
+    - available: net contributions whose funds are available, minus pending and succeeded withdrawals.
+    - pending: net contributions whose funds are not yet available.
+    - fees: processing fees of all successful contributions.
+    - withdrawn: total of pending and succeeded withdrawals.
+    """
+    WITHDRAWN_STATUSES = ('pending', 'succeeded')
+
+    def __init__(self, available, pending, fees, withdrawn):
+        self.available = available
+        self.pending = pending
+        self.fees = fees
+        self.withdrawn = withdrawn
+
+    @classmethod
+    def for_registry(cls, registry):
+        """
+        Returns the balance of the given registry from its ledger, a single-row lookup.
+        """
+        from .ledger import RegistryLedger
+        return RegistryLedger.read(registry)
+
+    @classmethod
+    def from_transactions(cls, registry, now=None):
+        """
+        Computes the balance of the given registry from scratch, with one conditional
+        aggregation over its contributions and one over its withdrawals.
+        This is the reference the ledger is checked against.
+        """
+        now = now or timezone.now()
+        is_available = Q(available_on__lte=now)
+        is_pending = Q(available_on__gt=now)
+        contributions = Contribution.objects.filter(
+            service__registry=registry, status='succeeded'
+        ).aggregate(
+            available_amount=Sum('amount', filter=is_available),
+            available_fee=Sum('fee', filter=is_available),
+            pending_amount=Sum('amount', filter=is_pending),
+            pending_fee=Sum('fee', filter=is_pending),
+            total_fee=Sum('fee'),
+        )
+        withdrawn = Withdrawal.objects.filter(
+            registry=registry, status__in=cls.WITHDRAWN_STATUSES
+        ).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
+
+        totals = {key: value or Decimal('0.00') for key, value in contributions.items()}
+        net_available = totals['available_amount'] - totals['available_fee']
+        net_pending = totals['pending_amount'] - totals['pending_fee']
+        return cls(
+            available=net_available - withdrawn,
+            pending=net_pending,
+            fees=totals['total_fee'],
+            withdrawn=withdrawn,
+        )
+
+    def __repr__(self):
+        return (f"RegistryBalance(available={self.available}, pending={self.pending}, "
+                f"fees={self.fees}, withdrawn={self.withdrawn})")
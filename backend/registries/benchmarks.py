@@ -0,0 +1,207 @@
+"""
+Helpers for the query plan benchmark management commands.
+
+Benchmark data is created under users whose emails use BENCHMARK_EMAIL_DOMAIN,
+so it can be told apart from real data and removed afterwards.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.utils import timezone
+from accounts.models import OTPRequest
+from notifications.models import UserNotification
+from .models import Contribution, Registry, Service, SharedRegistry, StripeEvent, Withdrawal
+
+
+User = get_user_model()
+
+BENCHMARK_EMAIL_DOMAIN = 'benchmark.pampermomma.invalid'
+BENCHMARK_REF_PREFIX = 'benchmark:'
+BENCHMARK_EVENT_PREFIX = 'evt_benchmark_'
+
+
+def benchmark_users(prefix, count):
+    """
+    Creates `count` benchmark users with a bulk insert and returns them.
+    """
+    users = [
+        User(email=f"{prefix}-{index}@{BENCHMARK_EMAIL_DOMAIN}", first_name=prefix, password='!')
+        for index in range(count)
+    ]
+    return User.objects.bulk_create(users, batch_size=1000)
+
+
+def seed_registries(registries, services_per_registry, shares_per_registry, viewers=50):
+    """
+    Creates registries owned by separate users, each with services and shared with a rotating
+    subset of viewer users. Returns the viewers and the created registries.
+    """
+    owners = benchmark_users('owner', registries)
+    viewer_users = benchmark_users('viewer', viewers)
+    created = Registry.objects.bulk_create(
+        [Registry(name=f"Benchmark {index}", created_by=owner) for index, owner in enumerate(owners)],
+        batch_size=1000,
+    )
+    Service.objects.bulk_create(
+        [
+            Service(registry=registry, name=f"Service {index}", hours=4, cost_per_hour=Decimal('25.00'))
+            for registry in created
+            for index in range(services_per_registry)
+        ],
+        batch_size=2000,
+    )
+    SharedRegistry.objects.bulk_create(
+        [
+            SharedRegistry(registry=registry, shared_with=viewer_users[(position + offset) % viewers])
+            for position, registry in enumerate(created)
+            for offset in range(min(shares_per_registry, viewers))
+        ],
+        batch_size=2000,
+    )
+    return viewer_users, created
+
+
+def seed_contributions(services, per_service, now=None):
+    """
+    Creates contributions for the given services, most of them succeeded and enriched.
+    The last contribution of every tenth service is left unenriched, like the reconciler backlog.
+    """
+    now = now or timezone.now()
+    contributions = []
+    for position, service in enumerate(services):
+        for index in range(per_service):
+            unenriched = position % 10 == 0 and index == per_service - 1
+            contributions.append(Contribution(
+                service=service,
+                amount=Decimal('25.00'),
+                fee=Decimal('0.00') if unenriched else Decimal('1.03'),
+                stripe_payment_intent_id=f"pi_benchmark_{service.id}_{index}",
+                status='failed' if index % 7 == 6 else 'succeeded',
+                available_on=None if unenriched else now + timedelta(days=2 - index % 5),
+            ))
+    return Contribution.objects.bulk_create(contributions, batch_size=2000)
+
+
+def seed_withdrawals(registries, per_registry):
+    """
+    Creates withdrawals for the given registries, with a mix of statuses.
+    """
+    statuses = ('succeeded', 'pending', 'failed')
+    return Withdrawal.objects.bulk_create(
+        [
+            Withdrawal(
+                registry=registry,
+                amount=Decimal('10.00'),
+                status=statuses[index % len(statuses)],
+                stripe_transfer_id=f"tr_benchmark_{registry.id}_{index}",
+            )
+            for registry in registries
+            for index in range(per_registry)
+        ],
+        batch_size=2000,
+    )
+
+
+def seed_notifications(users, per_user):
+    """
+    Creates notifications for the given users, most of them already read.
+    Notifications use multi-table inheritance, so they are saved one by one.
+    """
+    for user in users:
+        for index in range(per_user):
+            UserNotification.objects.create(
+                user=user, title=f"Notification {index}", message='Benchmark', is_read=index % 10 != 0,
+            )
+
+
+def seed_otp_requests(refs, per_ref):
+    """
+    Creates OTP requests under benchmark refs, as repeated requests for the same ref would.
+    """
+    return OTPRequest.objects.bulk_create(
+        [
+            OTPRequest(ref=f"{BENCHMARK_REF_PREFIX}{ref}", device_identity='!', otp=f"{100000 + index}")
+            for ref in range(refs)
+            for index in range(per_ref)
+        ],
+        batch_size=2000,
+    )
+
+
+def payment_burst(services, payment_intents, charges=True, now=None):
+    """
+    Returns the payloads of a burst of Stripe events paying the given services in turn:
+    a payment_intent.succeeded event per PaymentIntent, each followed by the charge.succeeded
+    event of its charge when `charges` is set.
+    """
+    created = int((now or timezone.now()).timestamp())
+    payloads = []
+    for index in range(payment_intents):
+        payment_intent = {
+            'id': f"pi_benchmark_burst_{index}",
+            'object': 'payment_intent',
+            'amount_received': 2500,
+            'metadata': {'service_id': str(services[index % len(services)].id), 'contributor_name': 'Benchmark'},
+        }
+        payloads.append({
+            'id': f"evt_burst_pi_{index}",
+            'object': 'event',
+            'type': 'payment_intent.succeeded',
+            'created': created + index // 10,
+            'data': {'object': payment_intent},
+        })
+        if charges:
+            payloads.append({
+                'id': f"evt_burst_ch_{index}",
+                'object': 'event',
+                'type': 'charge.succeeded',
+                'created': created + index // 10,
+                'data': {'object': {'id': f"ch_benchmark_burst_{index}", 'object': 'charge', 'payment_intent': payment_intent['id']}},
+            })
+    return payloads
+
+
+def remove_benchmark_data():
+    """
+    Deletes every benchmark user, which cascades to their registries, services and notifications,
+    along with the contributions of their services, the benchmark OTP requests and Stripe events.
+    """
+    Contribution.objects.filter(service__registry__created_by__email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}").delete()
+    OTPRequest.objects.filter(ref__startswith=BENCHMARK_REF_PREFIX).delete()
+    StripeEvent.objects.filter(event_id__startswith=BENCHMARK_EVENT_PREFIX).delete()
+    return User.objects.filter(email__endswith=f"@{BENCHMARK_EMAIL_DOMAIN}").delete()
+
+
+def vacuum_analyze(*models):
+    """
+    Refreshes planner statistics and visibility maps, so plans match a steady-state database.
+    """
+    with connection.cursor() as cursor:
+        for model in models:
+            cursor.execute(f'VACUUM ANALYZE "{model._meta.db_table}"')
+
+
+@contextmanager
+def without_indexes(*model_indexes):
+    """
+    Drops the given (model, index name) indexes for the duration of the block, in a transaction
+    that is rolled back afterwards. Dropping an index locks its table until then.
+    """
+    with transaction.atomic():
+        with connection.schema_editor(atomic=False) as schema_editor:
+            for model, name in model_indexes:
+                index = next(index for index in model._meta.indexes if index.name == name)
+                schema_editor.remove_index(model, index)
+        yield
+        transaction.set_rollback(True)
+
+
+def write_plan(stdout, title, queryset):
+    """
+    Writes the EXPLAIN ANALYZE output of the queryset under a title.
+    """
+    stdout.write(f"\n=== {title} ===")
+    stdout.write(str(queryset.query))
+    stdout.write(queryset.explain(analyze=True, buffers=True))
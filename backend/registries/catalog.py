@@ -0,0 +1,105 @@
+"""
+Versioned cache for the default registry and service catalog.
+
+The catalog changes rarely and is the same for every visitor, so serialized list payloads
+are kept in the shared cache and in a small per-worker LRU. Both are keyed by a catalog
+version stored in the shared cache; saving or deleting a default registry or service bumps
+the version, which retires every cached payload and ETag at once.
+"""
+from collections import OrderedDict
+from hashlib import sha1
+from threading import Lock
+import time
+from django.core.cache import cache
+from django.utils.cache import patch_cache_control
+from rest_framework import status
+from rest_framework.response import Response
+
+
+VERSION_KEY = 'registries:catalog:version'
+PAYLOAD_TIMEOUT = 60 * 60 * 24
+MAX_AGE = 60
+
+
+class LocalLRU:
+    """
+    A small thread-safe least-recently-used mapping, private to the worker process.
+    """
+
+    def __init__(self, size=128):
+        self.size = size
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+local_payloads = LocalLRU()
+
+
+def initial_version():
+    # Versions start from the clock, so a version evicted from the cache is never reused
+    # while payloads cached under it may still exist.
+    return int(time.time() * 1000)
+
+
+def catalog_version():
+    """
+    Returns the current catalog version, starting a new one if the cache has none.
+    """
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, initial_version(), timeout=None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    """
+    Moves the catalog to a new version, so cached payloads are no longer served.
+    """
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, initial_version(), timeout=None)
+
+
+def cached_catalog_response(request, name, build_payload):
+    """
+    Returns the catalog payload for the request, built with `build_payload()` only when
+    neither the worker's LRU nor the shared cache has it for the current version.
+    Responses carry an ETag and Cache-Control header, and a matching If-None-Match is
+    answered with 304 Not Modified without loading the payload at all.
+    """
+    version = catalog_version()
+    digest = sha1(request.build_absolute_uri().encode()).hexdigest()[:16]
+    etag = f'"{name}-{version}-{digest}"'
+
+    if etag in [tag.strip() for tag in request.headers.get('If-None-Match', '').split(',')]:
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
+    else:
+        key = f"registries:catalog:{version}:{name}:{digest}"
+        payload = local_payloads.get(key)
+        if payload is None:
+            payload = cache.get(key)
+            if payload is None:
+                payload = build_payload()
+                cache.set(key, payload, timeout=PAYLOAD_TIMEOUT)
+            local_payloads.set(key, payload)
+        response = Response(payload)
+
+    response['ETag'] = etag
+    patch_cache_control(response, public=True, max_age=MAX_AGE)
+    return response
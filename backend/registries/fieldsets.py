@@ -0,0 +1,102 @@
+"""
+Sparse fieldsets and expandable fields for the registry APIs.
+
+Clients pick the fields of a response with `?fields=name,services.name` and include fields
+that are left out by default with `?expand=stripe_balance,services.contributions`. Nested
+fields are addressed by their dotted path from the top-level serializer. Views read the
+same selection to decide what to prefetch, so fields that are not returned are not loaded.
+"""
+
+
+def parse_field_paths(value):
+    """
+    Parses a comma-separated list of dotted field paths into a set.
+    """
+    return {path.strip() for path in (value or '').split(',') if path.strip()}
+
+
+class FieldSelection:
+    """
+    The fields and expansions requested by a client.
+    """
+
+    def __init__(self, fields=(), expand=()):
+        self.fields = set(fields)
+        self.expand = set(expand)
+
+    @classmethod
+    def from_request(cls, request):
+        """
+        Reads the `fields` and `expand` query parameters of the request.
+        """
+        if request is None:
+            return cls()
+        params = request.query_params
+        return cls(parse_field_paths(params.get('fields')), parse_field_paths(params.get('expand')))
+
+    @staticmethod
+    def _mentions(paths, path):
+        """
+        Checks whether any of the paths names the given path or one of its nested fields.
+        """
+        return any(candidate == path or candidate.startswith(f"{path}.") for candidate in paths)
+
+    def includes(self, path, expandable=False):
+        """
+        Checks whether the field at the dotted path is part of the response.
+        A field is left out when `fields` restricts its level without naming it, and an
+        expandable field is left out unless it, or one of its nested fields, is expanded
+        or explicitly listed in `fields`.
+        """
+        parent, _, _ = path.rpartition('.')
+        if parent and not self.includes(parent):
+            return False
+        if parent:
+            restricted = any(candidate.startswith(f"{parent}.") for candidate in self.fields)
+        else:
+            restricted = bool(self.fields)
+        if restricted and not self._mentions(self.fields, path):
+            return False
+        if expandable:
+            return self._mentions(self.expand, path) or self._mentions(self.fields, path)
+        return True
+
+    def includes_any(self, *paths, expandable=False):
+        """
+        Checks whether any of the fields at the dotted paths is part of the response.
+        """
+        return any(self.includes(path, expandable) for path in paths)
+
+
+class SparseFieldsetMixin:
+    """
+    Serializer mixin that drops the fields the client did not ask for.
+    Fields named in `Meta.expandable_fields` are only included when expanded.
+    Nested serializers using the mixin resolve their fields under their own path.
+    """
+
+    @property
+    def field_path(self):
+        """
+        The dotted path of this serializer from the top-level serializer.
+        """
+        names, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None:
+            return fields
+
+        selection = FieldSelection.from_request(request)
+        prefix = f"{self.field_path}." if self.field_path else ''
+        expandable = getattr(self.Meta, 'expandable_fields', ())
+        for name in list(fields):
+            if not selection.includes(f"{prefix}{name}", expandable=name in expandable):
+                fields.pop(name)
+        return fields
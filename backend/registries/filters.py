@@ -0,0 +1,63 @@
+from django.db.models import Q
+from django.utils import timezone
+from django_filters import rest_framework as filters
+from . import models
+
+
+class ContributionFilter(filters.FilterSet):
+    """
+    Filters contributions by status, creation date range and availability of their funds.
+    """
+    status = filters.BaseInFilter(field_name='status', help_text="Comma-separated statuses, e.g. succeeded,failed.")
+    created_after = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='gte')
+    created_before = filters.IsoDateTimeFilter(field_name='created_at', lookup_expr='lt')
+    is_available = filters.BooleanFilter(
+        method='filter_is_available',
+        help_text="Whether the contribution's funds are available for withdrawal.",
+    )
+
+    class Meta:
+        model = models.Contribution
+        fields = ['status', 'created_after', 'created_before', 'is_available']
+
+    def filter_is_available(self, queryset, name, value):
+        available = Q(available_on__lte=timezone.now())
+        return queryset.filter(available) if value else queryset.exclude(available)
+
+
+class ServiceFilter(filters.FilterSet):
+    """
+    Filters services by registry and funding state.
+    The funding state filters run on the annotations of `Service.objects.with_financials()`.
+    """
+    is_available = filters.BooleanFilter(
+        field_name='annotated_is_available',
+        help_text="Whether the service is active and not yet fully funded.",
+    )
+    is_completed = filters.BooleanFilter(
+        field_name='annotated_is_completed',
+        help_text="Whether the service is active and fully funded.",
+    )
+
+    class Meta:
+        model = models.Service
+        fields = ['registry', 'is_available', 'is_completed']
+
+
+SERVICE_ORDERINGS = {
+    'progress': ('annotated_progress', 'id'),
+    '-progress': ('-annotated_progress', '-id'),
+    'created_at': ('created_at', 'id'),
+    '-created_at': ('-created_at', '-id'),
+}
+
+
+def service_ordering(request, default):
+    """
+    Returns the sort key requested with `?ordering=`, or the default one.
+    `progress` sorts by funded ratio, least funded first; `-progress` puts the best funded first.
+    """
+    ordering = SERVICE_ORDERINGS.get(request.query_params.get('ordering', ''))
+    if ordering is None:
+        return default
+    return ordering
@@ -0,0 +1,254 @@
+from collections import defaultdict
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.utils import timezone
+from .balance import RegistryBalance
+from .models import Contribution, Registry, RegistryLedgerBalance, RegistryLedgerEntry, Withdrawal
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+CREDIT, FEE, DEBIT = RegistryLedgerEntry.CREDIT, RegistryLedgerEntry.FEE, RegistryLedgerEntry.DEBIT
+
+
+def totals_from_entries(entries):
+    """
+    Computes the balance totals of a queryset of ledger entries with one conditional aggregation.
+    Returns a dict with the available, pending, fees and withdrawn totals.
+    """
+    scheduled = Q(is_settled=False, available_on__isnull=False)
+    sums = entries.aggregate(
+        settled_credits=Sum('amount', filter=Q(entry_type=CREDIT, is_settled=True)),
+        settled_fees=Sum('amount', filter=Q(entry_type=FEE, is_settled=True)),
+        pending_credits=Sum('amount', filter=Q(entry_type=CREDIT) & scheduled),
+        pending_fees=Sum('amount', filter=Q(entry_type=FEE) & scheduled),
+        fees=Sum('amount', filter=Q(entry_type=FEE)),
+        debits=Sum('amount', filter=Q(entry_type=DEBIT)),
+    )
+    sums = {key: value or Decimal('0.00') for key, value in sums.items()}
+    return {
+        'available': sums['settled_credits'] - sums['settled_fees'] - sums['debits'],
+        'pending': sums['pending_credits'] - sums['pending_fees'],
+        'fees': sums['fees'],
+        'withdrawn': sums['debits'],
+    }
+
+
+class RegistryLedger:
+    """
+    Maintains a registry's append-only ledger and its running balance.
+
+    Every change goes through a ledger obtained with `lock()`, which holds a row lock on
+    the registry's balance until the surrounding transaction ends. Balance reads are a
+    single-row lookup. The ledger of a registry is built from its contributions and
+    withdrawals the first time it is locked, so the lock must be taken before the
+    change being recorded is written to those tables.
+
+    Writers that also update services lock the ledgers first, in registry ID order, and
+    the service rows after them, so they cannot deadlock on each other.
+    """
+
+    def __init__(self, balance):
+        self.balance = balance
+
+    @classmethod
+    def lock(cls, registry_id):
+        """
+        Returns the ledger of the registry with its balance row locked.
+        Must be called inside a transaction.
+        """
+        balance = RegistryLedgerBalance.objects.select_for_update().filter(registry_id=registry_id).first()
+        if balance is None:
+            # Serialize the first build of the ledger on the registry row itself. The lock does
+            # not block the key-share locks foreign keys to the registry take, so writers that
+            # already hold the balance row can still insert ledger entries without deadlocking.
+            Registry.objects.select_for_update(no_key=True).get(pk=registry_id)
+            balance = RegistryLedgerBalance.objects.select_for_update().filter(registry_id=registry_id).first()
+            if balance is None:
+                balance = cls.build(registry_id)
+        return cls(balance)
+
+    @classmethod
+    def read(cls, registry):
+        """
+        Returns the current RegistryBalance of the registry from its balance row.
+        """
+        try:
+            # Uses the row loaded by select_related('ledger_balance') when there is one.
+            balance = registry.ledger_balance
+        except RegistryLedgerBalance.DoesNotExist:
+            with transaction.atomic():
+                balance = cls.lock(registry.pk).balance
+        return RegistryBalance(
+            available=balance.available,
+            pending=balance.pending,
+            fees=balance.fees,
+            withdrawn=balance.withdrawn,
+        )
+
+    @staticmethod
+    def build(registry_id, now=None):
+        """
+        Builds the ledger of a registry from its existing contributions and withdrawals.
+        Returns the new balance row.
+        """
+        now = now or timezone.now()
+        entries = []
+        contributions = Contribution.objects.filter(service__registry_id=registry_id, status='succeeded')
+        for contribution in contributions.iterator():
+            is_settled = contribution.available_on is not None and contribution.available_on <= now
+            for entry_type, amount in ((CREDIT, contribution.amount), (FEE, contribution.fee)):
+                if entry_type == FEE and not amount:
+                    continue
+                entries.append(RegistryLedgerEntry(
+                    registry_id=registry_id, entry_type=entry_type, amount=amount,
+                    contribution=contribution, available_on=contribution.available_on, is_settled=is_settled,
+                ))
+        withdrawals = Withdrawal.objects.filter(registry_id=registry_id, status__in=('pending', 'succeeded'))
+        for withdrawal in withdrawals.iterator():
+            entries.append(RegistryLedgerEntry(
+                registry_id=registry_id, entry_type=DEBIT, amount=withdrawal.amount,
+                withdrawal=withdrawal, available_on=withdrawal.created_at, is_settled=True,
+            ))
+        RegistryLedgerEntry.objects.bulk_create(entries)
+        totals = totals_from_entries(RegistryLedgerEntry.objects.filter(registry_id=registry_id))
+        return RegistryLedgerBalance.objects.create(registry_id=registry_id, checkpointed_at=now, **totals)
+
+    def _apply(self, **deltas):
+        for field, delta in deltas.items():
+            setattr(self.balance, field, getattr(self.balance, field) + delta)
+        self.balance.save(update_fields=[*deltas.keys(), 'updated_at'])
+
+    def credit(self, contribution):
+        """
+        Records a successful contribution. Its funds count as pending once Stripe reports
+        when they become available.
+        """
+        self.credit_many([contribution])
+
+    def credit_many(self, contributions):
+        """
+        Records several successful contributions, such as those of a cart checkout, with
+        one insert and one balance update.
+        """
+        now = timezone.now()
+        entries, deltas = [], defaultdict(Decimal)
+        for contribution in contributions:
+            is_settled = contribution.available_on is not None and contribution.available_on <= now
+            entries.append(RegistryLedgerEntry(
+                registry_id=self.balance.registry_id, entry_type=CREDIT, amount=contribution.amount,
+                contribution=contribution, available_on=contribution.available_on, is_settled=is_settled,
+            ))
+            if is_settled:
+                deltas['available'] += contribution.amount
+            elif contribution.available_on is not None:
+                deltas['pending'] += contribution.amount
+        RegistryLedgerEntry.objects.bulk_create(entries)
+        if deltas:
+            self._apply(**deltas)
+
+    def charge_fee(self, contribution, fee_delta):
+        """
+        Records a change to a contribution's processing fee, and schedules the contribution's
+        credit for the date its funds become available if it was not scheduled yet.
+        """
+        now = timezone.now()
+        available_on = contribution.available_on
+        is_settled = available_on is not None and available_on <= now
+        deltas = defaultdict(Decimal)
+
+        unscheduled = RegistryLedgerEntry.objects.filter(
+            contribution=contribution, available_on__isnull=True, is_settled=False
+        )
+        if available_on is not None:
+            for entry in unscheduled:
+                sign = 1 if entry.entry_type == CREDIT else -1
+                deltas['available' if is_settled else 'pending'] += sign * entry.amount
+            unscheduled.update(available_on=available_on, is_settled=is_settled)
+
+        if fee_delta:
+            RegistryLedgerEntry.objects.create(
+                registry_id=self.balance.registry_id, entry_type=FEE, amount=fee_delta,
+                contribution=contribution, available_on=available_on, is_settled=is_settled,
+            )
+            deltas['fees'] += fee_delta
+            if is_settled:
+                deltas['available'] -= fee_delta
+            elif available_on is not None:
+                deltas['pending'] -= fee_delta
+        if deltas:
+            self._apply(**deltas)
+
+    def debit(self, withdrawal):
+        """
+        Records a withdrawal, which leaves the available balance immediately.
+        """
+        RegistryLedgerEntry.objects.create(
+            registry_id=self.balance.registry_id, entry_type=DEBIT, amount=withdrawal.amount,
+            withdrawal=withdrawal, available_on=withdrawal.created_at, is_settled=True,
+        )
+        self._apply(available=-withdrawal.amount, withdrawn=withdrawal.amount)
+
+    def settle(self, now=None):
+        """
+        Moves the registry's pending entries whose funds are now available into the available balance.
+        Returns the number of entries settled.
+        """
+        now = now or timezone.now()
+        due = RegistryLedgerEntry.objects.filter(
+            registry_id=self.balance.registry_id, is_settled=False, available_on__lte=now
+        )
+        totals = due.aggregate(
+            credits=Sum('amount', filter=Q(entry_type=CREDIT)),
+            fees=Sum('amount', filter=Q(entry_type=FEE)),
+        )
+        net = (totals['credits'] or Decimal('0.00')) - (totals['fees'] or Decimal('0.00'))
+        settled = due.update(is_settled=True)
+        if settled:
+            self._apply(available=net, pending=-net)
+        return settled
+
+    def checkpoint(self):
+        """
+        Verifies the running balance against the ledger entries and corrects any drift.
+        Returns a dict of the fields that drifted, mapped to their (stored, actual) values.
+        """
+        totals = totals_from_entries(RegistryLedgerEntry.objects.filter(registry_id=self.balance.registry_id))
+        drift = {
+            field: (getattr(self.balance, field), value)
+            for field, value in totals.items()
+            if getattr(self.balance, field) != value
+        }
+        for field, value in totals.items():
+            setattr(self.balance, field, value)
+        self.balance.checkpointed_at = timezone.now()
+        self.balance.save()
+        if drift:
+            logger.warning(f"Ledger balance of registry {self.balance.registry_id} drifted: {drift}")
+        return drift
+
+    @classmethod
+    def settle_due(cls, now=None, checkpoint=False):
+        """
+        Settles the due entries of every registry, one registry per transaction.
+        With `checkpoint`, every ledger is also verified against its entries.
+        Returns the number of entries settled and the IDs of registries whose balance drifted.
+        """
+        now = now or timezone.now()
+        registry_ids = set(
+            RegistryLedgerEntry.objects.filter(is_settled=False, available_on__lte=now)
+            .values_list('registry_id', flat=True).distinct()
+        )
+        if checkpoint:
+            registry_ids.update(RegistryLedgerBalance.objects.values_list('registry_id', flat=True))
+
+        settled, drifted = 0, []
+        for registry_id in sorted(registry_ids):
+            with transaction.atomic():
+                ledger = cls.lock(registry_id)
+                settled += ledger.settle(now)
+                if checkpoint and ledger.checkpoint():
+                    drifted.append(registry_id)
+        return settled, drifted
@@ -0,0 +1,107 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count, Sum
+from accounts.models import OTPRequest
+from notifications.models import Notification, UserNotification
+from registries import benchmarks
+from registries.models import Contribution, Registry, Service, SharedRegistry, Withdrawal
+from registries.reconciler import ContributionReconciler
+
+
+HOT_QUERY_INDEXES = [
+    (Contribution, 'contribution_succeeded_idx'),
+    (Contribution, 'contribution_unenriched_idx'),
+    (Withdrawal, 'withdrawal_registry_status_idx'),
+    (UserNotification, 'user_notification_unread_idx'),
+    (OTPRequest, 'otp_request_lookup_idx'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds benchmark contributions, withdrawals, notifications and OTP requests and prints the "
+        "EXPLAIN ANALYZE plans of the hot financial and notification queries, without and with "
+        "their supporting indexes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--registries', type=int, default=5000)
+        parser.add_argument('--services-per-registry', type=int, default=10)
+        parser.add_argument('--contributions-per-service', type=int, default=8)
+        parser.add_argument('--withdrawals-per-registry', type=int, default=6)
+        parser.add_argument('--notification-users', type=int, default=100)
+        parser.add_argument('--notifications-per-user', type=int, default=30)
+        parser.add_argument('--otp-refs', type=int, default=20000)
+        parser.add_argument('--otp-requests-per-ref', type=int, default=5)
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded data afterwards.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("This benchmark requires PostgreSQL.")
+
+        self.stdout.write("Seeding benchmark data...")
+        viewers, registries = benchmarks.seed_registries(
+            options['registries'], options['services_per_registry'], shares_per_registry=0,
+            viewers=options['notification_users'],
+        )
+        try:
+            services = list(Service.objects.filter(registry__in=registries))
+            benchmarks.seed_contributions(services, options['contributions_per_service'])
+            benchmarks.seed_withdrawals(registries, options['withdrawals_per_registry'])
+            benchmarks.seed_notifications(viewers, options['notifications_per_user'])
+            benchmarks.seed_otp_requests(options['otp_refs'], options['otp_requests_per_ref'])
+            benchmarks.vacuum_analyze(
+                Registry, Service, SharedRegistry, Contribution, Withdrawal,
+                Notification, UserNotification, OTPRequest,
+            )
+
+            queries = self.hot_queries(registries, services, viewers)
+            with benchmarks.without_indexes(*HOT_QUERY_INDEXES):
+                for title, queryset in queries:
+                    benchmarks.write_plan(self.stdout, f"{title} (without indexes)", queryset)
+            for title, queryset in queries:
+                benchmarks.write_plan(self.stdout, f"{title} (with indexes)", queryset)
+        finally:
+            if not options['keep']:
+                benchmarks.remove_benchmark_data()
+
+    @staticmethod
+    def hot_queries(registries, services, viewers):
+        """
+        Returns the titled querysets of the hot queries, with the filters the application uses.
+        """
+        registry = registries[len(registries) // 2]
+        service_batch = services[len(services) // 2:len(services) // 2 + 500]
+        otp_ref = f"{benchmarks.BENCHMARK_REF_PREFIX}{len(registries) // 2}"
+        return [
+            (
+                "Service totals of a batch of services",
+                Contribution.objects.filter(service__in=service_batch, status='succeeded')
+                .values('service')
+                .annotate(amount=Sum('amount'), fee=Sum('fee'), count=Count('id')),
+            ),
+            (
+                "Contribution totals of a registry",
+                Contribution.objects.filter(service__registry=registry, status='succeeded')
+                .values('service__registry')
+                .annotate(amount=Sum('amount'), fee=Sum('fee')),
+            ),
+            (
+                "Enrichment backlog batch",
+                ContributionReconciler.pending_contributions().filter(id__gt=0)[:50],
+            ),
+            (
+                "Withdrawn total of a registry",
+                Withdrawal.objects.filter(registry=registry, status__in=('pending', 'succeeded'))
+                .values('registry')
+                .annotate(total=Sum('amount')),
+            ),
+            (
+                "Unread notifications of a user",
+                UserNotification.objects.filter(user=viewers[0], is_read=False).order_by('-created_at'),
+            ),
+            (
+                "Latest OTP request for a ref and code",
+                OTPRequest.objects.filter(ref=otp_ref, otp='100003').order_by('-created_at')[:1],
+            ),
+        ]
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from registries import benchmarks
+from registries.models import Registry, Service, SharedRegistry
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds benchmark services and prints the EXPLAIN ANALYZE plans of the service visibility "
+        "filter, comparing the former OR-join with DISTINCT against the union of registry IDs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--services', type=int, default=100000, help="Total number of services to seed.")
+        parser.add_argument('--services-per-registry', type=int, default=20)
+        parser.add_argument('--shares-per-registry', type=int, default=10)
+        parser.add_argument('--viewers', type=int, default=5000, help="Number of users registries are shared with.")
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded data afterwards.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("This benchmark requires PostgreSQL.")
+
+        registries = max(options['services'] // options['services_per_registry'], 1)
+        self.stdout.write(f"Seeding {registries} registries with {options['services_per_registry']} services each...")
+        viewers, _ = benchmarks.seed_registries(
+            registries, options['services_per_registry'], options['shares_per_registry'], options['viewers'],
+        )
+        try:
+            benchmarks.vacuum_analyze(Registry, Service, SharedRegistry)
+            viewer = viewers[0]
+            previous = Service.objects.filter(
+                Q(registry__created_by=viewer) | Q(registry__shared_registry__shared_with=viewer)
+            ).distinct()
+            benchmarks.write_plan(self.stdout, "OR-join with DISTINCT (previous)", previous)
+            benchmarks.write_plan(self.stdout, "Union of owned and shared registry IDs", Service.objects.visible_to(viewer))
+        finally:
+            if not options['keep']:
+                benchmarks.remove_benchmark_data()
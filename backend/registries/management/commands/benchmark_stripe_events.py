@@ -0,0 +1,141 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from registries import benchmarks
+from registries.models import Contribution, Service, StripeEvent
+from registries.webhooks import StripeEventProcessor, store_event
+import copy
+import json
+import multiprocessing
+import time
+
+
+def drain_until_idle(batch_size):
+    """
+    Processes due events on a single worker until it finds none it can take.
+    Runs in a forked worker process.
+    """
+    processor, processed = StripeEventProcessor(workers=1, batch_size=batch_size), 0
+    while batch := processor.drain():
+        processed += batch
+    return processed
+
+
+class Command(BaseCommand):
+    help = (
+        "Replays a burst of Stripe payment events through the webhook store and the partitioned "
+        "event processor with different numbers of worker processes, and prints the throughput of each."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payment-intents', type=int, default=2000, help="Number of payments in a generated burst.")
+        parser.add_argument('--registries', type=int, default=200)
+        parser.add_argument('--services-per-registry', type=int, default=5)
+        parser.add_argument('--workers', default='1,2,4,8', help="Comma-separated worker process counts to compare.")
+        parser.add_argument(
+            '--file',
+            help="Replay a recorded burst instead: a file of Stripe event payloads, one JSON object per line. "
+                 "PaymentIntent metadata is pointed at the benchmark services.",
+        )
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded data afterwards.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("This benchmark requires PostgreSQL.")
+        workers = [int(count) for count in options['workers'].split(',')]
+
+        self.stdout.write("Seeding benchmark registries...")
+        _, registries = benchmarks.seed_registries(
+            options['registries'], options['services_per_registry'], shares_per_registry=0, viewers=1,
+        )
+        try:
+            services = list(Service.objects.filter(registry__in=registries))
+            if options['file']:
+                burst = self.load_burst(options['file'], services)
+            else:
+                burst = benchmarks.payment_burst(services, options['payment_intents'])
+            self.stdout.write(f"Replaying a burst of {len(burst)} events.")
+
+            for run, count in enumerate(workers):
+                payloads = self.relabel(burst, run)
+                started = time.perf_counter()
+                for payload in payloads:
+                    store_event(payload)
+                stored = time.perf_counter() - started
+
+                started = time.perf_counter()
+                self.process(count)
+                processed = time.perf_counter() - started
+
+                events = StripeEvent.objects.filter(event_id__in=[payload['id'] for payload in payloads])
+                pending = events.exclude(status=StripeEvent.SUCCEEDED).count()
+                out_of_order = self.out_of_order(events)
+                contributions = Contribution.objects.filter(
+                    stripe_payment_intent_id__endswith=f"-run{run}", service__in=services
+                ).count()
+                self.stdout.write(
+                    f"{count} workers: stored {len(payloads)} events in {stored:.2f}s "
+                    f"({len(payloads) / stored:.0f}/s), processed them in {processed:.2f}s "
+                    f"({len(payloads) / processed:.0f}/s); {contributions} contributions, "
+                    f"{pending} events not processed, {out_of_order} processed out of order."
+                )
+        finally:
+            if not options['keep']:
+                benchmarks.remove_benchmark_data()
+
+    @staticmethod
+    def process(workers, batch_size=500):
+        """
+        Processes the due events with the given number of forked worker processes, as if that
+        many `process_stripe_events` commands were running, until none are left.
+        """
+        # Forked processes must not share the parent's database connections.
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            while sum(pool.map(drain_until_idle, [batch_size] * workers)):
+                pass
+
+    @staticmethod
+    def out_of_order(events):
+        """
+        Counts the events processed before an event Stripe created earlier for the same PaymentIntent.
+        """
+        count, last_processed = 0, {}
+        for key, processed_at in events.order_by('partition_key', 'stripe_created_at', 'id').values_list(
+            'partition_key', 'processed_at'
+        ):
+            if key in last_processed and processed_at < last_processed[key]:
+                count += 1
+            last_processed[key] = processed_at
+        return count
+
+    @staticmethod
+    def load_burst(path, services):
+        """
+        Reads recorded event payloads and points their PaymentIntents at the benchmark services.
+        """
+        burst = []
+        with open(path) as recorded:
+            for position, line in enumerate(line for line in recorded if line.strip()):
+                payload = json.loads(line)
+                obj = payload['data']['object']
+                if obj.get('object') == 'payment_intent':
+                    obj.setdefault('metadata', {})['service_id'] = str(services[position % len(services)].id)
+                burst.append(payload)
+        return burst
+
+    @staticmethod
+    def relabel(burst, run):
+        """
+        Gives the burst's events, PaymentIntents and charges IDs unique to the run, so every
+        run starts from the same state, and marks the events as benchmark data.
+        """
+        payloads = []
+        for payload in burst:
+            payload = copy.deepcopy(payload)
+            payload['id'] = f"{benchmarks.BENCHMARK_EVENT_PREFIX}{payload['id']}-run{run}"
+            obj = payload['data']['object']
+            for field in ('id', 'payment_intent', 'charge'):
+                if isinstance(obj.get(field), str):
+                    obj[field] = f"{obj[field]}-run{run}"
+            payloads.append(payload)
+        return payloads
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from registries.reservations import release_expired
+from registries.webhooks import StripeEventProcessor
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Processes the stored Stripe webhook events that are due, retrying failed ones with backoff, "
+        "and cancels the checkouts whose funding reservations expired."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help="Number of worker threads.")
+        parser.add_argument('--batch-size', type=int, default=100, help="Maximum events per worker thread per run.")
+        parser.add_argument('--loop', action='store_true', help="Keep running, sleeping between runs.")
+        parser.add_argument('--interval', type=int, default=2, help="Seconds to sleep between runs with --loop.")
+
+    def handle(self, *args, **options):
+        processor = StripeEventProcessor(workers=options['workers'], batch_size=options['batch_size'])
+        while True:
+            processed = processor.run()
+            released = release_expired()
+            if processed or released or not options['loop']:
+                self.stdout.write(f"Processed {processed} Stripe events, released {released} expired reservations.")
+            if not options['loop']:
+                break
+            if not processed:
+                time.sleep(options['interval'])
@@ -0,0 +1,72 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from registries.models import Contribution, FundingReservation, Service
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the denormalized funding counters of services from their contributions and held "
+        "funding reservations, and reports drift."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Number of services per batch.")
+        parser.add_argument('--dry-run', action='store_true', help="Report drift without fixing it.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = drifted = 0
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                # Lock the batch so concurrent counter updates wait for the rebuild instead of being overwritten.
+                services = list(
+                    Service.objects.select_for_update().filter(id__gt=last_id).order_by('id')[:batch_size]
+                )
+                if not services:
+                    break
+                last_id = services[-1].id
+                totals = {
+                    total['service']: total
+                    for total in Contribution.objects.filter(service__in=services, status='succeeded')
+                    .values('service')
+                    .annotate(amount=Sum('amount'), fee=Sum('fee'), count=Count('id'))
+                }
+                reserved = {
+                    total['service']: total['amount']
+                    for total in FundingReservation.objects.filter(service__in=services, status=FundingReservation.HELD)
+                    .values('service')
+                    .annotate(amount=Sum('amount'))
+                }
+
+                to_update = []
+                for service in services:
+                    total = totals.get(service.id, {})
+                    expected = (
+                        total.get('amount') or Decimal('0.00'),
+                        total.get('fee') or Decimal('0.00'),
+                        total.get('count', 0),
+                        reserved.get(service.id) or Decimal('0.00'),
+                    )
+                    actual = (service.contributed_total, service.fee_total, service.contribution_count, service.reserved_total)
+                    if actual == expected:
+                        continue
+                    drifted += 1
+                    self.stdout.write(
+                        f"Service {service.id}: stored (total={actual[0]}, fees={actual[1]}, count={actual[2]}, "
+                        f"reserved={actual[3]}), actual (total={expected[0]}, fees={expected[1]}, "
+                        f"count={expected[2]}, reserved={expected[3]})"
+                    )
+                    service.contributed_total, service.fee_total, service.contribution_count, service.reserved_total = expected
+                    to_update.append(service)
+
+                if to_update and not options['dry_run']:
+                    Service.objects.bulk_update(
+                        to_update, ['contributed_total', 'fee_total', 'contribution_count', 'reserved_total']
+                    )
+            checked += len(services)
+
+        action = "found" if options['dry_run'] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"Checked {checked} services, {action} drift in {drifted}."))
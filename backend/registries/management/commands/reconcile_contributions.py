@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from registries.reconciler import BalanceTransactionSync, ContributionReconciler
+from registries.stripe_gateway import get_stripe_gateway
+import time
+
+
+class Command(BaseCommand):
+    help = "Fills in Stripe fee and availability data for contributions that do not have it yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--strategy', choices=['sync', 'lookup'], default='sync',
+            help="'sync' pages through Stripe balance transactions from a stored cursor; "
+                 "'lookup' retrieves each pending contribution's transaction individually.",
+        )
+        parser.add_argument('--batch-size', type=int, default=50, help="Number of contributions per lookup batch.")
+        parser.add_argument('--loop', action='store_true', help="Keep running, sleeping between runs.")
+        parser.add_argument('--interval', type=int, default=60, help="Seconds to sleep between runs with --loop.")
+        parser.add_argument('--fake-stripe', action='store_true', help="Use the offline fake Stripe gateway.")
+
+    def handle(self, *args, **options):
+        gateway = get_stripe_gateway(fake=options['fake_stripe'] or None)
+        if options['strategy'] == 'sync':
+            reconciler = BalanceTransactionSync(gateway=gateway)
+        else:
+            reconciler = ContributionReconciler(gateway=gateway, batch_size=options['batch_size'])
+        while True:
+            state = reconciler.run()
+            self.stdout.write(
+                f"[{reconciler.name}] Processed {state.processed_count} records: "
+                f"{state.updated_count} contributions updated, {state.failed_count} failed."
+            )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+from django.utils import timezone
+from registries.webhooks import StripeEventProcessor
+
+
+class Command(BaseCommand):
+    help = (
+        "Queues the stored Stripe events created in a time range for processing again. "
+        "Event handlers are idempotent, so events that were already handled change nothing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', required=True, help="Start of the range, as an ISO 8601 date and time.")
+        parser.add_argument('--until', help="End of the range (exclusive), as an ISO 8601 date and time.")
+        parser.add_argument('--type', dest='event_type', help="Only replay events of this type.")
+        parser.add_argument('--process', action='store_true', help="Process the queued events right away.")
+
+    def handle(self, *args, **options):
+        since = self.parse(options['since'])
+        until = self.parse(options['until']) if options['until'] else None
+        queued = StripeEventProcessor.replay(since, until, options['event_type'])
+        self.stdout.write(f"Queued {queued} Stripe events for processing.")
+        if options['process']:
+            processor, processed = StripeEventProcessor(), 0
+            while batch := processor.run():
+                processed += batch
+            self.stdout.write(f"Processed {processed} Stripe events.")
+
+    @staticmethod
+    def parse(value):
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise CommandError(f"Invalid date and time: {value}")
+        return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
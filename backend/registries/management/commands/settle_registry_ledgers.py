@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from registries.balance import RegistryBalance
+from registries.ledger import RegistryLedger
+from registries.models import RegistryLedgerBalance
+import time
+
+
+class Command(BaseCommand):
+    help = "Moves pending registry ledger credits whose funds are now available into the available balance."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkpoint', action='store_true',
+                            help="Also verify every running balance against its ledger entries and correct drift.")
+        parser.add_argument('--verify-sources', action='store_true',
+                            help="Compare every ledger balance with a recomputation from contributions and withdrawals.")
+        parser.add_argument('--loop', action='store_true', help="Keep running, sleeping between runs.")
+        parser.add_argument('--interval', type=int, default=60, help="Seconds to sleep between runs with --loop.")
+
+    def handle(self, *args, **options):
+        while True:
+            settled, drifted = RegistryLedger.settle_due(checkpoint=options['checkpoint'])
+            self.stdout.write(f"Settled {settled} ledger entries.")
+            if drifted:
+                self.stdout.write(self.style.WARNING(f"Corrected drifted balances of registries: {drifted}"))
+            if options['verify_sources']:
+                self.verify_sources()
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
+
+    def verify_sources(self):
+        mismatched = 0
+        for balance in RegistryLedgerBalance.objects.select_related('registry').iterator():
+            expected = RegistryBalance.from_transactions(balance.registry)
+            fields = ('available', 'pending', 'fees', 'withdrawn')
+            if any(getattr(balance, field) != getattr(expected, field) for field in fields):
+                mismatched += 1
+                self.stdout.write(self.style.WARNING(
+                    f"Registry {balance.registry_id}: ledger has {balance.available} available, "
+                    f"{balance.pending} pending; transactions give {expected!r}"
+                ))
+        self.stdout.write(f"{mismatched} ledger balances differ from their transactions.")
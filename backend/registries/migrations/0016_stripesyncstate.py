@@ -0,0 +1,30 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0015_add_new_default_services'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(help_text='The name of the sync job.', max_length=100, unique=True, verbose_name='Name')),
+                ('cursor', models.BigIntegerField(blank=True, help_text='The position the job resumes from on its next batch.', null=True, verbose_name='Cursor')),
+                ('processed_count', models.PositiveIntegerField(default=0, help_text='The number of records processed during the last run.', verbose_name='Processed Count')),
+                ('updated_count', models.PositiveIntegerField(default=0, help_text='The number of records updated during the last run.', verbose_name='Updated Count')),
+                ('failed_count', models.PositiveIntegerField(default=0, help_text='The number of records that failed during the last run.', verbose_name='Failed Count')),
+                ('last_error', models.TextField(blank=True, help_text='The last error raised while processing a record.', verbose_name='Last Error')),
+                ('last_run_at', models.DateTimeField(blank=True, help_text='The date and time when the job last ran.', null=True, verbose_name='Last Run At')),
+            ],
+            options={
+                'verbose_name': 'Stripe Sync State',
+                'verbose_name_plural': 'Stripe Sync States',
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:36
+
+from decimal import Decimal
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def populate_funding_counters(apps, schema_editor):
+    """
+    Fills the new funding counters from the existing successful contributions.
+    """
+    Service = apps.get_model('registries', 'Service')
+    Contribution = apps.get_model('registries', 'Contribution')
+    db_alias = schema_editor.connection.alias
+
+    totals = (
+        Contribution.objects.using(db_alias)
+        .filter(status='succeeded', service__isnull=False)
+        .values('service')
+        .annotate(amount=Sum('amount'), fee=Sum('fee'), count=Count('id'))
+    )
+    for total in totals.iterator():
+        Service.objects.using(db_alias).filter(pk=total['service']).update(
+            contributed_total=total['amount'] or Decimal('0.00'),
+            fee_total=total['fee'] or Decimal('0.00'),
+            contribution_count=total['count'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0016_stripesyncstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='contributed_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='The total of successful contributions, maintained as contributions are recorded.', max_digits=10, verbose_name='Contributed Total'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='contribution_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='The number of successful contributions.', verbose_name='Contribution Count'),
+        ),
+        migrations.AddField(
+            model_name='service',
+            name='fee_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='The total processing fees of successful contributions.', max_digits=10, verbose_name='Fee Total'),
+        ),
+        migrations.RunPython(populate_funding_counters, migrations.RunPython.noop),
+    ]
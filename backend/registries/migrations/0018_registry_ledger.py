@@ -0,0 +1,52 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:38
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0017_service_funding_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistryLedgerBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('available', models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Settled credits minus settled fees and withdrawals.', max_digits=12, verbose_name='Available')),
+                ('pending', models.DecimalField(decimal_places=2, default=Decimal('0.00'), help_text='Scheduled credits minus their fees that are not available yet.', max_digits=12, verbose_name='Pending')),
+                ('fees', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Fees')),
+                ('withdrawn', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12, verbose_name='Withdrawn')),
+                ('checkpointed_at', models.DateTimeField(blank=True, help_text='The last time the balance was verified against the ledger entries.', null=True, verbose_name='Checkpointed At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+                ('registry', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_balance', to='registries.registry', verbose_name='Registry')),
+            ],
+            options={
+                'verbose_name': 'Registry Ledger Balance',
+                'verbose_name_plural': 'Registry Ledger Balances',
+            },
+        ),
+        migrations.CreateModel(
+            name='RegistryLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('entry_type', models.CharField(choices=[('credit', 'Credit'), ('fee', 'Fee'), ('debit', 'Debit')], max_length=10, verbose_name='Entry Type')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Amount')),
+                ('available_on', models.DateTimeField(blank=True, help_text="When the entry's funds become available. Empty until Stripe reports it.", null=True, verbose_name='Available On')),
+                ('is_settled', models.BooleanField(default=False, help_text='Indicates if the entry counts towards the available balance.', verbose_name='Is Settled')),
+                ('contribution', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='registries.contribution', verbose_name='Contribution')),
+                ('registry', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='registries.registry', verbose_name='Registry')),
+                ('withdrawal', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='registries.withdrawal', verbose_name='Withdrawal')),
+            ],
+            options={
+                'verbose_name': 'Registry Ledger Entry',
+                'verbose_name_plural': 'Registry Ledger Entries',
+                'indexes': [models.Index(fields=['is_settled', 'available_on'], name='ledger_entry_settlement_idx')],
+            },
+        ),
+    ]
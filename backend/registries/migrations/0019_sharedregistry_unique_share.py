@@ -0,0 +1,38 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:39
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_shares(apps, schema_editor):
+    """
+    Keeps the earliest share of each registry per user, so the unique constraint can be added.
+    """
+    SharedRegistry = apps.get_model('registries', 'SharedRegistry')
+    db_alias = schema_editor.connection.alias
+
+    duplicates = (
+        SharedRegistry.objects.using(db_alias)
+        .values('shared_with', 'registry')
+        .annotate(first_id=Min('id'), count=Count('id'))
+        .filter(count__gt=1)
+    )
+    for duplicate in duplicates:
+        SharedRegistry.objects.using(db_alias).filter(
+            shared_with=duplicate['shared_with'], registry=duplicate['registry']
+        ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0018_registry_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_shares, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='sharedregistry',
+            constraint=models.UniqueConstraint(fields=('shared_with', 'registry'), name='unique_shared_registry_per_user'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0019_sharedregistry_unique_share'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contribution',
+            index=models.Index(condition=models.Q(('status', 'succeeded')), fields=['service', 'available_on'], include=('amount', 'fee'), name='contribution_succeeded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='contribution',
+            index=models.Index(condition=models.Q(('available_on__isnull', True), ('status', 'succeeded'), ('stripe_payment_intent_id__isnull', False)), fields=['id'], name='contribution_unenriched_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='withdrawal',
+            index=models.Index(fields=['registry', 'status'], include=('amount',), name='withdrawal_registry_status_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0020_contribution_withdrawal_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contribution',
+            index=models.Index(fields=['service', 'created_at', 'id'], name='contribution_keyset_idx'),
+        ),
+    ]
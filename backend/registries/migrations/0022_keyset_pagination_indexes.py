@@ -0,0 +1,21 @@
+# Generated by Django 4.2.13 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0021_contribution_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='registry',
+            index=models.Index(fields=['created_by', 'created_at', 'id'], name='registry_owner_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sharedregistry',
+            index=models.Index(fields=['shared_with', 'created_at', 'id'], name='shared_registry_keyset_idx'),
+        ),
+    ]
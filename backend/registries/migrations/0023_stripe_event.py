@@ -0,0 +1,35 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0022_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StripeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('event_id', models.CharField(help_text='The ID Stripe assigned to the event.', max_length=255, unique=True, verbose_name='Event ID')),
+                ('event_type', models.CharField(help_text='The Stripe event type, e.g. payment_intent.succeeded.', max_length=100, verbose_name='Event Type')),
+                ('payload', models.JSONField(help_text='The event exactly as Stripe sent it.', verbose_name='Payload')),
+                ('stripe_created_at', models.DateTimeField(help_text='The date and time when Stripe created the event.', verbose_name='Stripe Created At')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='pending', max_length=10, verbose_name='Status')),
+                ('attempts', models.PositiveIntegerField(default=0, help_text='The number of times processing the event was attempted.', verbose_name='Attempts')),
+                ('next_attempt_at', models.DateTimeField(blank=True, help_text='The earliest date and time the event is processed again.', null=True, verbose_name='Next Attempt At')),
+                ('last_error', models.TextField(blank=True, help_text='The error raised by the last failed attempt.', verbose_name='Last Error')),
+                ('processed_at', models.DateTimeField(blank=True, help_text='The date and time when the event was processed successfully.', null=True, verbose_name='Processed At')),
+            ],
+            options={
+                'verbose_name': 'Stripe Event',
+                'verbose_name_plural': 'Stripe Events',
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['next_attempt_at', 'id'], name='stripe_event_due_idx'), models.Index(fields=['stripe_created_at'], name='stripe_event_created_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:20
+
+from django.db import migrations, models
+import zlib
+
+
+def partition_key(payload):
+    # A copy of registries.webhooks.partition_key as of this migration.
+    obj = payload['data']['object']
+    for field in ('payment_intent', 'charge'):
+        if obj.get('object') == field:
+            return obj['id']
+        related = obj.get(field)
+        if isinstance(related, dict):
+            related = related.get('id')
+        if related:
+            return related
+    return payload['id']
+
+
+def lane_of(key):
+    return zlib.crc32(key.encode()) % 64
+
+
+def populate_partitions(apps, schema_editor):
+    """
+    Assigns the stored events their partition key and lane, as new events get them when stored.
+    """
+    StripeEvent = apps.get_model('registries', 'StripeEvent')
+    db_alias = schema_editor.connection.alias
+
+    events = list(StripeEvent.objects.using(db_alias).only('id', 'payload'))
+    for event in events:
+        event.partition_key = partition_key(event.payload)
+        event.lane = lane_of(event.partition_key)
+    StripeEvent.objects.using(db_alias).bulk_update(events, ['partition_key', 'lane'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0023_stripe_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stripeevent',
+            name='partition_key',
+            field=models.CharField(default='', help_text='The PaymentIntent or charge the event is about, or the event ID for other events.', max_length=255, verbose_name='Partition Key'),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='stripeevent',
+            name='lane',
+            field=models.PositiveSmallIntegerField(default=0, help_text='The worker lane of the partition key; a lane is processed by one worker at a time.', verbose_name='Lane'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_partitions, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='stripeevent',
+            name='stripe_event_due_idx',
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['lane', 'stripe_created_at', 'id'], name='stripe_event_lane_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stripeevent',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['partition_key', 'stripe_created_at'], name='stripe_event_partition_idx'),
+        ),
+    ]
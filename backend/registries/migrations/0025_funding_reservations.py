@@ -0,0 +1,38 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:19
+
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0024_stripe_event_lanes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='reserved_total',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), editable=False, help_text='The total of funding reservations held for checkouts in progress.', max_digits=10, verbose_name='Reserved Total'),
+        ),
+        migrations.CreateModel(
+            name='FundingReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Amount')),
+                ('stripe_payment_intent_id', models.CharField(blank=True, help_text='The PaymentIntent paying for the reservation, once it has been created.', max_length=255, null=True, unique=True, verbose_name='Stripe Payment Intent ID')),
+                ('status', models.CharField(choices=[('held', 'Held'), ('converted', 'Converted'), ('released', 'Released')], default='held', max_length=10, verbose_name='Status')),
+                ('expires_at', models.DateTimeField(help_text='The date and time when a held reservation is released.', verbose_name='Expires At')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='registries.service', verbose_name='Service')),
+            ],
+            options={
+                'verbose_name': 'Funding Reservation',
+                'verbose_name_plural': 'Funding Reservations',
+                'indexes': [models.Index(condition=models.Q(('status', 'held')), fields=['service', 'expires_at'], name='reservation_held_idx'), models.Index(condition=models.Q(('status', 'held')), fields=['expires_at'], name='reservation_expiry_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.13 on 2026-10-18 15:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registries', '0025_funding_reservations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='contribution',
+            name='stripe_payment_intent_id',
+            field=models.CharField(blank=True, help_text='The PaymentIntent that paid for the contribution. A cart checkout pays for several services with one PaymentIntent.', max_length=255, null=True, verbose_name='Stripe Payment Intent ID'),
+        ),
+        migrations.AlterField(
+            model_name='fundingreservation',
+            name='stripe_payment_intent_id',
+            field=models.CharField(blank=True, help_text='The PaymentIntent paying for the reservation, once it has been created.', max_length=255, null=True, verbose_name='Stripe Payment Intent ID'),
+        ),
+        migrations.AddConstraint(
+            model_name='contribution',
+            constraint=models.UniqueConstraint(fields=('stripe_payment_intent_id', 'service'), name='contribution_payment_intent_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='fundingreservation',
+            constraint=models.UniqueConstraint(fields=('stripe_payment_intent_id', 'service'), name='reservation_payment_intent_uniq'),
+        ),
+    ]
@@ -1,4 +1,6 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from decimal import Decimal
 from django.contrib.auth import get_user_model
@@ -16,6 +18,47 @@ def generate_shareable_id():
     return str(uuid.uuid4())
 
 
+class RegistryQuerySet(models.QuerySet):
+    """
+    Custom queryset for the Registry model.
+    """
+
+    def with_progress(self):
+        """
+        Annotates each registry with its number of services and its funding progress.
+        The totals are summed from the services' denormalized counters in one grouped query.
+        """
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        zero = models.Value(Decimal('0.00'), output_field=money)
+        return self.annotate(
+            annotated_services_count=models.Count('services'),
+            annotated_total_cost=Coalesce(
+                models.Sum(models.F('services__hours') * models.F('services__cost_per_hour'), output_field=money),
+                zero,
+            ),
+            annotated_total_contributions=Coalesce(
+                models.Sum('services__contributed_total', output_field=money),
+                zero,
+            ),
+        )
+
+    def create_with_services(self, services=(), **fields):
+        """
+        Creates a registry and its services in one transaction, inserting the services in bulk.
+        `services` is a list of dicts of Service fields. The services are then prefetched with
+        their financial annotations in one query, so the registry can be serialized right away.
+        """
+        with transaction.atomic(using=self.db):
+            registry = self.create(**fields)
+            Service.objects.using(self.db).bulk_create(
+                [Service(registry=registry, **service) for service in services]
+            )
+        models.prefetch_related_objects(
+            [registry], models.Prefetch('services', queryset=Service.objects.using(self.db).with_financials()),
+        )
+        return registry
+
+
 class Registry(models.Model):
     """
     Represents a registry for a new mother, containing details about the services she needs.
@@ -77,14 +120,96 @@ class Registry(models.Model):
         help_text=_("The date and time when the registry was last updated."),
     )
 
+    objects = RegistryQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Registry"
         verbose_name_plural = "Registries"
+        indexes = [
+            models.Index(fields=['created_by', 'created_at', 'id'], name='registry_owner_keyset_idx'),
+        ]
+
+    @cached_property
+    def balance(self):
+        """
+        The financial summary of the registry.
+        It is computed once per instance, so all readers within a request share it.
+        """
+        from .balance import RegistryBalance
+        return RegistryBalance.for_registry(self)
     
     def __str__(self):
         return f"{self.name} - {self.shareable_id}"
 
 
+class ServiceQuerySet(models.QuerySet):
+    """
+    Custom queryset for the Service model.
+    """
+
+    def with_financials(self):
+        """
+        Annotates each service with its contribution totals and funding state.
+        The totals come from the denormalized counters on the service row, so the
+        annotations are plain column expressions that can be filtered and ordered on.
+        """
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        ratio = models.DecimalField(max_digits=12, decimal_places=4)
+        total_cost = models.ExpressionWrapper(models.F('hours') * models.F('cost_per_hour'), output_field=money)
+        return self.annotate(
+            annotated_total_contributions=models.F('contributed_total'),
+            annotated_total_fees=models.F('fee_total'),
+            annotated_withdrawable_amount=models.ExpressionWrapper(
+                models.F('contributed_total') - models.F('fee_total'),
+                output_field=money,
+            ),
+            annotated_is_completed=models.Case(
+                models.When(
+                    models.Q(is_active=True, contributed_total__gte=total_cost),
+                    then=models.Value(True),
+                ),
+                default=models.Value(False),
+                output_field=models.BooleanField(),
+            ),
+        ).annotate(
+            annotated_is_available=models.ExpressionWrapper(
+                models.Q(is_active=True, annotated_is_completed=False),
+                output_field=models.BooleanField(),
+            ),
+            # The funded ratio, contributions / (hours * cost_per_hour). A service without
+            # cost counts as fully funded, as it does for is_completed().
+            annotated_progress=models.Case(
+                models.When(
+                    models.Q(hours__gt=0, cost_per_hour__gt=0),
+                    then=models.ExpressionWrapper(models.F('contributed_total') / total_cost, output_field=ratio),
+                ),
+                default=models.Value(Decimal('1'), output_field=ratio),
+                output_field=ratio,
+            ),
+        )
+
+    def visible_to(self, user):
+        """
+        Filters services to those in registries the user owns or that are shared with them.
+        The registry IDs are the union of an owner lookup and an index-only scan of the
+        (shared_with, registry) unique index, so services are reached through their registry
+        index, are never multiplied by their shares and need no DISTINCT.
+        """
+        owned = Registry.objects.filter(created_by=user).values('id')
+        shared = SharedRegistry.objects.filter(shared_with=user).values('registry_id')
+        return self.filter(registry__in=owned.union(shared))
+
+    def adjust_totals(self, service_id, amount=Decimal('0.00'), fee=Decimal('0.00'), count=0):
+        """
+        Atomically adds the given deltas to a service's funding counters.
+        """
+        return self.filter(pk=service_id).update(
+            contributed_total=models.F('contributed_total') + amount,
+            fee_total=models.F('fee_total') + fee,
+            contribution_count=models.F('contribution_count') + count,
+        )
+
+
 class Service(models.Model):
     """
     Represents a service that can be requested in the registry.
@@ -135,6 +260,36 @@ class Service(models.Model):
         verbose_name=_("Total Withdrawn"),
         help_text=_("The total amount withdrawn for this service."),
     )
+    contributed_total = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name=_("Contributed Total"),
+        help_text=_("The total of successful contributions, maintained as contributions are recorded."),
+    )
+    fee_total = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name=_("Fee Total"),
+        help_text=_("The total processing fees of successful contributions."),
+    )
+    contribution_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name=_("Contribution Count"),
+        help_text=_("The number of successful contributions."),
+    )
+    reserved_total = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        editable=False,
+        verbose_name=_("Reserved Total"),
+        help_text=_("The total of funding reservations held for checkouts in progress."),
+    )
     created_at = models.DateTimeField(
         auto_now_add=True,
         verbose_name=_("Created At"),
@@ -151,6 +306,8 @@ class Service(models.Model):
     #     help_text=_("Indicates if the service has been cashed out."),
     # )
 
+    objects = ServiceQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Service"
         verbose_name_plural = "Services"
@@ -163,21 +320,17 @@ class Service(models.Model):
     
     def total_contributions(self):
         """
-        Calculates the total contributions made towards this service.
-        This can be overridden in subclasses to implement custom contribution logic.
+        Returns the total contributions made towards this service.
+        This reads the denormalized counter, so it does not query the contributions table.
         """
-        # The related_name is 'contributions', so self.contributions will always exist.
-        # We filter for successful payments to get the total.
-        total = self.contributions.filter(status='succeeded').aggregate(total=models.Sum('amount'))['total']
-        return total or Decimal('0.00')
+        return self.contributed_total
     
     def available_withdrawable_amount(self):
         """
         Calculates the available amount that can be withdrawn for this service.
         This is the net total of contributions for this service.
         """
-        total_fees = self.contributions.filter(status='succeeded').aggregate(total_fee=models.Sum('fee'))['total_fee'] or Decimal('0.00')
-        return self.total_contributions() - total_fees
+        return self.contributed_total - self.fee_total
     
     def is_completed(self):
         """
@@ -198,7 +351,7 @@ class Service(models.Model):
         Checks if the service is owned by the given user.
         This method can be overridden in subclasses to implement custom ownership logic.
         """
-        return self.registry.created_by == user
+        return self.registry.created_by_id == user.pk
     
     def __str__(self):
         return f"{self.name} for {self.registry.name}"
@@ -231,6 +384,13 @@ class SharedRegistry(models.Model):
     class Meta:
         verbose_name = "Shared Registry"
         verbose_name_plural = "Shared Registries"
+        constraints = [
+            # Also serves as the (shared_with, registry) index for visibility checks.
+            models.UniqueConstraint(fields=['shared_with', 'registry'], name='unique_shared_registry_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['shared_with', 'created_at', 'id'], name='shared_registry_keyset_idx'),
+        ]
 
     def __str__(self):
         return f"{self.registry.name} shared with {self.shared_with.email}"
@@ -273,11 +433,10 @@ class Contribution(TimeStampedBaseModel):
     )
     stripe_payment_intent_id = models.CharField(
         max_length=255,
-        unique=True,
-        db_index=True,
         null=True,  # Allow null for non-stripe contributions or existing rows
         blank=True, # Allow it to be blank in forms/admin
         verbose_name=_("Stripe Payment Intent ID"),
+        help_text=_("The PaymentIntent that paid for the contribution. A cart checkout pays for several services with one PaymentIntent."),
     )
     status = models.CharField(
         max_length=50,
@@ -295,11 +454,106 @@ class Contribution(TimeStampedBaseModel):
     class Meta:
         verbose_name = "Contribution"
         verbose_name_plural = "Contributions"
+        indexes = [
+            # Balances and service totals only ever aggregate successful contributions.
+            models.Index(
+                fields=['service', 'available_on'],
+                include=['amount', 'fee'],
+                condition=models.Q(status='succeeded'),
+                name='contribution_succeeded_idx',
+            ),
+            # The enrichment backlog: successful contributions still waiting for their fee details.
+            models.Index(
+                fields=['id'],
+                condition=models.Q(status='succeeded', available_on__isnull=True, stripe_payment_intent_id__isnull=False),
+                name='contribution_unenriched_idx',
+            ),
+            # The keyset pagination order of a service's contributions.
+            models.Index(fields=['service', 'created_at', 'id'], name='contribution_keyset_idx'),
+        ]
+        constraints = [
+            # A PaymentIntent pays for each service at most once. The index also serves lookups by PaymentIntent.
+            models.UniqueConstraint(
+                fields=['stripe_payment_intent_id', 'service'],
+                name='contribution_payment_intent_uniq',
+            ),
+        ]
     
     def __str__(self):
         service_name = self.service.name if self.service else "a deleted service"
         return f"${self.amount} for {service_name} ({self.status})"
-    
+
+
+class FundingReservation(TimeStampedBaseModel):
+    """
+    Holds part of a service's remaining funding for a checkout in progress, so concurrent
+    contributors cannot together pay more than the service costs.
+    A hold is converted when its payment succeeds and released when its PaymentIntent is
+    canceled, which happens at the latest when the hold expires.
+    """
+    HELD = 'held'
+    CONVERTED = 'converted'
+    RELEASED = 'released'
+    STATUS_CHOICES = [
+        (HELD, _('Held')),
+        (CONVERTED, _('Converted')),
+        (RELEASED, _('Released')),
+    ]
+    service = models.ForeignKey(
+        Service,
+        on_delete=models.CASCADE,
+        related_name="reservations",
+        verbose_name=_("Service"),
+    )
+    amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name=_("Amount"),
+    )
+    stripe_payment_intent_id = models.CharField(
+        max_length=255,
+        null=True,
+        blank=True,
+        verbose_name=_("Stripe Payment Intent ID"),
+        help_text=_("The PaymentIntent paying for the reservation, once it has been created."),
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=HELD,
+        verbose_name=_("Status"),
+    )
+    expires_at = models.DateTimeField(
+        verbose_name=_("Expires At"),
+        help_text=_("The date and time when a held reservation is released."),
+    )
+
+    class Meta:
+        verbose_name = "Funding Reservation"
+        verbose_name_plural = "Funding Reservations"
+        indexes = [
+            # Held reservations by expiry, for releasing the expired ones.
+            models.Index(
+                fields=['service', 'expires_at'],
+                condition=models.Q(status='held'),
+                name='reservation_held_idx',
+            ),
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(status='held'),
+                name='reservation_expiry_idx',
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['stripe_payment_intent_id', 'service'],
+                name='reservation_payment_intent_uniq',
+            ),
+        ]
+
+    def __str__(self):
+        return f"${self.amount} held for service {self.service_id} ({self.status})"
+
 class Withdrawal(TimeStampedBaseModel):
     """Represents a withdrawal of funds by a registry owner."""
     registry = models.ForeignKey(
@@ -328,11 +582,283 @@ class Withdrawal(TimeStampedBaseModel):
     class Meta:
         verbose_name = "Withdrawal"
         verbose_name_plural = "Withdrawals"
+        indexes = [
+            models.Index(fields=['registry', 'status'], include=['amount'], name='withdrawal_registry_status_idx'),
+        ]
 
     def __str__(self):
         return f"${self.amount} for {self.registry.name} ({self.status})"
 
 
+class RegistryLedgerEntry(TimeStampedBaseModel):
+    """
+    An append-only record of money moving in or out of a registry.
+    Entry amounts are never changed; only their settlement state moves forward.
+    """
+    CREDIT = 'credit'
+    FEE = 'fee'
+    DEBIT = 'debit'
+    ENTRY_TYPE_CHOICES = [
+        (CREDIT, _('Credit')),
+        (FEE, _('Fee')),
+        (DEBIT, _('Debit')),
+    ]
+    registry = models.ForeignKey(
+        Registry,
+        on_delete=models.CASCADE,
+        related_name="ledger_entries",
+        verbose_name=_("Registry"),
+    )
+    entry_type = models.CharField(
+        max_length=10,
+        choices=ENTRY_TYPE_CHOICES,
+        verbose_name=_("Entry Type"),
+    )
+    amount = models.DecimalField(
+        max_digits=10,
+        decimal_places=2,
+        verbose_name=_("Amount"),
+    )
+    contribution = models.ForeignKey(
+        Contribution,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="ledger_entries",
+        verbose_name=_("Contribution"),
+    )
+    withdrawal = models.ForeignKey(
+        Withdrawal,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="ledger_entries",
+        verbose_name=_("Withdrawal"),
+    )
+    available_on = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Available On"),
+        help_text=_("When the entry's funds become available. Empty until Stripe reports it."),
+    )
+    is_settled = models.BooleanField(
+        default=False,
+        verbose_name=_("Is Settled"),
+        help_text=_("Indicates if the entry counts towards the available balance."),
+    )
+
+    class Meta:
+        verbose_name = "Registry Ledger Entry"
+        verbose_name_plural = "Registry Ledger Entries"
+        indexes = [
+            models.Index(fields=['is_settled', 'available_on'], name='ledger_entry_settlement_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.entry_type} ${self.amount} for {self.registry_id}"
+
+
+class RegistryLedgerBalance(models.Model):
+    """
+    The running balance of a registry's ledger, maintained as entries are appended.
+    """
+    registry = models.OneToOneField(
+        Registry,
+        on_delete=models.CASCADE,
+        related_name="ledger_balance",
+        verbose_name=_("Registry"),
+    )
+    available = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        verbose_name=_("Available"),
+        help_text=_("Settled credits minus settled fees and withdrawals."),
+    )
+    pending = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        verbose_name=_("Pending"),
+        help_text=_("Scheduled credits minus their fees that are not available yet."),
+    )
+    fees = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        verbose_name=_("Fees"),
+    )
+    withdrawn = models.DecimalField(
+        max_digits=12,
+        decimal_places=2,
+        default=Decimal('0.00'),
+        verbose_name=_("Withdrawn"),
+    )
+    checkpointed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Checkpointed At"),
+        help_text=_("The last time the balance was verified against the ledger entries."),
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name=_("Updated At"),
+    )
+
+    class Meta:
+        verbose_name = "Registry Ledger Balance"
+        verbose_name_plural = "Registry Ledger Balances"
+
+    def __str__(self):
+        return f"{self.registry_id}: ${self.available} available, ${self.pending} pending"
+
+
+class StripeSyncState(models.Model):
+    """
+    Records the progress of a background job that syncs data from Stripe.
+    """
+    name = models.CharField(
+        max_length=100,
+        unique=True,
+        verbose_name=_("Name"),
+        help_text=_("The name of the sync job."),
+    )
+    cursor = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name=_("Cursor"),
+        help_text=_("The position the job resumes from on its next batch."),
+    )
+    processed_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Processed Count"),
+        help_text=_("The number of records processed during the last run."),
+    )
+    updated_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Updated Count"),
+        help_text=_("The number of records updated during the last run."),
+    )
+    failed_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Failed Count"),
+        help_text=_("The number of records that failed during the last run."),
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name=_("Last Error"),
+        help_text=_("The last error raised while processing a record."),
+    )
+    last_run_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Last Run At"),
+        help_text=_("The date and time when the job last ran."),
+    )
+
+    class Meta:
+        verbose_name = "Stripe Sync State"
+        verbose_name_plural = "Stripe Sync States"
+
+    def __str__(self):
+        return f"{self.name} (last run {self.last_run_at})"
+
+
+class StripeEvent(TimeStampedBaseModel):
+    """
+    A verified Stripe webhook event, stored as received and processed by a background worker.
+    Events are keyed by their Stripe ID, so deliveries Stripe repeats are stored only once.
+    Events about the same PaymentIntent share a partition key and a worker lane, and are
+    processed one at a time in the order Stripe created them.
+    """
+    PENDING = 'pending'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, _('Pending')),
+        (SUCCEEDED, _('Succeeded')),
+        (FAILED, _('Failed')),
+    ]
+    event_id = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name=_("Event ID"),
+        help_text=_("The ID Stripe assigned to the event."),
+    )
+    event_type = models.CharField(
+        max_length=100,
+        verbose_name=_("Event Type"),
+        help_text=_("The Stripe event type, e.g. payment_intent.succeeded."),
+    )
+    payload = models.JSONField(
+        verbose_name=_("Payload"),
+        help_text=_("The event exactly as Stripe sent it."),
+    )
+    stripe_created_at = models.DateTimeField(
+        verbose_name=_("Stripe Created At"),
+        help_text=_("The date and time when Stripe created the event."),
+    )
+    partition_key = models.CharField(
+        max_length=255,
+        verbose_name=_("Partition Key"),
+        help_text=_("The PaymentIntent or charge the event is about, or the event ID for other events."),
+    )
+    lane = models.PositiveSmallIntegerField(
+        verbose_name=_("Lane"),
+        help_text=_("The worker lane of the partition key; a lane is processed by one worker at a time."),
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        verbose_name=_("Status"),
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name=_("Attempts"),
+        help_text=_("The number of times processing the event was attempted."),
+    )
+    next_attempt_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Next Attempt At"),
+        help_text=_("The earliest date and time the event is processed again."),
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name=_("Last Error"),
+        help_text=_("The error raised by the last failed attempt."),
+    )
+    processed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name=_("Processed At"),
+        help_text=_("The date and time when the event was processed successfully."),
+    )
+
+    class Meta:
+        verbose_name = "Stripe Event"
+        verbose_name_plural = "Stripe Events"
+        indexes = [
+            # The lane queues: pending events of a lane in the order Stripe created them.
+            models.Index(
+                fields=['lane', 'stripe_created_at', 'id'],
+                name='stripe_event_lane_idx',
+                condition=models.Q(status='pending'),
+            ),
+            # Finds the earlier pending events of a partition that hold back the later ones.
+            models.Index(
+                fields=['partition_key', 'stripe_created_at'],
+                name='stripe_event_partition_idx',
+                condition=models.Q(status='pending'),
+            ),
+            models.Index(fields=['stripe_created_at'], name='stripe_event_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.event_type} {self.event_id} ({self.status})"
+
+
 # class VolunteerContribution(models.Model):
 #     """Represents a volunteer contribution towards a service in the registry."""
 #     service = models.ForeignKey(
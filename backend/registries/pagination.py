@@ -0,0 +1,9 @@
+from utilities.pagination import KeysetPagination
+
+
+class ContributionPagination(KeysetPagination):
+    """
+    Newest contributions first, 50 per page.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = 50
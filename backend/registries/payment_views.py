@@ -2,14 +2,16 @@ from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.decorators import action, api_view, permission_classes as drf_permission_classes
 from rest_framework.permissions import AllowAny
-from decimal import Decimal
-from django.db import transaction
 from django.conf import settings
+from django.core.cache import cache
 from django.views.decorators.csrf import csrf_exempt
-from .models import Service, Contribution
+from .models import FundingReservation, Service
 #from utilities.email import EmailDispatcher
-from .serializers import CreatePaymentIntentSerializer
+from .serializers import CreateCartPaymentIntentSerializer, CreatePaymentIntentSerializer
+from .webhooks import store_event
+from . import reservations
 import stripe
+import hashlib
 import logging
 import json
 from datetime import datetime, timezone
@@ -21,44 +23,145 @@ stripe.api_key = settings.STRIPE_SECRET_KEY
 
 class PaymentViewSet(viewsets.ViewSet):
     permission_classes = [AllowAny]
+    # How long the client secret of a PaymentIntent is reused for an idempotency key, at most 24
+    # hours, as Stripe keeps idempotency keys for at least that long. It never outlives the
+    # checkout's funding hold: once the hold expires its PaymentIntent is canceled.
+    @staticmethod
+    def payment_intent_cache_timeout():
+        return min(60 * 60 * 24, int(reservations.reservation_ttl().total_seconds()))
+
+    @staticmethod
+    def payment_intent_cache_key(service_id, amount_in_cents, idempotency_key):
+        digest = hashlib.sha256(idempotency_key.encode()).hexdigest()
+        return f"payments:intent:{service_id}:{amount_in_cents}:{digest}"
+
+    @staticmethod
+    def idempotency_key(request, validated_data):
+        return validated_data.get('idempotency_key') or request.headers.get('Idempotency-Key', '')
+
+    def checkout(self, held, amount_in_cents, metadata, idempotency_key, cache_key):
+        """
+        Creates the PaymentIntent paying for the held reservations and records it on them.
+        The reservations are released if Stripe does not create the PaymentIntent.
+        """
+        options = {}
+        if idempotency_key:
+            options['idempotency_key'] = idempotency_key
+        try:
+            payment_intent = stripe.PaymentIntent.create(
+                amount=amount_in_cents,
+                currency='usd',
+                metadata=metadata,
+                **options
+            )
+        except stripe.error.IdempotencyError:
+            reservations.cancel(held)
+            return Response({'error': 'This payment is already being processed with different details.'}, status=status.HTTP_409_CONFLICT)
+        except Exception as e:
+            reservations.cancel(held)
+            # Log the full exception for debugging, but return a generic error to the user.
+            logger.error(f"Error creating payment intent for services {[r.service_id for r in held]}: {e}", exc_info=True)
+            return Response({'error': 'An unexpected error occurred while creating the payment.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        held = reservations.attach(held, payment_intent.id)
+        if not any(reservation.status == FundingReservation.HELD for reservation in held):
+            # Stripe returned the PaymentIntent of an earlier request with the same key, whose
+            # hold has ended since, so it was canceled or already paid.
+            return Response({'error': 'This checkout has expired. Please start again.'}, status=status.HTTP_409_CONFLICT)
+        if cache_key:
+            cache.set(cache_key, payment_intent.client_secret, timeout=self.payment_intent_cache_timeout())
+        return Response({'clientSecret': payment_intent.client_secret})
 
     @action(detail=False, methods=['post'], url_path='create-payment-intent')
     def create_payment_intent(self, request):
         """
         Creates a Stripe PaymentIntent for a given service and amount.
+        With an `idempotency_key`, repeated requests for the same service and amount return the
+        client secret of the first PaymentIntent from the cache, without calling Stripe again.
         """
         serializer = CreatePaymentIntentSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         validated_data = serializer.validated_data
 
-        try:
-            service = Service.objects.get(id=validated_data['service_id'])
-            if not service.is_available():
-                return Response({'error': 'This service is no longer available for contributions.'}, status=status.HTTP_400_BAD_REQUEST)
+        amount_to_contribute = validated_data['amount']
+        amount_in_cents = int(amount_to_contribute * 100)
+        idempotency_key = self.idempotency_key(request, validated_data)
+        cache_key = None
+        if idempotency_key:
+            cache_key = self.payment_intent_cache_key(validated_data['service_id'], amount_in_cents, idempotency_key)
+            client_secret = cache.get(cache_key)
+            if client_secret:
+                return Response({'clientSecret': client_secret})
 
-            amount_to_contribute = validated_data['amount']
-            amount_in_cents = int(amount_to_contribute * 100)
+        try:
+            # Hold the amount against the service's remaining funding for the checkout.
+            reservation = reservations.reserve(validated_data['service_id'], amount_to_contribute)
+        except Service.DoesNotExist:
+            return Response({'error': 'Service not found.'}, status=status.HTTP_404_NOT_FOUND)
+        except reservations.ReservationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        service = reservation.service
+        metadata = {
+            'service_id': str(service.id),
+            'registry_id': str(service.registry_id),
+            'amount': str(amount_to_contribute),
+            'contributor_name': validated_data.get('contributor_name', ''),
+            'contributor_email': validated_data.get('contributor_email', ''),
+        }
+        return self.checkout(
+            [reservation], amount_in_cents, metadata,
+            # Scoped to the service and amount, so a key reused for another payment is not
+            # rejected by Stripe for changed parameters.
+            f"payment-intent:{service.id}:{amount_in_cents}:{idempotency_key}" if idempotency_key else None,
+            cache_key,
+        )
+
+    @action(detail=False, methods=['post'], url_path='create-cart-payment-intent')
+    def create_cart_payment_intent(self, request):
+        """
+        Creates one Stripe PaymentIntent for contributions to several services of a registry.
+        Every service is checked and its amount held in a single query, and the PaymentIntent
+        records the amount per service in its `allocations` metadata, from which the webhook
+        creates one contribution per service. Idempotency keys work as for a single service.
+        """
+        serializer = CreateCartPaymentIntentSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        validated_data = serializer.validated_data
 
-            metadata = {
-                'service_id': str(service.id),
-                'registry_id': str(service.registry.id),
-                'amount': str(amount_to_contribute),
-                'contributor_name': validated_data.get('contributor_name', ''),
-                'contributor_email': validated_data.get('contributor_email', ''),
-            }
+        registry_id = validated_data['registry_id']
+        allocations = {item['service_id']: item['amount'] for item in validated_data['items']}
+        amount_in_cents = int(sum(allocations.values()) * 100)
+        # The items in a canonical order, so the same cart always gets the same keys.
+        cart = ','.join(f"{service_id}:{amount}" for service_id, amount in sorted(allocations.items()))
+        cart_digest = hashlib.sha256(cart.encode()).hexdigest()[:16]
+        idempotency_key = self.idempotency_key(request, validated_data)
+        cache_key = None
+        if idempotency_key:
+            cache_key = self.payment_intent_cache_key(f"cart:{registry_id}:{cart_digest}", amount_in_cents, idempotency_key)
+            client_secret = cache.get(cache_key)
+            if client_secret:
+                return Response({'clientSecret': client_secret})
 
-            payment_intent = stripe.PaymentIntent.create(
-                amount=amount_in_cents,
-                currency='usd',
-                metadata=metadata
-            )
-            return Response({'clientSecret': payment_intent.client_secret})
+        try:
+            held = reservations.reserve_many(allocations, registry_id=registry_id)
         except Service.DoesNotExist:
-            return Response({'error': 'Service not found.'}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            # Log the full exception for debugging, but return a generic error to the user.
-            logger.error(f"Error creating payment intent for service {validated_data.get('service_id')}: {e}", exc_info=True)
-            return Response({'error': 'An unexpected error occurred while creating the payment.'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response({'error': 'Service not found in this registry.'}, status=status.HTTP_404_NOT_FOUND)
+        except reservations.ReservationError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        metadata = {
+            'registry_id': str(registry_id),
+            'allocations': json.dumps({str(service_id): str(amount) for service_id, amount in sorted(allocations.items())}),
+            'amount': str(sum(allocations.values())),
+            'contributor_name': validated_data.get('contributor_name', ''),
+            'contributor_email': validated_data.get('contributor_email', ''),
+        }
+        return self.checkout(
+            held, amount_in_cents, metadata,
+            f"cart-payment-intent:{registry_id}:{cart_digest}:{idempotency_key}" if idempotency_key else None,
+            cache_key,
+        )
 
 
 @csrf_exempt
@@ -66,84 +169,21 @@ class PaymentViewSet(viewsets.ViewSet):
 @drf_permission_classes([AllowAny])
 def stripe_webhook(request):
     """
-    Handles incoming webhooks from Stripe to confirm payments.
+    Handles incoming webhooks from Stripe.
+    The event is verified and stored, and Stripe gets its response right away; the stored
+    events are processed by the `process_stripe_events` worker (see registries/webhooks.py).
     This is a standalone view to easily apply @csrf_exempt.
     """
-    print("\n--- [WEBHOOK] Received a request from Stripe CLI ---")
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
 
     try:
-        event = stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
-        print(f"[WEBHOOK] Event constructed successfully. Type: {event.type}")
+        stripe.Webhook.construct_event(payload, sig_header, endpoint_secret)
     except (ValueError, stripe.error.SignatureVerificationError) as e:
-        print(f"!!! WEBHOOK SIGNATURE VERIFICATION FAILED: {e}")
         logger.error(f"Webhook signature verification failed: {e}", exc_info=True)
         return Response(status=status.HTTP_400_BAD_REQUEST)
 
-    if event.type == 'charge.succeeded':
-        # We now handle everything in the retrieve method to avoid race conditions.
-        # This handler can be used in the future for other charge-related events.
-        pass
-
-    if event.type == 'payment_intent.succeeded':
-        print("\n--- [WEBHOOK] Handling 'payment_intent.succeeded' to create initial contribution record ---")
-        payment_intent = event['data']['object']
-        payment_intent_id = payment_intent.get('id')
-        print(f"[WEBHOOK] PI ID: {payment_intent_id}")
-
-        metadata = payment_intent.get('metadata', {})
-        service_id = metadata.get('service_id')
-        
-        if not service_id:
-            logger.warning(f"Webhook 'payment_intent.succeeded' for PI {payment_intent_id} is missing 'service_id' in metadata. Skipping.")
-            return Response(status=status.HTTP_200_OK)
-
-        try:
-            with transaction.atomic():
-                service = Service.objects.get(id=int(service_id))
-                
-                # Create the initial contribution record. Fee and available_on will be updated later.
-                defaults_for_db = {
-                    'service': service,
-                    'amount': Decimal(payment_intent.get('amount_received', 0)) / Decimal('100.0'),
-                    'contributor_name': metadata.get('contributor_name', ''),
-                    'contributor_email': metadata.get('contributor_email', ''),
-                    'status': 'succeeded',
-                }
-
-                contribution, created = Contribution.objects.update_or_create(
-                    stripe_payment_intent_id=payment_intent_id,
-                    defaults=defaults_for_db
-                )
-                print(f"[WEBHOOK] Initial contribution record {'created' if created else 'updated'}: ID {contribution.id}")
-
-                if created:
-                    from notifications.models import UserNotification
-                    message = f"{defaults_for_db['contributor_name'] or 'An anonymous contributor'} just contributed ${defaults_for_db['amount']:.2f} to your '{service.name}' service!"
-                    UserNotification.objects.create(
-                        user=service.registry.created_by,
-                        title="New Contribution Received!",
-                        message=message,
-                    )
-                # logger.info(f"Sending contribution notification email to {service.registry.created_by.email}")
-                # # Send contribution notification email
-                # try:
-                #     EmailDispatcher.send_contribution_notification_email(
-                #         registry_name=service.registry.name,
-                #         service_name=service.name,
-                #         contributor_name=metadata.get('contributor_name', 'An anonymous contributor'),
-                #         amount=Decimal(payment_intent.get('amount_received', 0)) / Decimal('100.0'),
-                #         user_email=service.registry.created_by.email,
-                #     )
-                # except Exception as e:
-                #     logger.error(f"Failed to send new service notification email for service {service.id}: {e}", exc_info=True)
-        except Service.DoesNotExist:
-            logger.error(f"Stripe Webhook: Service with ID {service_id} not found for PI {payment_intent_id}.")
-            return Response({'error': 'Service not found'}, status=status.HTTP_404_NOT_FOUND)
-        except Exception as e:
-            logger.error(f"Stripe Webhook: Error processing payment_intent.succeeded for PI {payment_intent_id}: {e}", exc_info=True)
-            return Response(status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-    return Response(status=status.HTTP_200_OK)
\ No newline at end of file
+    # Stripe retries the delivery if storing the event fails, so errors are left to surface as a 500.
+    store_event(json.loads(payload))
+    return Response(status=status.HTTP_200_OK)
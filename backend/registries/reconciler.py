@@ -0,0 +1,291 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from .ledger import RegistryLedger
+from .models import Contribution, Service, StripeSyncState
+from .stripe_gateway import get_stripe_gateway
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def save_fee_details(updates):
+    """
+    Saves fee and availability details onto contributions and keeps the fee counters
+    of their services in step.
+
+    `updates` is a list of (contribution, FeeDetails) pairs. The contributions are locked
+    and re-read inside the transaction, so the fee deltas applied to the services are
+    correct even if another worker enriched the same contributions concurrently.
+    Returns the number of contributions that changed.
+    """
+    details_by_id = {contribution.id: details for contribution, details in updates if details is not None}
+    if not details_by_id:
+        return 0
+
+    with transaction.atomic():
+        locked = list(
+            Contribution.objects.select_for_update(of=('self',))
+            .filter(id__in=details_by_id.keys())
+            .annotate(registry_id=F('service__registry_id'))
+            .order_by('id')
+        )
+        # Lock the affected ledgers before the new fees are written.
+        ledgers = {
+            registry_id: RegistryLedger.lock(registry_id)
+            for registry_id in sorted({c.registry_id for c in locked if c.registry_id and c.status == 'succeeded'})
+        }
+
+        changed, service_fee_deltas, ledger_changes = [], defaultdict(Decimal), []
+        for contribution in locked:
+            details = details_by_id[contribution.id]
+            if contribution.fee == details.fee and contribution.available_on == details.available_on:
+                continue
+            fee_delta = details.fee - contribution.fee
+            contribution.fee = details.fee
+            contribution.available_on = details.available_on
+            changed.append(contribution)
+            if contribution.registry_id in ledgers:
+                service_fee_deltas[contribution.service_id] += fee_delta
+                ledger_changes.append((contribution, fee_delta))
+
+        if changed:
+            Contribution.objects.bulk_update(changed, ['fee', 'available_on'])
+        for service_id, delta in service_fee_deltas.items():
+            if delta:
+                Service.objects.adjust_totals(service_id, fee=delta)
+        for contribution, fee_delta in ledger_changes:
+            ledgers[contribution.registry_id].charge_fee(contribution, fee_delta)
+    return len(changed)
+
+
+def allocate_fee_details(contributions, details):
+    """
+    Splits the fee details of one PaymentIntent across the contributions it paid for, in
+    proportion to their amounts. The rounding remainder goes to the largest contribution, so
+    the shares add up to the PaymentIntent's fee exactly.
+    Returns (contribution, FeeDetails) pairs.
+    """
+    contributions = sorted(contributions, key=lambda contribution: contribution.id)
+    total = sum(contribution.amount for contribution in contributions)
+    if len(contributions) == 1 or not total:
+        return [(contribution, details) for contribution in contributions]
+
+    fees = [
+        (details.fee * contribution.amount / total).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        for contribution in contributions
+    ]
+    largest = max(range(len(contributions)), key=lambda index: contributions[index].amount)
+    fees[largest] += details.fee - sum(fees)
+    return [(contribution, details._replace(fee=fee)) for contribution, fee in zip(contributions, fees)]
+
+
+def fetch_fee_details_concurrently(gateway, contributions, max_workers=None):
+    """
+    Looks up the fee details of the given contributions on a bounded thread pool, with one
+    lookup per PaymentIntent. The fee of a PaymentIntent that paid for several services is
+    split across all of its contributions, so those not among the given ones are included.
+    Returns (contribution, details, error) triples, grouped by PaymentIntent.
+    """
+    by_payment_intent = defaultdict(dict)
+    for contribution in contributions:
+        by_payment_intent[contribution.stripe_payment_intent_id][contribution.id] = contribution
+    siblings = Contribution.objects.filter(
+        status='succeeded', stripe_payment_intent_id__in=by_payment_intent.keys()
+    ).exclude(id__in=[contribution.id for contribution in contributions])
+    for contribution in siblings:
+        by_payment_intent[contribution.stripe_payment_intent_id][contribution.id] = contribution
+
+    def fetch(group):
+        group = list(group.values())
+        try:
+            details = gateway.fetch_fee_details(group[0])
+        except Exception as e:
+            return [(contribution, None, e) for contribution in group]
+        finally:
+            # Gateways may query the database, which opens a connection for the pool thread.
+            connections.close_all()
+        if details is None:
+            return [(contribution, None, None) for contribution in group]
+        return [(contribution, share, None) for contribution, share in allocate_fee_details(group, details)]
+
+    max_workers = max_workers or getattr(settings, 'STRIPE_ENRICHMENT_WORKERS', 4)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return [triple for triples in pool.map(fetch, by_payment_intent.values()) for triple in triples]
+
+
+class ContributionReconciler:
+    """
+    Fills in the fee and available_on fields of successful contributions from Stripe.
+
+    Contributions are processed in batches ordered by ID. The ID of the last processed
+    contribution is stored as the job's cursor, so a run resumes where the previous one
+    stopped and contributions that keep failing do not block the ones after them.
+    """
+    name = 'contribution-enrichment'
+
+    def __init__(self, gateway=None, batch_size=50):
+        self.gateway = gateway or get_stripe_gateway()
+        self.batch_size = batch_size
+
+    @staticmethod
+    def pending_contributions():
+        """
+        Returns the successful contributions that have not been enriched yet.
+        """
+        return Contribution.objects.filter(
+            status='succeeded',
+            available_on__isnull=True,
+            stripe_payment_intent_id__isnull=False,
+        ).order_by('id')
+
+    def enrich(self, contributions):
+        """
+        Looks up the fee details of the given contributions and saves them.
+        Returns the number of updated and failed contributions.
+        """
+        updates, failed = [], 0
+        for contribution, details, error in fetch_fee_details_concurrently(self.gateway, contributions):
+            if error is not None:
+                failed += 1
+                self.state.last_error = f"Contribution {contribution.id}: {error}"
+                logger.error(f"Failed to enrich contribution {contribution.id}: {error}")
+                continue
+            updates.append((contribution, details))
+        return save_fee_details(updates), failed
+
+    def run_batch(self):
+        """
+        Processes the next batch of contributions after the stored cursor.
+        Returns the number of contributions processed.
+        """
+        batch = list(self.pending_contributions().filter(id__gt=self.state.cursor or 0)[:self.batch_size])
+        if not batch:
+            # Start over from the beginning on the next run to retry skipped contributions.
+            self.state.cursor = None
+            return 0
+
+        updated, failed = self.enrich(batch)
+        self.state.cursor = batch[-1].id
+        self.state.processed_count += len(batch)
+        self.state.updated_count += updated
+        self.state.failed_count += failed
+        self.state.save()
+        return len(batch)
+
+    def run(self, max_batches=None):
+        """
+        Processes batches until every pending contribution after the cursor has been seen,
+        or `max_batches` batches were processed.
+        Returns the sync state recording the progress of the run.
+        """
+        self.state, _ = StripeSyncState.objects.get_or_create(name=self.name)
+        self.state.processed_count = self.state.updated_count = self.state.failed_count = 0
+        self.state.last_error = ''
+        self.state.last_run_at = timezone.now()
+        batches = 0
+        while (max_batches is None or batches < max_batches) and self.run_batch():
+            batches += 1
+        self.state.save()
+        return self.state
+
+
+class MissedContributionLookup(ContributionReconciler):
+    """
+    Looks up the contributions the balance transaction sync moved past one by one.
+
+    Only contributions older than `grace` are looked up, as the sync normally picks up
+    younger ones, and each run looks up a single batch after its own stored cursor. So the
+    contributions still waiting for Stripe are spread over runs instead of all being looked
+    up again on every run.
+    """
+    name = 'balance-transaction-sync-lookup'
+    grace = timedelta(minutes=30)
+
+    def pending_contributions(self):
+        return super().pending_contributions().filter(created_at__lte=timezone.now() - self.grace)
+
+    def run(self):
+        return super().run(max_batches=1)
+
+
+class BalanceTransactionSync:
+    """
+    Applies Stripe fee and availability data to contributions by paging through
+    balance transactions instead of looking each contribution up individually.
+
+    Each page of up to 100 transactions costs one API call. Transactions are matched
+    back to contributions by PaymentIntent ID in memory, and each page is saved with
+    one bulk update. The creation time of the newest transaction seen is stored as a
+    high-water mark cursor, and the next run lists transactions from that point on.
+    The cursor only advances after a complete pass, as Stripe lists newest first.
+
+    A transaction whose contribution is recorded only after the pass that listed it, as
+    when its webhook is delayed or retried, is behind the cursor for good. So after every
+    complete pass, a bounded batch of the older contributions still missing their fee
+    details is looked up one by one with a MissedContributionLookup.
+    """
+    name = 'balance-transaction-sync'
+
+    def __init__(self, gateway=None, page_size=100, lookup_batch_size=50):
+        self.gateway = gateway or get_stripe_gateway()
+        self.page_size = page_size
+        self.lookup_batch_size = lookup_batch_size
+
+    def apply(self, records):
+        """
+        Applies a page of balance transaction records to the matching contributions.
+        Returns the number of contributions updated.
+        """
+        by_payment_intent = {record.payment_intent_id: record for record in records if record.fee_details}
+        if not by_payment_intent:
+            return 0
+
+        contributions = defaultdict(list)
+        for contribution in Contribution.objects.filter(
+            status='succeeded', stripe_payment_intent_id__in=by_payment_intent.keys()
+        ).only('id', 'amount', 'stripe_payment_intent_id'):
+            contributions[contribution.stripe_payment_intent_id].append(contribution)
+        # A cart PaymentIntent's fee is split across the contributions it paid for.
+        return save_fee_details([
+            pair
+            for payment_intent_id, group in contributions.items()
+            for pair in allocate_fee_details(group, by_payment_intent[payment_intent_id].fee_details)
+        ])
+
+    def run(self):
+        """
+        Syncs every balance transaction created since the stored cursor.
+        Returns the sync state recording the progress of the run.
+        """
+        state, _ = StripeSyncState.objects.get_or_create(name=self.name)
+        state.processed_count = state.updated_count = state.failed_count = 0
+        state.last_error = ''
+        state.last_run_at = timezone.now()
+        high_water_mark = state.cursor
+
+        try:
+            for records in self.gateway.list_balance_transactions(created_since=state.cursor, page_size=self.page_size):
+                state.processed_count += len(records)
+                state.updated_count += self.apply(records)
+                for record in records:
+                    if high_water_mark is None or record.created > high_water_mark:
+                        high_water_mark = record.created
+        except Exception as e:
+            state.failed_count += 1
+            state.last_error = str(e)
+            logger.error(f"Balance transaction sync stopped: {e}", exc_info=True)
+        else:
+            state.cursor = high_water_mark
+            lookup = MissedContributionLookup(gateway=self.gateway, batch_size=self.lookup_batch_size).run()
+            state.updated_count += lookup.updated_count
+            state.failed_count += lookup.failed_count
+            state.last_error = lookup.last_error
+        state.save()
+        return state
@@ -0,0 +1,209 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.conf import settings
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from .models import FundingReservation, Service
+from .stripe_gateway import get_stripe_gateway
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+# How long an expired hold whose PaymentIntent could not be canceled waits before the next attempt.
+CANCEL_RETRY_DELAY = timedelta(minutes=5)
+
+
+class ReservationError(Exception):
+    """
+    Raised when a service cannot take a reservation; the message is safe to show to contributors.
+    """
+
+
+def reservation_ttl():
+    """
+    How long a reservation is held for a checkout that has not completed.
+    """
+    return timedelta(seconds=getattr(settings, 'FUNDING_RESERVATION_TTL', 30 * 60))
+
+
+def _release(reservations, status):
+    """
+    Moves held reservations to the given status and returns their amounts to the services.
+    Must be called inside a transaction holding the reservations' rows.
+    """
+    # Services are updated in a fixed order, so concurrent releases cannot deadlock on them.
+    released = sorted(
+        (reservation for reservation in reservations if reservation.status == FundingReservation.HELD),
+        key=lambda reservation: reservation.service_id,
+    )
+    for reservation in released:
+        reservation.status = status
+        Service.objects.filter(pk=reservation.service_id).update(
+            reserved_total=models.F('reserved_total') - reservation.amount,
+        )
+    FundingReservation.objects.filter(pk__in=[reservation.pk for reservation in released]).update(
+        status=status, updated_at=timezone.now(),
+    )
+    return len(released)
+
+
+def reserve(service_id, amount):
+    """
+    Holds `amount` of the service's remaining funding and returns the reservation.
+    Raises ReservationError when the service is unavailable or does not have `amount` left to fund.
+    """
+    return reserve_many({service_id: amount})[0]
+
+
+def reserve_many(allocations, registry_id=None):
+    """
+    Holds funding on several services at once and returns the reservations, in the order of
+    the services' IDs. `allocations` maps service IDs to the amounts to hold.
+
+    The services are validated against their annotated availability in one query that also
+    locks their rows, so concurrent reservations for the same service are serialized and can
+    never exceed its total cost. Expired holds of the services that never got a PaymentIntent
+    are released first; those with one are left to `release_expired()`. Either
+    every amount is held or none is: raises Service.DoesNotExist when a service is missing or
+    not in the given registry, and ReservationError when one cannot take its amount.
+    """
+    with transaction.atomic():
+        services = Service.objects.with_financials().select_for_update(no_key=True).filter(pk__in=allocations.keys())
+        if registry_id is not None:
+            services = services.filter(registry_id=registry_id)
+        # Rows are locked in ID order, so overlapping carts cannot deadlock on them.
+        services = list(services.order_by('pk'))
+        if len(services) != len(allocations):
+            raise Service.DoesNotExist()
+
+        # A hold with a PaymentIntent is only released once the PaymentIntent is canceled at
+        # Stripe, which is not done while the service rows are locked. Expired holds another
+        # worker is already settling are skipped; they stay counted until released, which errs
+        # on the side of not overfunding. Skipping also means this never waits for a
+        # reservation row while holding the service rows.
+        expired = list(FundingReservation.objects.select_for_update(skip_locked=True).filter(
+            service_id__in=allocations.keys(), status=FundingReservation.HELD, expires_at__lte=timezone.now(),
+            stripe_payment_intent_id__isnull=True,
+        ))
+        by_id = {service.pk: service for service in services}
+        for reservation in expired:
+            by_id[reservation.service_id].reserved_total -= reservation.amount
+        _release(expired, FundingReservation.RELEASED)
+
+        for service in services:
+            remaining = service.total_cost() - service.contributed_total - service.reserved_total
+            if not service.annotated_is_available or remaining <= Decimal('0.00'):
+                raise ReservationError(f"'{service.name}' is no longer available for contributions.")
+            if allocations[service.pk] > remaining:
+                raise ReservationError(f"Only ${remaining:.2f} of '{service.name}' is left to fund.")
+
+        expires_at = timezone.now() + reservation_ttl()
+        for service in services:
+            Service.objects.filter(pk=service.pk).update(
+                reserved_total=models.F('reserved_total') + allocations[service.pk],
+            )
+        return FundingReservation.objects.bulk_create([
+            FundingReservation(service=service, amount=allocations[service.pk], expires_at=expires_at)
+            for service in services
+        ])
+
+
+def attach(reservations, payment_intent_id):
+    """
+    Records the PaymentIntent paying for the reservations.
+    If the PaymentIntent already has reservations, as when Stripe returns an existing
+    PaymentIntent for a repeated idempotency key, the new ones are released and the existing
+    ones are kept. Returns the reservations that hold the funding.
+    """
+    try:
+        with transaction.atomic():
+            FundingReservation.objects.filter(pk__in=[reservation.pk for reservation in reservations]).update(
+                stripe_payment_intent_id=payment_intent_id,
+            )
+    except IntegrityError:
+        cancel(reservations)
+        return list(FundingReservation.objects.filter(stripe_payment_intent_id=payment_intent_id))
+    for reservation in reservations:
+        reservation.stripe_payment_intent_id = payment_intent_id
+    return reservations
+
+
+def cancel(reservations):
+    """
+    Releases reservations whose PaymentIntent could not be created.
+    """
+    with transaction.atomic():
+        _release(
+            list(FundingReservation.objects.select_for_update().filter(
+                pk__in=[reservation.pk for reservation in reservations],
+            )),
+            FundingReservation.RELEASED,
+        )
+
+
+def settle(payment_intent_id, succeeded):
+    """
+    Ends the holds of the PaymentIntent's reservations: converted when the payment succeeded,
+    so their amounts move to the contributed totals, or released when it was canceled.
+    Returns the number of reservations changed.
+    """
+    status = FundingReservation.CONVERTED if succeeded else FundingReservation.RELEASED
+    with transaction.atomic():
+        reservations = list(
+            FundingReservation.objects.select_for_update()
+            .filter(stripe_payment_intent_id=payment_intent_id).order_by('pk')
+        )
+        return _release(reservations, status)
+
+
+def release_expired(batch_size=500, gateway=None):
+    """
+    Ends the holds that have expired and returns the number released.
+
+    The PaymentIntent of an expired hold is canceled at Stripe before the hold is released,
+    so an expired checkout can no longer be paid once its funding is free again. A hold whose
+    PaymentIntent cannot be canceled, because it was already paid or Stripe could not be
+    reached, is kept and tried again after CANCEL_RETRY_DELAY; once paid, its
+    payment_intent.succeeded event converts it.
+    """
+    gateway = gateway or get_stripe_gateway()
+    released = 0
+    while True:
+        expired = list(
+            FundingReservation.objects.filter(status=FundingReservation.HELD, expires_at__lte=timezone.now())
+            .order_by('expires_at').values_list('stripe_payment_intent_id', flat=True)[:batch_size]
+        )
+        if not expired:
+            return released
+
+        payment_intent_ids = {payment_intent_id for payment_intent_id in expired if payment_intent_id}
+        progress = len(payment_intent_ids)
+        if None in expired:
+            # Holds whose PaymentIntent was never created cannot be paid.
+            with transaction.atomic():
+                unpaid = _release(
+                    list(FundingReservation.objects.select_for_update(skip_locked=True).filter(
+                        status=FundingReservation.HELD, expires_at__lte=timezone.now(),
+                        stripe_payment_intent_id__isnull=True,
+                    ).order_by('pk')[:batch_size]),
+                    FundingReservation.RELEASED,
+                )
+            released += unpaid
+            progress += unpaid
+
+        for payment_intent_id in payment_intent_ids:
+            try:
+                payment_intent_status = gateway.cancel_payment_intent(payment_intent_id)
+            except Exception as e:
+                logger.error(f"Canceling PaymentIntent {payment_intent_id} of an expired hold failed: {e}", exc_info=True)
+                payment_intent_status = None
+            if payment_intent_status == 'canceled':
+                released += settle(payment_intent_id, succeeded=False)
+            else:
+                FundingReservation.objects.filter(
+                    stripe_payment_intent_id=payment_intent_id, status=FundingReservation.HELD,
+                ).update(expires_at=timezone.now() + CANCEL_RETRY_DELAY, updated_at=timezone.now())
+        if not progress:
+            # The remaining holds are being released by another worker.
+            return released
@@ -1,10 +1,12 @@
 from rest_framework import serializers
 from . import models
-from django.utils import timezone
-from django.db.models import Sum
-from decimal import Decimal
+from .fieldsets import SparseFieldsetMixin
 
 
+# Funding counters maintained on Service for bookkeeping; clients read the
+# derived totals (total_contributions, is_available, ...) instead.
+SERVICE_COUNTER_FIELDS = ('contributed_total', 'fee_total', 'contribution_count', 'reserved_total')
+
 
 class DefaultServiceSerializer(serializers.ModelSerializer):
     """
@@ -30,6 +32,58 @@ class DefaultRegistrySerializer(serializers.ModelSerializer):
         read_only_fields = ('created_at', 'updated_at')
 
 
+class DefaultServiceOverrideSerializer(serializers.Serializer):
+    """
+    Overrides the fields of one service copied from a default registry, or leaves it out.
+    """
+    default_service = serializers.IntegerField(help_text="ID of a default service of the template.")
+    include = serializers.BooleanField(default=True, help_text="Set to false to leave the service out.")
+    name = serializers.CharField(max_length=255, required=False)
+    description = serializers.CharField(required=False, allow_blank=True)
+    hours = serializers.IntegerField(min_value=0, required=False)
+    cost_per_hour = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    is_active = serializers.BooleanField(required=False)
+
+
+class InstantiateDefaultRegistrySerializer(serializers.ModelSerializer):
+    """
+    Creates a registry for the requesting user from the default registry in the `template` context,
+    copying its default services with the given overrides applied.
+    """
+    name = serializers.CharField(max_length=255, required=False, help_text="Defaults to the template's name.")
+    services = DefaultServiceOverrideSerializer(many=True, required=False)
+
+    class Meta:
+        model = models.Registry
+        fields = ['name', 'is_first_time', 'babies_count', 'arrival_date', 'thank_you_message', 'welcome_message', 'services']
+
+    def validate_services(self, overrides):
+        template_service_ids = {service.id for service in self.context['template'].default_services.all()}
+        unknown = [override['default_service'] for override in overrides if override['default_service'] not in template_service_ids]
+        if unknown:
+            raise serializers.ValidationError(f"Default services {unknown} are not part of this template.")
+        return overrides
+
+    def create(self, validated_data):
+        template = self.context['template']
+        overrides = {override.pop('default_service'): override for override in validated_data.pop('services', [])}
+        services = []
+        for default_service in template.default_services.all():
+            override = overrides.get(default_service.id, {})
+            if not override.pop('include', True):
+                continue
+            services.append({
+                'name': default_service.name,
+                'description': default_service.description,
+                'hours': default_service.hours,
+                'cost_per_hour': default_service.cost_per_hour,
+                **override,
+            })
+        validated_data.setdefault('name', template.name)
+        validated_data['created_by'] = self.context['request'].user
+        return models.Registry.objects.create_with_services(services, **validated_data)
+
+
 class ContributionSerializer(serializers.ModelSerializer):
     """
     Serializer for the Contribution model.
@@ -49,6 +103,43 @@ class CreatePaymentIntentSerializer(serializers.Serializer):
     amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=10.00, help_text="Minimum contribution is $10.00")
     contributor_name = serializers.CharField(max_length=100, required=False, allow_blank=True)
     contributor_email = serializers.EmailField(required=False, allow_blank=True)
+    idempotency_key = serializers.CharField(
+        max_length=100, required=False, allow_blank=True,
+        help_text="A key the client generates per contribution attempt. Repeated requests with the same key, "
+                  "service and amount return the same PaymentIntent."
+    )
+
+class CartItemSerializer(serializers.Serializer):
+    """
+    Serializer for one service and amount of a cart checkout.
+    """
+    service_id = serializers.IntegerField()
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=10.00, help_text="Minimum contribution is $10.00")
+
+
+class CreateCartPaymentIntentSerializer(serializers.Serializer):
+    """
+    Serializer for validating a cart checkout: contributions to several services of one
+    registry, paid with a single Stripe PaymentIntent.
+    """
+    # Bounded so the allocations fit in a single Stripe metadata value (500 characters).
+    MAX_ITEMS = 20
+
+    registry_id = serializers.IntegerField()
+    items = CartItemSerializer(many=True, allow_empty=False, max_length=MAX_ITEMS)
+    contributor_name = serializers.CharField(max_length=100, required=False, allow_blank=True)
+    contributor_email = serializers.EmailField(required=False, allow_blank=True)
+    idempotency_key = serializers.CharField(
+        max_length=100, required=False, allow_blank=True,
+        help_text="A key the client generates per checkout attempt. Repeated requests with the same key "
+                  "and items return the same PaymentIntent."
+    )
+
+    def validate_items(self, items):
+        service_ids = [item['service_id'] for item in items]
+        if len(set(service_ids)) != len(service_ids):
+            raise serializers.ValidationError("Each service can only appear once in the cart.")
+        return items
 
 class FinalizeWithdrawalSerializer(serializers.Serializer):
     """Serializer for validating the final withdrawal request with OTP."""
@@ -60,6 +151,13 @@ class InitiateWithdrawalSerializer(serializers.Serializer):
     """Serializer for validating the initiation of a withdrawal."""
     amount = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=1.00)
 
+class RegistryBalanceSerializer(serializers.Serializer):
+    """Serializer for the financial summary of a registry."""
+    available = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    pending = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    fees = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    withdrawn = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
 # class VolunteerContributionSerializer(serializers.ModelSerializer):
 #     """
 #     Serializer for the VolunteerContribution model.
@@ -101,7 +199,7 @@ class RegistryServiceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.Service
-        exclude = ('registry',)
+        exclude = ('registry',) + SERVICE_COUNTER_FIELDS
         read_only_fields = ('created_at', 'updated_at', 'cashed_out')
 
     def get_is_owned_by_user(self, obj) -> bool:
@@ -112,10 +210,11 @@ class RegistryServiceSerializer(serializers.ModelSerializer):
         return obj.is_owned_by_user(self.context['request'].user)
 
 
-class ServiceSerializer(serializers.ModelSerializer):
+class ServiceSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer for the Service model.
     This serializer is used to convert Service model instances to JSON format and vice versa.
+    The nested contributions are only included with `?expand=contributions`.
     """
     is_owned_by_user = serializers.SerializerMethodField()
     total_cost = serializers.DecimalField(
@@ -147,8 +246,9 @@ class ServiceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.Service
-        fields = '__all__'
+        exclude = SERVICE_COUNTER_FIELDS
         read_only_fields = ('created_at', 'updated_at', 'registry')
+        expandable_fields = ('contributions',)
     
     def get_is_owned_by_user(self, obj) -> bool:
         """
@@ -158,10 +258,55 @@ class ServiceSerializer(serializers.ModelSerializer):
         return obj.is_owned_by_user(self.context['request'].user)
     
 
-class RegistrySerializer(serializers.ModelSerializer):
+class ServiceBulkUpdateSerializer(serializers.ModelSerializer):
+    """
+    One item of a bulk service update: the ID of the service and the fields to change.
+    """
+    id = serializers.IntegerField()
+
+    class Meta:
+        model = models.Service
+        fields = ['id', 'name', 'description', 'hours', 'cost_per_hour', 'is_active']
+        extra_kwargs = {
+            'name': {'required': False},
+            'description': {'required': False},
+            'hours': {'required': False, 'min_value': 0},
+            'cost_per_hour': {'required': False, 'min_value': 0},
+            'is_active': {'required': False},
+        }
+
+
+class ServiceBulkDeleteSerializer(serializers.Serializer):
+    """
+    Serializer for validating the IDs of the services to delete at once.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=500)
+
+
+class ServiceSummarySerializer(serializers.ModelSerializer):
+    """
+    Compact representation of a service, without its contributions.
+    The financial fields are read from the service's funding counters.
+    """
+    total_cost = serializers.DecimalField(read_only=True, max_digits=10, decimal_places=2)
+    total_contributions = serializers.DecimalField(read_only=True, max_digits=10, decimal_places=2)
+    is_completed = serializers.BooleanField(read_only=True)
+    is_available = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = models.Service
+        fields = [
+            'id', 'registry', 'name', 'description', 'hours', 'cost_per_hour', 'is_active',
+            'total_cost', 'total_contributions', 'is_completed', 'is_available', 'updated_at',
+        ]
+        read_only_fields = fields
+
+
+class RegistrySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer for the Registry model.
     This serializer is used to convert Registry model instances to JSON format and vice versa.
+    The balance fields are only included when expanded, e.g. `?expand=stripe_balance,total_fees`.
     """
     services = ServiceSerializer(many=True, required=False)
     payouts_enabled = serializers.SerializerMethodField()
@@ -174,6 +319,7 @@ class RegistrySerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('created_at', 'updated_at',
                             'sharable_id', 'created_by')
+        expandable_fields = ('total_withdrawn', 'total_fees', 'stripe_balance')
     
     def get_payouts_enabled(self, obj) -> bool:
         """
@@ -182,61 +328,62 @@ class RegistrySerializer(serializers.ModelSerializer):
         return bool(obj.created_by.stripe_account_id)
 
     def get_total_withdrawn(self, obj) -> str:
-        """Calculates the total amount withdrawn or pending withdrawal for the registry."""
-        total = obj.withdrawals.filter(status__in=['pending', 'succeeded']).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        return str(total)
+        """Returns the total amount withdrawn or pending withdrawal for the registry."""
+        return str(obj.balance.withdrawn)
 
     def get_total_fees(self, obj) -> str:
-        """Calculates the total Stripe fees for all successful contributions to the registry."""
-        total_fees = models.Contribution.objects.filter(
-            service__registry=obj, status='succeeded'
-        ).aggregate(total=Sum('fee'))['total'] or Decimal('0.00')
-        return str(total_fees)
+        """Returns the total Stripe fees for all successful contributions to the registry."""
+        return str(obj.balance.fees)
 
     def get_stripe_balance(self, obj) -> dict:
         """
-        Calculates the user-specific available and pending balances based on contribution data.
+        Returns the user-specific available and pending balances based on contribution data.
         """
-        now = timezone.now()
-
-        # Sum of contributions that are now available
-        available_contributions = models.Contribution.objects.filter(
-            service__registry=obj, status='succeeded', available_on__lte=now
-        ).aggregate(total_amount=Sum('amount'), total_fee=Sum('fee'))
-
-        # Sum of contributions that are still pending
-        pending_contributions = models.Contribution.objects.filter(
-            service__registry=obj, status='succeeded', available_on__gt=now
-        ).aggregate(total_amount=Sum('amount'), total_fee=Sum('fee'))
-
-        net_available = (available_contributions['total_amount'] or Decimal('0.00')) - (available_contributions['total_fee'] or Decimal('0.00'))
-        net_pending = (pending_contributions['total_amount'] or Decimal('0.00')) - (pending_contributions['total_fee'] or Decimal('0.00'))
-
-        # Total already withdrawn or in the process of being withdrawn
-        total_withdrawn = obj.withdrawals.filter(status__in=['pending', 'succeeded']).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-
-        true_withdrawable_amount = net_available - total_withdrawn
-
-        return {'available': str(true_withdrawable_amount), 'pending': str(net_pending)}
+        return {'available': str(obj.balance.available), 'pending': str(obj.balance.pending)}
     
     def create(self, validated_data):
         """
         Override the create method to handle nested service creation.
-        This method allows creating a registry with associated services.
+        The registry and all its services are inserted in one transaction, the services
+        with a single bulk insert.
         """
         services_data = validated_data.pop('services', [])
         # Create the registry instance
         if 'created_by' not in validated_data:
             validated_data['created_by'] = self.context['request'].user
-        registry = models.Registry.objects.create(**validated_data)
-        # Create services associated with the registry
-        for service_data in services_data:
-            models.Service.objects.create(registry=registry, **service_data)
-        registry.refresh_from_db()
-        return registry
+        return models.Registry.objects.create_with_services(services_data, **validated_data)
+
+
+class RegistryListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """
+    Lightweight serializer for listing registries.
+    It carries the registry details and funding progress, and the services only with `?expand=services`.
+    """
+    services_count = serializers.IntegerField(source='annotated_services_count', read_only=True)
+    total_cost = serializers.DecimalField(
+        source='annotated_total_cost',
+        read_only=True,
+        max_digits=12,
+        decimal_places=2
+    )
+    total_contributions = serializers.DecimalField(
+        source='annotated_total_contributions',
+        read_only=True,
+        max_digits=12,
+        decimal_places=2
+    )
+    services = ServiceSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = models.Registry
+        fields = (
+            'id', 'name', 'is_first_time', 'babies_count', 'arrival_date', 'shareable_id',
+            'created_at', 'updated_at', 'services_count', 'total_cost', 'total_contributions', 'services',
+        )
+        expandable_fields = ('services',)
 
 
-class PublicServiceSerializer(serializers.ModelSerializer):
+class PublicServiceSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer for the Service model.
     """
@@ -262,7 +409,7 @@ class PublicServiceSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.Service
-        exclude = []
+        exclude = SERVICE_COUNTER_FIELDS
         read_only_fields = ('created_at', 'updated_at', 'registry', 'cashed_out')
     
     def get_is_owned_by_user(self, obj) -> bool:
@@ -273,7 +420,7 @@ class PublicServiceSerializer(serializers.ModelSerializer):
         return obj.is_owned_by_user(self.context['request'].user)
 
 
-class PublicRegistrySerializer(serializers.ModelSerializer):
+class PublicRegistrySerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """
     Serializer for the Registry model.
     """
@@ -0,0 +1,24 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from .catalog import bump_catalog_version
+from .models import DefaultRegistry, DefaultService
+
+
+@receiver(post_save, sender=DefaultRegistry)
+@receiver(post_delete, sender=DefaultRegistry)
+@receiver(post_save, sender=DefaultService)
+@receiver(post_delete, sender=DefaultService)
+def invalidate_catalog(sender, **kwargs):
+    """
+    Retires the cached default catalog whenever a default registry or service changes.
+    """
+    bump_catalog_version()
+
+
+@receiver(m2m_changed, sender=DefaultRegistry.default_services.through)
+def invalidate_catalog_services(sender, action, **kwargs):
+    """
+    Retires the cached default catalog when services are added to or removed from a default registry.
+    """
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_catalog_version()
@@ -0,0 +1,156 @@
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db import models
+import stripe
+
+
+stripe.api_key = settings.STRIPE_SECRET_KEY
+
+# The processing fee and the date the funds become available for a single payment.
+FeeDetails = namedtuple('FeeDetails', ['fee', 'available_on'])
+# A balance transaction reduced to what is needed to match it back to a contribution.
+BalanceTransactionRecord = namedtuple('BalanceTransactionRecord', ['created', 'payment_intent_id', 'fee_details'])
+# The balance transaction types of the charge behind a payment.
+PAYMENT_TRANSACTION_TYPES = ('charge', 'payment')
+
+
+def _from_cents(value):
+    return Decimal(value) / 100
+
+
+def _from_timestamp(value):
+    return datetime.fromtimestamp(value, tz=timezone.utc) if value else None
+
+
+class StripeGateway:
+    """
+    Wraps the Stripe API calls used to enrich contributions with fee and availability data
+    and to cancel the PaymentIntents of expired checkouts.
+    """
+
+    def fetch_fee_details(self, contribution):
+        """
+        Returns the FeeDetails for the charge behind the contribution's PaymentIntent,
+        or None when Stripe has not created the balance transaction yet.
+        The charge and its balance transaction are expanded inline, so this is a single API call.
+        """
+        payment_intent = stripe.PaymentIntent.retrieve(
+            contribution.stripe_payment_intent_id,
+            expand=['latest_charge.balance_transaction'],
+        )
+        charge = payment_intent.get('latest_charge')
+        balance_transaction = charge.get('balance_transaction') if isinstance(charge, dict) else None
+        if not isinstance(balance_transaction, dict):
+            return None
+        return FeeDetails(
+            fee=_from_cents(balance_transaction['fee']),
+            available_on=_from_timestamp(balance_transaction.get('available_on')),
+        )
+
+    def cancel_payment_intent(self, payment_intent_id):
+        """
+        Cancels the PaymentIntent so it can no longer be paid, unless it is already past the
+        point where Stripe allows that. Returns the PaymentIntent's resulting status.
+        """
+        try:
+            return stripe.PaymentIntent.cancel(payment_intent_id).status
+        except stripe.error.InvalidRequestError:
+            # Raised for a PaymentIntent that already succeeded or was canceled.
+            return stripe.PaymentIntent.retrieve(payment_intent_id).status
+
+    def list_balance_transactions(self, created_since=None, page_size=100):
+        """
+        Yields pages of BalanceTransactionRecords for payments created at or after the
+        given Unix timestamp. Each page costs a single API call, as the source charge
+        is expanded inline. Only the transactions of charges carry a payment's fee and
+        availability; refunds, disputes and adjustments, whose sources also name the
+        PaymentIntent, are skipped along with transactions without a PaymentIntent.
+        """
+        params = {'limit': page_size, 'expand': ['data.source']}
+        if created_since is not None:
+            params['created'] = {'gte': created_since}
+        page = stripe.BalanceTransaction.list(**params)
+        while True:
+            records = []
+            for transaction in page.data:
+                if transaction.get('type') not in PAYMENT_TRANSACTION_TYPES:
+                    continue
+                source = transaction.get('source')
+                payment_intent_id = source.get('payment_intent') if isinstance(source, dict) else None
+                if not payment_intent_id:
+                    continue
+                records.append(BalanceTransactionRecord(
+                    created=transaction.created,
+                    payment_intent_id=payment_intent_id,
+                    fee_details=FeeDetails(
+                        fee=_from_cents(transaction.fee),
+                        available_on=_from_timestamp(transaction.available_on),
+                    ),
+                ))
+            yield records
+            if not page.has_more:
+                break
+            page = stripe.BalanceTransaction.list(starting_after=page.data[-1].id, **params)
+
+
+class FakeStripeGateway(StripeGateway):
+    """
+    An offline stand-in for the Stripe API, used for local development and tests.
+    It derives Stripe's standard card pricing (2.9% + 30c) and a two-day payout
+    delay from the contributions themselves instead of calling Stripe.
+    """
+    PERCENT_FEE = Decimal('0.029')
+    FIXED_FEE = Decimal('0.30')
+    PAYOUT_DELAY = timedelta(days=2)
+
+    def cancel_payment_intent(self, payment_intent_id):
+        return 'canceled'
+
+    def fee_details(self, amount, created_at):
+        fee = (amount * self.PERCENT_FEE + self.FIXED_FEE).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        return FeeDetails(fee=fee, available_on=created_at + self.PAYOUT_DELAY)
+
+    def fetch_fee_details(self, contribution):
+        from .models import Contribution
+
+        # Stripe charges once per PaymentIntent, which a cart checkout shares between services.
+        payment = Contribution.objects.filter(
+            status='succeeded', stripe_payment_intent_id=contribution.stripe_payment_intent_id
+        ).aggregate(amount=models.Sum('amount'), created_at=models.Min('created_at'))
+        return self.fee_details(payment['amount'] or contribution.amount, payment['created_at'] or contribution.created_at)
+
+    def list_balance_transactions(self, created_since=None, page_size=100):
+        from .models import Contribution
+
+        contributions = Contribution.objects.filter(status='succeeded', stripe_payment_intent_id__isnull=False)
+        if created_since is not None:
+            contributions = contributions.filter(created_at__gte=_from_timestamp(created_since))
+        payments = (
+            contributions.values('stripe_payment_intent_id')
+            .annotate(amount=models.Sum('amount'), created_at=models.Min('created_at'))
+            .order_by('-created_at')
+        )
+        page = []
+        for payment in payments.iterator():
+            page.append(BalanceTransactionRecord(
+                created=int(payment['created_at'].timestamp()),
+                payment_intent_id=payment['stripe_payment_intent_id'],
+                fee_details=self.fee_details(payment['amount'], payment['created_at']),
+            ))
+            if len(page) == page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+
+def get_stripe_gateway(fake=None):
+    """
+    Returns the gateway to use for Stripe lookups.
+    The fake gateway is used when requested explicitly or when STRIPE_FAKE_MODE is enabled.
+    """
+    if fake is None:
+        fake = getattr(settings, 'STRIPE_FAKE_MODE', False)
+    return FakeStripeGateway() if fake else StripeGateway()
@@ -1,3 +1,863 @@
-from django.test import TestCase
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+import io
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from .ledger import RegistryLedger
+from . import reservations
+from .models import (
+    Contribution, DefaultRegistry, DefaultService, FundingReservation, Registry, RegistryLedgerBalance, RegistryLedgerEntry, Service, SharedRegistry, StripeEvent, Withdrawal,
+)
+from .payment_views import PaymentViewSet
+from .reconciler import (
+    BalanceTransactionSync, MissedContributionLookup, allocate_fee_details, fetch_fee_details_concurrently,
+)
+from .stripe_gateway import BalanceTransactionRecord, FeeDetails, StripeGateway
+from .webhooks import EVENT_HANDLERS, StripeEventProcessor, store_event
+import json
+import stripe
 
-# Create your tests here.
+
+User = get_user_model()
+
+
+def create_registry(owner=None, services=1, cost_per_hour=Decimal('50.00'), hours=2):
+    """
+    Creates a registry with the given number of services for the tests.
+    """
+    owner = owner or User.objects.create_user(
+        email=f"owner{User.objects.count()}@example.com", password='password', first_name='Owner',
+    )
+    registry = Registry.objects.create(name='Registry', created_by=owner)
+    for index in range(services):
+        Service.objects.create(registry=registry, name=f"Service {index}", hours=hours, cost_per_hour=cost_per_hour)
+    return registry
+
+
+def payment_intent_event(event_id, payment_intent_id, amount, metadata, event_type='payment_intent.succeeded'):
+    """
+    Builds the payload of a Stripe PaymentIntent event for the given amount in dollars.
+    """
+    return {
+        'id': event_id,
+        'type': event_type,
+        'created': int(timezone.now().timestamp()),
+        'data': {'object': {
+            'id': payment_intent_id,
+            'object': 'payment_intent',
+            'amount_received': int(amount * 100),
+            'metadata': metadata,
+        }},
+    }
+
+
+class StubStripeGateway(StripeGateway):
+    """
+    Serves fixed balance transactions, keyed by PaymentIntent ID, instead of calling Stripe.
+    """
+
+    def __init__(self):
+        self.transactions = {}
+
+    def add(self, payment_intent_id, fee, created):
+        self.transactions[payment_intent_id] = BalanceTransactionRecord(
+            created=int(created.timestamp()),
+            payment_intent_id=payment_intent_id,
+            fee_details=FeeDetails(fee=fee, available_on=created + timedelta(days=2)),
+        )
+
+    def fetch_fee_details(self, contribution):
+        record = self.transactions.get(contribution.stripe_payment_intent_id)
+        return record.fee_details if record else None
+
+    def list_balance_transactions(self, created_since=None, page_size=100):
+        records = [
+            record for record in self.transactions.values()
+            if created_since is None or record.created >= created_since
+        ]
+        yield sorted(records, key=lambda record: record.created, reverse=True)
+
+
+class BalanceTransactionSyncTests(TestCase):
+
+    def test_contribution_recorded_after_its_transaction_was_synced_is_enriched(self):
+        service = create_registry().services.get()
+        gateway = StubStripeGateway()
+        now = datetime.now(tz=dt_timezone.utc)
+        gateway.add('pi_late', Decimal('0.60'), now - timedelta(hours=1))
+        gateway.add('pi_newer', Decimal('0.90'), now)
+
+        # The webhook of pi_late has not been processed yet, so the sync moves past its transaction.
+        state = BalanceTransactionSync(gateway=gateway).run()
+        self.assertEqual(state.cursor, int(now.timestamp()))
+
+        late = Contribution.objects.create(service=service, amount=Decimal('10.00'), stripe_payment_intent_id='pi_late')
+        # Within the grace period, the contribution is left for the sync.
+        with mock.patch.object(gateway, 'fetch_fee_details', wraps=gateway.fetch_fee_details) as fetch:
+            BalanceTransactionSync(gateway=gateway).run()
+        fetch.assert_not_called()
+
+        Contribution.objects.filter(pk=late.pk).update(created_at=timezone.now() - MissedContributionLookup.grace)
+        state = BalanceTransactionSync(gateway=gateway).run()
+
+        late.refresh_from_db()
+        self.assertEqual(late.fee, Decimal('0.60'))
+        self.assertIsNotNone(late.available_on)
+        self.assertEqual(state.updated_count, 1)
+
+    def test_lookups_of_missed_contributions_are_bounded_per_run(self):
+        service = create_registry().services.get()
+        gateway = StubStripeGateway()
+        for index in range(3):
+            Contribution.objects.create(service=service, amount=Decimal('10.00'), stripe_payment_intent_id=f"pi_{index}")
+        Contribution.objects.update(created_at=timezone.now() - timedelta(hours=1))
+
+        looked_up = []
+        with mock.patch.object(gateway, 'fetch_fee_details', side_effect=lambda c: looked_up.append(c.id)):
+            for _ in range(3):
+                BalanceTransactionSync(gateway=gateway, lookup_batch_size=2).run()
+                looked_up.append('run')
+        ids = sorted(Contribution.objects.values_list('id', flat=True))
+        # Each run looks up one batch, and the next run continues after it.
+        self.assertEqual(looked_up, [*ids[:2], 'run', ids[2], 'run', 'run'])
+
+    def test_refunds_are_not_applied_as_charges(self):
+        service = create_registry().services.get()
+        contribution = Contribution.objects.create(service=service, amount=Decimal('10.00'), stripe_payment_intent_id='pi_1')
+        created = int(timezone.now().timestamp())
+        transactions = [
+            # Stripe lists newest first.
+            {'id': 'txn_refund', 'type': 'refund', 'created': created + 60, 'fee': -30, 'available_on': created + 60,
+             'source': {'object': 'refund', 'payment_intent': 'pi_1'}},
+            {'id': 'txn_charge', 'type': 'charge', 'created': created, 'fee': 59, 'available_on': created + 172800,
+             'source': {'object': 'charge', 'payment_intent': 'pi_1'}},
+        ]
+        page = stripe.StripeObject.construct_from({'data': transactions, 'has_more': False}, 'sk_test')
+
+        with mock.patch('stripe.BalanceTransaction.list', return_value=page):
+            state = BalanceTransactionSync(gateway=StripeGateway()).run()
+            contribution.refresh_from_db()
+            self.assertEqual(contribution.fee, Decimal('0.59'))
+            self.assertEqual(int(contribution.available_on.timestamp()), created + 172800)
+
+            # A later run where only the refund is after the cursor leaves the charge's details.
+            page.data = page.data[:1]
+            BalanceTransactionSync(gateway=StripeGateway()).run()
+        contribution.refresh_from_db()
+        service.refresh_from_db()
+        self.assertEqual((contribution.fee, service.fee_total), (Decimal('0.59'), Decimal('0.59')))
+        self.assertEqual(state.cursor, created)
+
+
+class FetchFeeDetailsTests(TestCase):
+
+    def test_pool_threads_close_their_connections(self):
+        service = create_registry().services.get()
+        contributions = [
+            Contribution.objects.create(service=service, amount=Decimal('10.00'), stripe_payment_intent_id=f"pi_{index}")
+            for index in range(3)
+        ]
+        failing = mock.Mock(fetch_fee_details=mock.Mock(side_effect=[None, ValueError('boom'), None]))
+        with mock.patch('registries.reconciler.connections') as connections:
+            results = fetch_fee_details_concurrently(failing, contributions, max_workers=2)
+        self.assertEqual(len(results), 3)
+        self.assertEqual(connections.close_all.call_count, 3)
+
+
+class CreateWithServicesTests(TestCase):
+
+    def test_returns_registry_with_annotated_services(self):
+        owner = User.objects.create_user(email='owner@example.com', password='password', first_name='Owner')
+        with self.assertNumQueries(5):
+            registry = Registry.objects.create_with_services(
+                [{'name': 'Meals', 'hours': 2, 'cost_per_hour': Decimal('20.00')}, {'name': 'Cleaning'}],
+                name='Registry', created_by=owner,
+            )
+        with self.assertNumQueries(0):
+            services = list(registry.services.all())
+        self.assertEqual([service.name for service in services], ['Meals', 'Cleaning'])
+        self.assertEqual(services[0].annotated_total_contributions, Decimal('0.00'))
+        self.assertTrue(services[0].annotated_is_available)
+
+
+class SharedRegistryListQueryTests(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='friend@example.com', password='password', first_name='Friend')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def share(self, count):
+        for _ in range(count):
+            registry = create_registry(services=3)
+            Contribution.objects.create(service=registry.services.first(), amount=Decimal('10.00'))
+            SharedRegistry.objects.create(registry=registry, shared_with=self.user)
+
+    def assert_queries_per_page(self, url, queries):
+        for count in (1, 5):
+            with self.subTest(url=url, shared=count):
+                SharedRegistry.objects.filter(shared_with=self.user).delete()
+                self.share(count)
+                with self.assertNumQueries(queries):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), count)
+
+    def test_full_registries_with_services_and_owners(self):
+        # The shared registries with their registries and owners, and the services.
+        self.assert_queries_per_page('/registries/shared/', 2)
+
+    def test_registries_without_services_and_owners(self):
+        self.assert_queries_per_page('/registries/shared/?fields=id,registry.name,registry.shareable_id', 1)
+
+    def test_registries_with_owners_only(self):
+        self.assert_queries_per_page('/registries/shared/?fields=id,registry.name,registry.owner_first_name', 1)
+
+    def test_registries_with_services_only(self):
+        self.assert_queries_per_page('/registries/shared/?fields=id,registry.name,registry.services', 2)
+
+
+class StripeEventProcessorTests(TestCase):
+
+    def setUp(self):
+        self.registry = create_registry()
+        self.service = self.registry.services.get()
+        self.processor = StripeEventProcessor(workers=1)
+
+    def drain(self):
+        # Lanes are drained on the test's own connection; run() would use worker threads.
+        return sum(self.processor.drain_lane(lane, 100) for lane in self.processor.busy_lanes())
+
+    def succeeded_event(self, event_id='evt_1', payment_intent_id='pi_1'):
+        return payment_intent_event(event_id, payment_intent_id, Decimal('25.00'), {'service_id': str(self.service.id)})
+
+    def test_storing_an_event_twice_keeps_one_row(self):
+        store_event(self.succeeded_event())
+        store_event(self.succeeded_event())
+        self.assertEqual(StripeEvent.objects.count(), 1)
+
+    def test_failing_event_is_retried_with_backoff_and_then_failed(self):
+        store_event(self.succeeded_event())
+        event = StripeEvent.objects.get()
+        failing = {'payment_intent.succeeded': mock.Mock(side_effect=ValueError('boom'))}
+        with mock.patch.dict('registries.webhooks.EVENT_HANDLERS', failing), self.assertLogs('registries.webhooks', 'ERROR'):
+            self.assertFalse(self.processor.process(event.id))
+            event.refresh_from_db()
+            self.assertEqual(event.status, StripeEvent.PENDING)
+            self.assertEqual(event.attempts, 1)
+            self.assertEqual(event.last_error, 'boom')
+            self.assertAlmostEqual(
+                (event.next_attempt_at - timezone.now()).total_seconds(),
+                self.processor.retry_delay(1).total_seconds(), delta=5,
+            )
+            self.assertFalse(self.processor.due_events(event.lane).exists())
+
+            for _ in range(self.processor.max_attempts - 1):
+                self.processor.process(event.id)
+        event.refresh_from_db()
+        self.assertEqual(event.status, StripeEvent.FAILED)
+        self.assertEqual(event.attempts, self.processor.max_attempts)
+        self.assertIsNone(event.next_attempt_at)
+        self.assertFalse(self.processor.process(event.id))
+
+    def test_replaying_a_processed_event_changes_nothing(self):
+        store_event(self.succeeded_event())
+        self.assertEqual(self.drain(), 1)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.SUCCEEDED)
+        balance = vars(RegistryLedger.read(self.registry))
+
+        self.assertEqual(StripeEventProcessor.replay(since=timezone.now() - timedelta(days=1)), 1)
+        self.assertEqual(self.drain(), 1)
+
+        self.service.refresh_from_db()
+        self.assertEqual(Contribution.objects.filter(stripe_payment_intent_id='pi_1').count(), 1)
+        self.assertEqual((self.service.contributed_total, self.service.contribution_count), (Decimal('25.00'), 1))
+        self.assertEqual(
+            list(RegistryLedgerEntry.objects.filter(registry=self.registry).values_list('entry_type', 'amount')),
+            [(RegistryLedgerEntry.CREDIT, Decimal('25.00'))],
+        )
+        self.registry.refresh_from_db()
+        self.assertEqual(vars(RegistryLedger.read(self.registry)), balance)
+        self.assertEqual(StripeEvent.objects.get().status, StripeEvent.SUCCEEDED)
+
+
+class FundingReservationTests(TestCase):
+
+    def setUp(self):
+        # $100 in total, of which $40 is left to fund.
+        self.service = create_registry().services.get()
+        Service.objects.adjust_totals(self.service.id, amount=Decimal('60.00'), count=1)
+
+    def hold(self, amount, payment_intent_id):
+        reservation = reservations.reserve(self.service.id, Decimal(amount))
+        return reservations.attach([reservation], payment_intent_id)[0]
+
+    def expire(self):
+        FundingReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+    def gateway(self, payment_intent_status):
+        return mock.Mock(cancel_payment_intent=mock.Mock(return_value=payment_intent_status))
+
+    def succeed(self, payment_intent_id, amount):
+        event = payment_intent_event('evt', payment_intent_id, Decimal(amount), {'service_id': str(self.service.id)})
+        EVENT_HANDLERS[event['type']](event['data']['object'])
+
+    def test_over_capacity_reservation_is_rejected(self):
+        self.hold('30.00', 'pi_1')
+        with self.assertRaisesMessage(reservations.ReservationError, "Only $10.00 of 'Service 0' is left to fund."):
+            reservations.reserve(self.service.id, Decimal('20.00'))
+
+    def test_expired_hold_is_released_once_its_payment_intent_is_canceled(self):
+        reservation = self.hold('30.00', 'pi_1')
+        self.expire()
+        gateway = self.gateway('canceled')
+
+        self.assertEqual(reservations.release_expired(gateway=gateway), 1)
+
+        gateway.cancel_payment_intent.assert_called_once_with('pi_1')
+        reservation.refresh_from_db()
+        self.service.refresh_from_db()
+        self.assertEqual(reservation.status, FundingReservation.RELEASED)
+        self.assertEqual(self.service.reserved_total, Decimal('0.00'))
+
+    def test_expiry_followed_by_late_success_never_overfunds(self):
+        reservation = self.hold('30.00', 'pi_late')
+        self.expire()
+
+        # The contributor paid just before the hold expired, so Stripe can no longer cancel it.
+        self.assertEqual(reservations.release_expired(gateway=self.gateway('succeeded')), 0)
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, FundingReservation.HELD)
+        self.assertGreater(reservation.expires_at, timezone.now())
+        with self.assertRaises(reservations.ReservationError):
+            reservations.reserve(self.service.id, Decimal('30.00'))
+
+        # A new checkout does not release the hold either.
+        self.expire()
+        with self.assertRaises(reservations.ReservationError):
+            reservations.reserve(self.service.id, Decimal('30.00'))
+
+        self.succeed('pi_late', '30.00')
+        reservation.refresh_from_db()
+        self.service.refresh_from_db()
+        self.assertEqual(reservation.status, FundingReservation.CONVERTED)
+        self.assertEqual((self.service.contributed_total, self.service.reserved_total), (Decimal('90.00'), Decimal('0.00')))
+        with self.assertRaises(reservations.ReservationError):
+            reservations.reserve(self.service.id, Decimal('30.00'))
+
+    def test_success_locks_the_ledger_before_settling_the_hold(self):
+        self.hold('30.00', 'pi_1')
+        calls = mock.Mock()
+        with mock.patch.object(RegistryLedger, 'lock', side_effect=RegistryLedger.lock) as lock, \
+                mock.patch.object(reservations, 'settle', side_effect=reservations.settle) as settle:
+            calls.attach_mock(lock, 'lock')
+            calls.attach_mock(settle, 'settle')
+            self.succeed('pi_1', '30.00')
+        self.assertEqual([name for name, _, _ in calls.mock_calls], ['lock', 'settle'])
+        self.service.refresh_from_db()
+        self.assertEqual((self.service.contributed_total, self.service.reserved_total), (Decimal('90.00'), Decimal('0.00')))
+
+    def test_failed_payment_keeps_its_hold(self):
+        reservation = self.hold('30.00', 'pi_1')
+        self.assertNotIn('payment_intent.payment_failed', EVENT_HANDLERS)
+        EVENT_HANDLERS['payment_intent.canceled']({'id': 'pi_other'})
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, FundingReservation.HELD)
+
+        EVENT_HANDLERS['payment_intent.canceled']({'id': 'pi_1'})
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, FundingReservation.RELEASED)
+
+    @override_settings(FUNDING_RESERVATION_TTL=600)
+    def test_client_secret_is_cached_no_longer_than_the_hold(self):
+        self.assertEqual(PaymentViewSet.payment_intent_cache_timeout(), 600)
+
+    def test_repeat_request_returns_the_same_payment_intent_without_a_second_hold(self):
+        payment_intent = SimpleNamespace(id='pi_1', client_secret='secret')
+        body = json.dumps({'service_id': self.service.id, 'amount': '30.00', 'idempotency_key': 'key'})
+        client = APIClient()
+        with mock.patch('stripe.PaymentIntent.create', return_value=payment_intent) as create:
+            responses = [
+                client.post('/registries/payments/create-payment-intent/', body, content_type='application/json')
+                for _ in range(2)
+            ]
+        self.assertEqual([response.json() for response in responses], [{'clientSecret': 'secret'}] * 2)
+        create.assert_called_once()
+        self.service.refresh_from_db()
+        self.assertEqual(self.service.reserved_total, Decimal('30.00'))
+        self.assertEqual(FundingReservation.objects.get().stripe_payment_intent_id, 'pi_1')
+
+    def test_repeat_request_missing_the_cache_releases_its_second_hold(self):
+        payment_intent = SimpleNamespace(id='pi_1', client_secret='secret')
+        body = json.dumps({'service_id': self.service.id, 'amount': '20.00', 'idempotency_key': 'key'})
+        client = APIClient()
+        with mock.patch('stripe.PaymentIntent.create', return_value=payment_intent) as create:
+            client.post('/registries/payments/create-payment-intent/', body, content_type='application/json')
+            cache.clear()
+            # Stripe returns the PaymentIntent of the first request for the same idempotency key.
+            response = client.post('/registries/payments/create-payment-intent/', body, content_type='application/json')
+        self.assertEqual(response.json(), {'clientSecret': 'secret'})
+        self.assertEqual(create.call_args_list[0], create.call_args_list[1])
+        self.service.refresh_from_db()
+        self.assertEqual(self.service.reserved_total, Decimal('20.00'))
+        self.assertEqual(
+            list(FundingReservation.objects.order_by('id').values_list('status', 'stripe_payment_intent_id')),
+            [(FundingReservation.HELD, 'pi_1'), (FundingReservation.RELEASED, None)],
+        )
+
+    def test_repeat_request_for_a_canceled_checkout_is_rejected(self):
+        payment_intent = SimpleNamespace(id='pi_1', client_secret='secret')
+        body = json.dumps({'service_id': self.service.id, 'amount': '30.00', 'idempotency_key': 'key'})
+        client = APIClient()
+        with mock.patch('stripe.PaymentIntent.create', return_value=payment_intent):
+            response = client.post('/registries/payments/create-payment-intent/', body, content_type='application/json')
+            self.assertEqual(response.json(), {'clientSecret': 'secret'})
+
+            self.expire()
+            reservations.release_expired(gateway=self.gateway('canceled'))
+            cache.clear()
+            # Stripe returns the canceled PaymentIntent again for the same idempotency key.
+            response = client.post('/registries/payments/create-payment-intent/', body, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.service.refresh_from_db()
+        self.assertEqual(self.service.reserved_total, Decimal('0.00'))
+
+
+class CartCheckoutTests(TestCase):
+
+    def setUp(self):
+        # Three services of $100 each.
+        self.registry = create_registry(services=3)
+        self.services = list(self.registry.services.order_by('id'))
+        self.amounts = [Decimal('20.00'), Decimal('33.33'), Decimal('15.01')]
+        self.event = payment_intent_event('evt_cart', 'pi_cart', sum(self.amounts), {
+            'registry_id': str(self.registry.id),
+            'allocations': json.dumps({str(service.id): str(amount) for service, amount in zip(self.services, self.amounts)}),
+            'contributor_name': 'Ada',
+        })
+
+    def test_replayed_cart_webhook_records_each_contribution_once(self):
+        for _ in range(2):
+            EVENT_HANDLERS['payment_intent.succeeded'](self.event['data']['object'])
+
+        contributions = Contribution.objects.filter(stripe_payment_intent_id='pi_cart').order_by('service_id')
+        self.assertEqual(
+            list(contributions.values_list('service_id', 'amount')),
+            [(service.id, amount) for service, amount in zip(self.services, self.amounts)],
+        )
+        for service, amount in zip(self.services, self.amounts):
+            service.refresh_from_db()
+            self.assertEqual((service.contributed_total, service.contribution_count), (amount, 1))
+        credits = RegistryLedgerEntry.objects.filter(registry=self.registry, entry_type=RegistryLedgerEntry.CREDIT)
+        self.assertEqual(sorted(credits.values_list('amount', flat=True)), sorted(self.amounts))
+        with transaction.atomic():
+            self.assertEqual(RegistryLedger.lock(self.registry.id).checkpoint(), {})
+
+    def test_fee_shares_add_up_to_the_payment_intent_fee(self):
+        EVENT_HANDLERS['payment_intent.succeeded'](self.event['data']['object'])
+        contributions = list(Contribution.objects.filter(stripe_payment_intent_id='pi_cart'))
+        for fee in (Decimal('2.28'), Decimal('0.01'), Decimal('1.00'), Decimal('0.00')):
+            with self.subTest(fee=fee):
+                details = FeeDetails(fee=fee, available_on=timezone.now())
+                shares = allocate_fee_details(contributions, details)
+                self.assertEqual(sum(share.fee for _, share in shares), fee)
+                self.assertEqual({contribution.id for contribution, _ in shares}, {c.id for c in contributions})
+
+        gateway = StubStripeGateway()
+        gateway.add('pi_cart', Decimal('2.28'), timezone.now())
+        BalanceTransactionSync(gateway=gateway).run()
+        fees = Contribution.objects.filter(stripe_payment_intent_id='pi_cart').values_list('fee', flat=True)
+        self.assertEqual(sum(fees), Decimal('2.28'))
+        self.assertEqual(
+            sum(Service.objects.filter(registry=self.registry).values_list('fee_total', flat=True)), Decimal('2.28'),
+        )
+
+    def test_reserve_many_holds_every_amount_or_none(self):
+        Service.objects.adjust_totals(self.services[2].id, amount=Decimal('90.00'), count=1)
+        allocations = {service.id: amount for service, amount in zip(self.services, self.amounts)}
+
+        with self.assertRaises(reservations.ReservationError):
+            reservations.reserve_many(allocations, registry_id=self.registry.id)
+        self.assertFalse(FundingReservation.objects.exists())
+        self.assertFalse(Service.objects.filter(reserved_total__gt=0).exists())
+
+        allocations[self.services[2].id] = Decimal('10.00')
+        held = reservations.reserve_many(allocations, registry_id=self.registry.id)
+        self.assertEqual([reservation.amount for reservation in held], [Decimal('20.00'), Decimal('33.33'), Decimal('10.00')])
+        self.assertEqual(
+            list(Service.objects.filter(registry=self.registry).order_by('id').values_list('reserved_total', flat=True)),
+            [Decimal('20.00'), Decimal('33.33'), Decimal('10.00')],
+        )
+
+    def test_reserve_many_rejects_services_of_other_registries(self):
+        other = create_registry().services.get()
+        with self.assertRaises(Service.DoesNotExist):
+            reservations.reserve_many({self.services[0].id: Decimal('10.00'), other.id: Decimal('10.00')}, registry_id=self.registry.id)
+        self.assertFalse(FundingReservation.objects.exists())
+
+
+class RegistryBalanceTests(TestCase):
+
+    def setUp(self):
+        self.registry = create_registry()
+        service = self.registry.services.get()
+        now = timezone.now()
+        for amount, fee, available_on, payment_intent_id in (
+            (Decimal('30.00'), Decimal('1.17'), now - timedelta(days=1), 'pi_settled'),
+            (Decimal('20.00'), Decimal('0.88'), now + timedelta(days=1), 'pi_pending'),
+            (Decimal('10.00'), Decimal('0.00'), None, 'pi_unenriched'),
+        ):
+            Contribution.objects.create(
+                service=service, amount=amount, fee=fee, available_on=available_on, stripe_payment_intent_id=payment_intent_id,
+            )
+        Withdrawal.objects.create(registry=self.registry, amount=Decimal('5.00'), status='succeeded', stripe_transfer_id='tr_1')
+        self.client = APIClient()
+
+    def test_balance_of_own_registry(self):
+        self.client.force_authenticate(self.registry.created_by)
+        response = self.client.get(f'/registries/r/{self.registry.id}/balance/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {
+            'available': '23.83',
+            'pending': '19.12',
+            'fees': '2.05',
+            'withdrawn': '5.00',
+        })
+
+    def test_retrieve_leaves_enrichment_to_the_reconciler(self):
+        self.client.force_authenticate(self.registry.created_by)
+        with mock.patch.object(StripeGateway, 'fetch_fee_details') as fetch, mock.patch('threading.Thread') as thread:
+            self.assertEqual(self.client.get(f'/registries/r/{self.registry.id}/').status_code, 200)
+        fetch.assert_not_called()
+        thread.assert_not_called()
+        self.assertIsNone(Contribution.objects.get(stripe_payment_intent_id='pi_unenriched').available_on)
+
+    def test_balance_of_another_users_registry_is_not_found(self):
+        self.client.force_authenticate(User.objects.create_user(email='other@example.com', password='password'))
+        self.assertEqual(self.client.get(f'/registries/r/{self.registry.id}/balance/').status_code, 404)
+
+
+class RegistryLedgerTests(TestCase):
+
+    def setUp(self):
+        self.registry = create_registry()
+        self.service = self.registry.services.get()
+
+    def ledger(self):
+        return RegistryLedger.lock(self.registry.id)
+
+    def assert_balance(self, **expected):
+        balance = vars(RegistryLedger.read(Registry.objects.select_related('ledger_balance').get(pk=self.registry.pk)))
+        self.assertEqual(balance, {field: Decimal(value).quantize(Decimal('0.01')) for field, value in expected.items()})
+
+    @transaction.atomic
+    def record_contribution(self, amount, payment_intent_id):
+        # The ledger is locked before the contribution is written, as in the webhook handler.
+        ledger = self.ledger()
+        contribution = Contribution.objects.create(service=self.service, amount=Decimal(amount), stripe_payment_intent_id=payment_intent_id)
+        ledger.credit(contribution)
+        return contribution
+
+    @transaction.atomic
+    def enrich(self, contribution, fee, available_on):
+        fee_delta = Decimal(fee) - contribution.fee
+        contribution.fee, contribution.available_on = Decimal(fee), available_on
+        contribution.save()
+        self.ledger().charge_fee(contribution, fee_delta)
+
+    def test_credit_fee_settle_and_debit(self):
+        now = timezone.now()
+        first = self.record_contribution('30.00', 'pi_1')
+        second = self.record_contribution('20.00', 'pi_2')
+        # Credits count once Stripe reports when their funds become available.
+        self.assert_balance(available='0', pending='0', fees='0', withdrawn='0')
+
+        self.enrich(first, '1.17', now + timedelta(days=2))
+        self.assert_balance(available='0', pending='28.83', fees='1.17', withdrawn='0')
+        self.enrich(second, '0.88', now - timedelta(days=1))
+        self.assert_balance(available='19.12', pending='28.83', fees='2.05', withdrawn='0')
+
+        with transaction.atomic():
+            self.assertEqual(self.ledger().settle(now + timedelta(days=1)), 0)
+            self.assertEqual(self.ledger().settle(now + timedelta(days=3)), 2)
+        self.assert_balance(available='47.95', pending='0', fees='2.05', withdrawn='0')
+
+        with transaction.atomic():
+            withdrawal = Withdrawal.objects.create(registry=self.registry, amount=Decimal('40.00'), stripe_transfer_id='tr_1')
+            self.ledger().debit(withdrawal)
+        self.assert_balance(available='7.95', pending='0', fees='2.05', withdrawn='40.00')
+
+        with transaction.atomic():
+            self.assertEqual(self.ledger().checkpoint(), {})
+
+    def test_checkpoint_corrects_drift(self):
+        contribution = self.record_contribution('30.00', 'pi_1')
+        self.enrich(contribution, '1.17', timezone.now() - timedelta(days=1))
+        self.assert_balance(available='28.83', pending='0', fees='1.17', withdrawn='0')
+        RegistryLedgerBalance.objects.filter(registry=self.registry).update(available=Decimal('99.00'))
+
+        with transaction.atomic(), self.assertLogs('registries.ledger', 'WARNING'):
+            drift = self.ledger().checkpoint()
+        self.assertEqual(drift, {'available': (Decimal('99.00'), Decimal('28.83'))})
+        self.assert_balance(available='28.83', pending='0', fees='1.17', withdrawn='0')
+
+    def test_settle_command_settles_due_entries_and_reports_drift(self):
+        contribution = self.record_contribution('30.00', 'pi_1')
+        self.enrich(contribution, '1.17', timezone.now() + timedelta(days=2))
+        RegistryLedgerEntry.objects.filter(registry=self.registry).update(available_on=timezone.now() - timedelta(minutes=1))
+        RegistryLedgerBalance.objects.filter(registry=self.registry).update(fees=Decimal('5.00'))
+
+        out = io.StringIO()
+        with self.assertLogs('registries.ledger', 'WARNING'):
+            call_command('settle_registry_ledgers', '--checkpoint', stdout=out)
+        self.assertIn('Settled 2 ledger entries.', out.getvalue())
+        self.assertIn(f"Corrected drifted balances of registries: [{self.registry.id}]", out.getvalue())
+        self.assert_balance(available='28.83', pending='0', fees='1.17', withdrawn='0')
+
+
+class ServiceRepresentationTests(TestCase):
+
+    def setUp(self):
+        self.registry = create_registry(services=1)
+        self.owner = self.registry.created_by
+        Service.objects.adjust_totals(self.registry.services.get().pk, Decimal('10.00'), Decimal('0.59'), 1)
+
+    def assert_no_counters(self, service):
+        for field in ('contributed_total', 'fee_total', 'contribution_count', 'reserved_total'):
+            self.assertNotIn(field, service)
+
+    def test_public_registry_hides_funding_counters(self):
+        response = APIClient().get(f"/registries/public/{self.registry.shareable_id}/")
+        self.assertEqual(response.status_code, 200)
+        service = response.json()['services'][0]
+        self.assertEqual(service['total_contributions'], '10.00')
+        self.assert_no_counters(service)
+
+        response = APIClient().get(f"/registries/public/{self.registry.shareable_id}/services/")
+        self.assertEqual(response.status_code, 200)
+        self.assert_no_counters(response.json()['results'][0])
+
+    def test_owned_services_hide_funding_counters(self):
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.get('/registries/services/')
+        self.assertEqual(response.status_code, 200)
+        self.assert_no_counters(response.json()['results'][0])
+
+
+class ContributionListTests(TestCase):
+
+    def setUp(self):
+        self.registry = create_registry(services=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.registry.created_by)
+        self.now = timezone.now()
+        first, second = self.registry.services.order_by('id')
+        self.contributions = [
+            self.contribute(first, '10.00', '0.59', 'succeeded', days_ago=3),
+            self.contribute(second, '20.00', '0.88', 'succeeded', days_ago=2),
+            self.contribute(first, '5.00', '0.00', 'failed', days_ago=1),
+            self.contribute(second, '15.00', '0.74', 'succeeded', days_ago=0),
+        ]
+        self.url = f"/registries/r/{self.registry.id}/contributions/"
+
+    def contribute(self, service, amount, fee, status, days_ago):
+        contribution = Contribution.objects.create(service=service, amount=Decimal(amount), fee=Decimal(fee), status=status)
+        Contribution.objects.filter(pk=contribution.pk).update(created_at=self.now - timedelta(days=days_ago))
+        return contribution
+
+    def ids(self, response):
+        return [contribution['id'] for contribution in response.json()['results']]
+
+    def test_pages_through_contributions_newest_first(self):
+        response = self.client.get(self.url, {'page_size': 3})
+        self.assertEqual(response.status_code, 200)
+        newest_first = [contribution.id for contribution in reversed(self.contributions)]
+        self.assertEqual(self.ids(response), newest_first[:3])
+        self.assertIsNone(response.json()['previous'])
+
+        response = self.client.get(response.json()['next'])
+        self.assertEqual(self.ids(response), newest_first[3:])
+        self.assertIsNone(response.json()['next'])
+
+        response = self.client.get(response.json()['previous'])
+        self.assertEqual(self.ids(response), newest_first[:3])
+
+    def test_summary_headers_cover_all_pages(self):
+        response = self.client.get(self.url, {'page_size': 1})
+        self.assertEqual(len(response.json()['results']), 1)
+        self.assertEqual(response['X-Contributions-Count'], '4')
+        self.assertEqual(Decimal(response['X-Contributions-Amount']), Decimal('50.00'))
+        self.assertEqual(Decimal(response['X-Contributions-Fees']), Decimal('2.21'))
+
+    def test_filters_by_status_and_creation_date(self):
+        response = self.client.get(self.url, {'status': 'succeeded'})
+        self.assertEqual(self.ids(response), [self.contributions[3].id, self.contributions[1].id, self.contributions[0].id])
+        self.assertEqual(response['X-Contributions-Count'], '3')
+        self.assertEqual(Decimal(response['X-Contributions-Amount']), Decimal('45.00'))
+
+        created_after = (self.now - timedelta(days=2, hours=1)).isoformat()
+        response = self.client.get(self.url, {'status': 'succeeded', 'created_after': created_after})
+        self.assertEqual(self.ids(response), [self.contributions[3].id, self.contributions[1].id])
+        self.assertEqual(Decimal(response['X-Contributions-Fees']), Decimal('1.62'))
+
+        response = self.client.get(self.url, {'created_after': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ServiceBulkTests(TestCase):
+    url = '/registries/services/bulk/'
+
+    def setUp(self):
+        self.registry = create_registry(services=2)
+        self.first, self.second = self.registry.services.order_by('id')
+        self.other = create_registry(services=1).services.get()
+        self.client = APIClient()
+        self.client.force_authenticate(self.registry.created_by)
+
+    def patch(self, data):
+        return self.client.patch(self.url, data, format='json')
+
+    def delete(self, ids):
+        return self.client.delete(self.url, {'ids': ids}, format='json')
+
+    def test_updates_the_listed_services(self):
+        response = self.patch([
+            {'id': self.first.id, 'name': 'Meals', 'cost_per_hour': '30.00'},
+            {'id': self.second.id, 'is_active': False},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(service['id'] for service in response.json()), [self.first.id, self.second.id])
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.name, self.first.cost_per_hour), ('Meals', Decimal('30.00')))
+        self.assertFalse(self.second.is_active)
+
+    def test_rejects_invalid_values(self):
+        for item in ({'cost_per_hour': '-1.00'}, {'cost_per_hour': 'abc'}, {'hours': -1}):
+            with self.subTest(item=item):
+                response = self.patch([{'id': self.first.id, 'name': 'Meals'}, {'id': self.second.id, **item}])
+                self.assertEqual(response.status_code, 400)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.name, 'Service 0')
+
+    def test_rejects_a_service_listed_twice(self):
+        response = self.patch([{'id': self.first.id, 'name': 'Meals'}, {'id': self.first.id, 'name': 'Cleaning'}])
+        self.assertEqual(response.status_code, 400)
+
+    def test_other_users_and_missing_services_are_not_found_alike(self):
+        missing_id = Service.objects.order_by('-id').first().id + 1
+        responses = {
+            service_id: self.patch([{'id': self.first.id, 'name': 'Meals'}, {'id': service_id, 'name': 'Taken'}])
+            for service_id in (self.other.id, missing_id)
+        }
+        for service_id, response in responses.items():
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json(), {'detail': f"Services [{service_id}] were not found."})
+        self.first.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(self.first.name, 'Service 0')
+        self.assertEqual(self.other.name, 'Service 0')
+
+    def test_requires_authentication(self):
+        self.client.force_authenticate(None)
+        self.assertEqual(self.patch([{'id': self.first.id, 'name': 'Meals'}]).status_code, 401)
+        self.assertEqual(self.delete([self.first.id]).status_code, 401)
+
+    def test_deletes_the_listed_services(self):
+        response = self.delete([self.first.id, self.second.id])
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(Service.objects.filter(registry=self.registry).exists())
+
+    def test_deletes_none_when_any_service_has_contributions(self):
+        Contribution.objects.create(service=self.second, amount=Decimal('10.00'))
+        response = self.delete([self.first.id, self.second.id])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {'detail': f"Cannot delete services that have contributions: [{self.second.id}]."})
+        self.assertEqual(Service.objects.filter(registry=self.registry).count(), 2)
+
+    def test_deletes_none_when_any_service_is_not_owned(self):
+        response = self.delete([self.first.id, self.other.id])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(Service.objects.filter(pk__in=[self.first.id, self.other.id]).count(), 2)
+
+
+class DefaultCatalogCacheTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.service = DefaultService.objects.create(name='Meals', hours=2, cost_per_hour=Decimal('20.00'))
+        self.registry = DefaultRegistry.objects.create(name='Newborn')
+        self.registry.default_services.add(self.service)
+
+    def get(self, url, etag=None):
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag) if etag else self.client.get(url)
+
+    def test_editing_a_default_service_changes_the_etag(self):
+        url = '/registries/services/default/'
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.get(url, etag).status_code, 304)
+
+        self.service.name = 'Warm meals'
+        self.service.save()
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        names = {service['id']: service['name'] for service in response.json()['results']}
+        self.assertEqual(names[self.service.id], 'Warm meals')
+        self.assertEqual(self.get(url, response['ETag']).status_code, 304)
+
+    def test_adding_a_service_to_a_default_registry_changes_the_etag(self):
+        url = '/registries/default/'
+        etag = self.get(url)['ETag']
+        self.registry.default_services.add(DefaultService.objects.create(name='Cleaning'))
+
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        registry = next(registry for registry in response.json()['results'] if registry['id'] == self.registry.id)
+        self.assertEqual([service['name'] for service in registry['services']], ['Meals', 'Cleaning'])
+
+
+class PublicServiceOrderingTests(TestCase):
+
+    def setUp(self):
+        self.registry = create_registry(services=4)
+        self.unfunded, self.half, self.free, self.other_half = self.registry.services.order_by('id')
+        Service.objects.filter(pk=self.free.pk).update(cost_per_hour=Decimal('0.00'))
+        for service in (self.half, self.other_half):
+            Service.objects.adjust_totals(service.pk, Decimal('50.00'))
+        self.url = f"/registries/public/{self.registry.shareable_id}/services/"
+
+    def page_through(self, ordering):
+        ids = []
+        response = APIClient().get(self.url, {'ordering': ordering, 'page_size': 1})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(service['id'] for service in response.json()['results'])
+            if not response.json()['next']:
+                return ids
+            response = APIClient().get(response.json()['next'])
+
+    def test_pages_by_progress_with_services_without_cost_last(self):
+        self.assertEqual(
+            self.page_through('progress'),
+            [self.unfunded.id, self.half.id, self.other_half.id, self.free.id],
+        )
+
+    def test_pages_by_descending_progress(self):
+        self.assertEqual(
+            self.page_through('-progress'),
+            [self.free.id, self.other_half.id, self.half.id, self.unfunded.id],
+        )
@@ -1,89 +1,141 @@
 from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from django.db import transaction
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
-from django.db.models import Q, Sum
+from django.db.models import Count, Exists, OuterRef, Prefetch, Sum
 from django.utils import timezone
 import stripe
 from django.conf import settings
 from utilities.email import EmailDispatcher
 import logging
 from accounts.models import OTPRequest
-from drf_spectacular.utils import extend_schema
+from drf_spectacular.utils import OpenApiParameter, extend_schema
 from . import models, serializers
+from .catalog import cached_catalog_response
+from .fieldsets import FieldSelection
+from .filters import SERVICE_ORDERINGS, ContributionFilter, ServiceFilter, service_ordering
+from .pagination import ContributionPagination
+from .ledger import RegistryLedger
 import threading
-from decimal import Decimal
-from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+CONTRIBUTION_LIST_PARAMETERS = [
+    OpenApiParameter('status', str, description="Comma-separated statuses, e.g. succeeded,failed."),
+    OpenApiParameter('created_after', str, description="Only contributions created at or after this ISO 8601 datetime."),
+    OpenApiParameter('created_before', str, description="Only contributions created before this ISO 8601 datetime."),
+    OpenApiParameter('is_available', bool, description="Whether the contribution's funds are available for withdrawal."),
+    OpenApiParameter('cursor', str, description="The pagination cursor value."),
+    OpenApiParameter('page_size', int, description="Number of results to return per page, at most 200."),
+]
 
-class RegistryViewSet(viewsets.ModelViewSet):
+
+class ContributionListMixin:
+    """
+    Serves contributions filtered with ContributionFilter and keyset paginated, newest first.
+    The count and totals of the filtered contributions are returned in the
+    X-Contributions-Count, X-Contributions-Amount and X-Contributions-Fees headers.
+    """
+
+    def list_contributions(self, request, contributions):
+        filterset = ContributionFilter(request.query_params, queryset=contributions, request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        contributions = filterset.qs
+
+        totals = contributions.aggregate(count=Count('id'), amount=Sum('amount'), fees=Sum('fee'))
+        paginator = ContributionPagination()
+        page = paginator.paginate_queryset(contributions, request)
+        serializer = serializers.ContributionSerializer(page, many=True)
+        response = paginator.get_paginated_response(serializer.data)
+        response['X-Contributions-Count'] = totals['count']
+        response['X-Contributions-Amount'] = totals['amount'] or '0.00'
+        response['X-Contributions-Fees'] = totals['fees'] or '0.00'
+        return response
+
+
+class RegistryViewSet(ContributionListMixin, viewsets.ModelViewSet):
     """
     A base viewset for registry-related operations.
     This can be extended by other viewsets to implement specific registry functionalities.
     """
     queryset = models.Registry.objects.all()
     permission_classes = [permissions.IsAuthenticated]
+    ordering = ('-created_at', '-id')
+    page_size = 20
 
     def get_queryset(self):
         """
         Override the default queryset to filter registries based on the user's ownership.
         This ensures that users can only access registries they have created.
         """
-        return self.queryset.filter(created_by=self.request.user)
+        queryset = self.queryset.filter(created_by=self.request.user)
+        selection = FieldSelection.from_request(self.request)
+        if self.action == 'list':
+            # The list serializer returns progress totals and only nests services when expanded.
+            if selection.includes_any('services_count', 'total_cost', 'total_contributions'):
+                queryset = queryset.with_progress()
+            if selection.includes('services', expandable=True):
+                queryset = queryset.prefetch_related(self.services_prefetch(selection))
+            return queryset
+        if self.action in ('retrieve', 'update', 'partial_update'):
+            # Load only what the requested fields of RegistrySerializer read, so the number
+            # of queries does not grow with services or contributions.
+            if selection.includes('payouts_enabled'):
+                queryset = queryset.select_related('created_by')
+            if selection.includes_any('total_withdrawn', 'total_fees', 'stripe_balance', expandable=True):
+                queryset = queryset.select_related('ledger_balance')
+            if selection.includes('services'):
+                queryset = queryset.prefetch_related(self.services_prefetch(selection))
+            return queryset
+        if self.action == 'balance':
+            return queryset.select_related('ledger_balance')
+        return queryset
+
+    @staticmethod
+    def services_prefetch(selection):
+        """
+        Returns the prefetch of the registries' services with their financial annotations,
+        and their contributions only when `services.contributions` is expanded.
+        """
+        services = models.Service.objects.with_financials()
+        if selection.includes('services.contributions', expandable=True):
+            services = services.prefetch_related('contributions')
+        return Prefetch('services', queryset=services)
 
     def get_serializer_class(self):
         """
         Return the appropriate serializer class based on the request action.
         """
-        if self.action == 'create':
-            return serializers.RegistrySerializer
+        if self.action == 'list':
+            return serializers.RegistryListSerializer
         return serializers.RegistrySerializer
 
-    def retrieve(self, request, *args, **kwargs):
+    @extend_schema(responses={200: serializers.RegistryBalanceSerializer()})
+    @action(detail=True, methods=['get'])
+    def balance(self, request, pk=None):
         """
-        Override retrieve to enrich the response with real-time Stripe balance information.
-        This method also lazily updates contribution records with fee and availability data.
+        Returns the financial summary of the registry without its nested services.
+        This is a lightweight endpoint for polling balances.
         """
-        instance = self.get_object()
-
-        # --- START of new lazy-loading logic ---
-        contributions_to_update = models.Contribution.objects.filter(
-            service__registry=instance,
-            status='succeeded',
-            available_on__isnull=True  # Find contributions that need updating
-        )
-
-        updated_contributions = []
-        for contrib in contributions_to_update:
-            try:
-                print(f"[LAZY LOAD] Updating contribution for PI: {contrib.stripe_payment_intent_id}")
-                payment_intent = stripe.PaymentIntent.retrieve(contrib.stripe_payment_intent_id)
-                charge_id = payment_intent.get('latest_charge')
-
-                if charge_id:
-                    charge = stripe.Charge.retrieve(charge_id)
-                    balance_transaction_id = charge.get('balance_transaction')
-                    if balance_transaction_id:
-                        balance_transaction = stripe.BalanceTransaction.retrieve(balance_transaction_id)
-                        contrib.fee = Decimal(balance_transaction.fee) / 100
-                        if balance_transaction.available_on:
-                            contrib.available_on = datetime.fromtimestamp(balance_transaction.available_on, tz=timezone.utc)
-                        updated_contributions.append(contrib)
-            except Exception as e:
-                logger.error(f"Failed to lazily update contribution {contrib.id}: {e}", exc_info=True)
-        
-        if updated_contributions:
-            models.Contribution.objects.bulk_update(updated_contributions, ['fee', 'available_on'])
-            print(f"[LAZY LOAD] Bulk updated {len(updated_contributions)} contributions.")
-        # --- END of new lazy-loading logic ---
-
-        # The serializer now handles all financial calculations.
-        serializer = self.get_serializer(instance)
+        registry = self.get_object()
+        serializer = serializers.RegistryBalanceSerializer(registry.balance)
         return Response(serializer.data)
 
+    @extend_schema(parameters=CONTRIBUTION_LIST_PARAMETERS, responses={200: serializers.ContributionSerializer(many=True)})
+    @action(detail=True, methods=['get'])
+    def contributions(self, request, pk=None):
+        """
+        Returns the contributions to all services of the registry, newest first.
+        Supports the `status`, `created_after`, `created_before` and `is_available` filters
+        and is paginated with the `cursor` and `page_size` parameters.
+        """
+        registry = self.get_object()
+        return self.list_contributions(request, models.Contribution.objects.filter(service__registry=registry))
+
     @action(detail=False, methods=['post'], url_path='create-connect-account')
     def create_stripe_connect_account(self, request):
         """
@@ -137,7 +189,7 @@ class RegistryViewSet(viewsets.ModelViewSet):
         registry = self.get_object()
         user = request.user
 
-        if registry.created_by != user:
+        if registry.created_by_id != user.pk:
             return Response({"detail": "You do not have permission to withdraw from this registry."}, status=status.HTTP_403_FORBIDDEN)
 
         try:
@@ -146,14 +198,7 @@ class RegistryViewSet(viewsets.ModelViewSet):
             amount = serializer.validated_data['amount']
 
             # Re-calculate the true withdrawable amount for validation
-            now = timezone.now()
-            available_contributions = models.Contribution.objects.filter(
-                service__registry=registry, status='succeeded', available_on__lte=now
-            ).aggregate(total_amount=Sum('amount'), total_fee=Sum('fee'))
-            net_available = (available_contributions['total_amount'] or Decimal('0.00')) - (available_contributions['total_fee'] or Decimal('0.00'))
-            total_withdrawn = registry.withdrawals.filter(status__in=['pending', 'succeeded']).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-            
-            available_balance = net_available - total_withdrawn
+            available_balance = registry.balance.available
             if amount > available_balance:
                 return Response({"detail": f"Withdrawal amount exceeds available balance of ${available_balance:.2f}."}, status=status.HTTP_400_BAD_REQUEST)
 
@@ -188,7 +233,7 @@ class RegistryViewSet(viewsets.ModelViewSet):
         registry = self.get_object()
         user = request.user
 
-        if registry.created_by != user:
+        if registry.created_by_id != user.pk:
             return Response({"detail": "You do not have permission to withdraw from this registry."}, status=status.HTTP_403_FORBIDDEN)
 
         if not user.stripe_account_id:
@@ -206,16 +251,10 @@ class RegistryViewSet(viewsets.ModelViewSet):
         if not otp_entry or not otp_entry.is_valid(device_identity):
             return Response({'detail': 'Invalid or expired verification code.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        # Final, definitive balance check before initiating transfer
-        now = timezone.now()
-        available_contributions = models.Contribution.objects.filter(
-            service__registry=registry, status='succeeded', available_on__lte=now
-        ).aggregate(total_amount=Sum('amount'), total_fee=Sum('fee'))
-        
-        net_available = (available_contributions['total_amount'] or Decimal('0.00')) - (available_contributions['total_fee'] or Decimal('0.00'))
-        total_withdrawn = registry.withdrawals.filter(status__in=['pending', 'succeeded']).aggregate(total=Sum('amount'))['total'] or Decimal('0.00')
-        
-        available_balance = net_available - total_withdrawn
+        # Final, definitive balance check before initiating transfer.
+        # The ledger balance stays locked until the withdrawal is recorded.
+        ledger = RegistryLedger.lock(registry.id)
+        available_balance = ledger.balance.available
 
         if amount_to_withdraw > available_balance:
             return Response({"detail": f"Withdrawal amount of ${amount_to_withdraw:.2f} exceeds available balance of ${available_balance:.2f}."}, status=status.HTTP_400_BAD_REQUEST)
@@ -245,6 +284,7 @@ class RegistryViewSet(viewsets.ModelViewSet):
                 status='pending',
                 stripe_transfer_id=transfer.id
             )
+            ledger.debit(withdrawal)
             return Response({"status": "success", "message": "Withdrawal initiated successfully. It may take a few business days to appear in your account.", "transfer_id": transfer.id}, status=status.HTTP_200_OK)
         except stripe.error.StripeError as e:
             return Response({"detail": f"An error occurred with our payment processor: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -261,9 +301,61 @@ class PublicRegistryViewSet(
     serializer_class = serializers.PublicRegistrySerializer
     permission_classes = [permissions.AllowAny]
     lookup_field = 'shareable_id'
+    ordering = ('-created_at', '-id')
+    page_size = 50
+
+    def get_ordering(self):
+        """
+        Sort services by the `?ordering=` the client asked for, e.g. `progress` for least funded first.
+        """
+        return service_ordering(self.request, self.ordering)
+
+    def filter_services(self, services):
+        """
+        Applies the `?is_available=`, `?is_completed=` and `?ordering=` parameters to the services.
+        """
+        filterset = ServiceFilter(self.request.query_params, queryset=services.with_financials(), request=self.request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return filterset.qs
+
+    def get_queryset(self):
+        """
+        Load the owner and services only when the requested fields include them.
+        The nested services are filtered and ordered in the database like the services list.
+        """
+        queryset = self.queryset
+        selection = FieldSelection.from_request(self.request)
+        if selection.includes('owner_first_name'):
+            queryset = queryset.select_related('created_by')
+        if selection.includes('services') and self.action == 'retrieve':
+            services = self.filter_services(models.Service.objects.all())
+            if 'ordering' in self.request.query_params:
+                services = services.order_by(*self.get_ordering())
+            queryset = queryset.prefetch_related(Prefetch('services', queryset=services))
+        return queryset
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter('is_available', bool, description="Whether the service is active and not yet fully funded."),
+            OpenApiParameter('is_completed', bool, description="Whether the service is active and fully funded."),
+            OpenApiParameter('ordering', str, enum=list(SERVICE_ORDERINGS), description="Sort order; `progress` is least funded first."),
+        ],
+        responses={200: serializers.PublicServiceSerializer(many=True)},
+    )
+    @action(detail=True, methods=['get'])
+    def services(self, request, shareable_id=None):
+        """
+        Lists the services of a public registry, filtered and ordered by funding progress, a page at a time.
+        """
+        registry = get_object_or_404(models.Registry, shareable_id=shareable_id)
+        services = self.filter_services(registry.services.select_related('registry'))
+        page = self.paginate_queryset(services)
+        serializer = serializers.PublicServiceSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
 
-class ServiceViewSet(viewsets.ModelViewSet):
+class ServiceViewSet(ContributionListMixin, viewsets.ModelViewSet):
     """
     A base viewset for service-related operations.
     This can be extended by other viewsets to implement specific service functionalities.
@@ -271,18 +363,34 @@ class ServiceViewSet(viewsets.ModelViewSet):
     queryset = models.Service.objects.all()
     serializer_class = serializers.ServiceSerializer
     permission_classes = [permissions.IsAuthenticated]
+    ordering = ('-created_at', '-id')
+    page_size = 50
     filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['registry']
+    filterset_class = ServiceFilter
+
+    def get_ordering(self):
+        """
+        Sort by the `?ordering=` the client asked for, e.g. `progress` for least funded first.
+        """
+        return service_ordering(self.request, self.ordering)
 
     def get_queryset(self):
         """
         Override the default queryset to filter services based on the user's ownership or shared.
         """
         # return self.queryset.filter(registry__created_by=self.request.user)
-        return self.queryset.filter(
-            Q(registry__created_by=self.request.user) |
-            Q(registry__shared_registry__shared_with=self.request.user)
-        ).distinct()
+        queryset = self.queryset.visible_to(self.request.user).with_financials().select_related('registry')
+        if FieldSelection.from_request(self.request).includes('contributions', expandable=True):
+            queryset = queryset.prefetch_related('contributions')
+        return queryset
+
+    def perform_update(self, serializer):
+        """
+        Reload the updated service so its financial annotations reflect the new hours,
+        cost or active state instead of the values loaded before the update.
+        """
+        instance = serializer.save()
+        serializer.instance = self.get_queryset().get(pk=instance.pk)
 
     def create(self, request, *args, **kwargs):
         # This custom create method handles both single and bulk service creation.
@@ -333,7 +441,7 @@ class ServiceViewSet(viewsets.ModelViewSet):
         service = self.get_object()
 
         # Check if the user is the owner of the registry
-        if service.registry.created_by != request.user:
+        if service.registry.created_by_id != request.user.pk:
             return Response({"detail": "You do not have permission to delete this service."}, status=status.HTTP_403_FORBIDDEN)
 
         # Check if the service has any contributions
@@ -343,17 +451,92 @@ class ServiceViewSet(viewsets.ModelViewSet):
         self.perform_destroy(service)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def lock_owned_services(self, ids):
+        """
+        Locks the services with the given IDs for the rest of the transaction.
+        Returns the services by ID, or a 404 response when any of them is not in a registry
+        the user owns, so the IDs of other users' services are not revealed.
+        """
+        services = {
+            service.id: service
+            for service in models.Service.objects.select_for_update(of=('self',))
+            .filter(id__in=ids, registry__created_by=self.request.user)
+            .annotate(has_contributions=Exists(models.Contribution.objects.filter(service=OuterRef('pk'))))
+        }
+        missing = sorted(set(ids) - services.keys())
+        if missing:
+            return None, Response({"detail": f"Services {missing} were not found."}, status=status.HTTP_404_NOT_FOUND)
+        return services, None
+
+    @extend_schema(
+        methods=['patch'],
+        request=serializers.ServiceBulkUpdateSerializer(many=True),
+        responses={200: serializers.ServiceSummarySerializer(many=True)},
+    )
+    @extend_schema(methods=['delete'], request=serializers.ServiceBulkDeleteSerializer, responses={204: None})
+    @action(methods=['patch', 'delete'], detail=False, url_path='bulk')
+    def bulk(self, request):
+        """
+        Updates or deletes many services at once.
+        PATCH takes a list of `{id, ...fields}` and returns the updated services only.
+        DELETE takes `{"ids": [...]}` and deletes all of them, or none if any has contributions.
+        """
+        if request.method == 'DELETE':
+            return self.bulk_destroy(request)
+        return self.bulk_update(request)
+
+    def bulk_update(self, request):
+        serializer = serializers.ServiceBulkUpdateSerializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        changes = {item.pop('id'): item for item in serializer.validated_data}
+        if len(changes) != len(serializer.validated_data):
+            return Response({"detail": "Each service can only be listed once."}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            services, error = self.lock_owned_services(changes.keys())
+            if error:
+                return error
+            now = timezone.now()
+            fields = {'updated_at'}
+            for service_id, values in changes.items():
+                for field, value in values.items():
+                    setattr(services[service_id], field, value)
+                services[service_id].updated_at = now
+                fields.update(values)
+            models.Service.objects.bulk_update(services.values(), sorted(fields))
+
+        output = serializers.ServiceSummarySerializer(list(services.values()), many=True)
+        return Response(output.data)
+
+    def bulk_destroy(self, request):
+        serializer = serializers.ServiceBulkDeleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data['ids'])
+
+        with transaction.atomic():
+            # The row locks keep contributions from being added between the check and the delete.
+            services, error = self.lock_owned_services(ids)
+            if error:
+                return error
+            funded = sorted(service.id for service in services.values() if service.has_contributions)
+            if funded:
+                return Response(
+                    {"detail": f"Cannot delete services that have contributions: {funded}."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            models.Service.objects.filter(id__in=ids).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @extend_schema(parameters=CONTRIBUTION_LIST_PARAMETERS, responses={200: serializers.ContributionSerializer(many=True)})
     @action(methods=['get'], detail=True)
     def contributions(self, request, pk=None):
         """
-        Custom action to retrieve contributions for the service.
-        This can be used to implement functionalities related to contributions.
+        Custom action to retrieve contributions for the service, newest first.
+        Supports the `status`, `created_after`, `created_before` and `is_available` filters
+        and is paginated with the `cursor` and `page_size` parameters.
         """
         service = self.get_object()
-        contributions = service.contributions.all()
-        serializer = serializers.ContributionSerializer(
-            contributions, many=True)
-        return Response(serializer.data)
+        return self.list_contributions(request, service.contributions.all())
 
     # @action(methods=['get'], detail=False)
     # def volunteers(self, request):
@@ -375,9 +558,40 @@ class DefaultRegistryViewSet(
     A default viewset for registry operations.
     This can be used as a base for other registry-related viewsets.
     """
-    queryset = models.DefaultRegistry.objects.all()
+    queryset = models.DefaultRegistry.objects.prefetch_related(
+        Prefetch('default_services', queryset=models.DefaultService.objects.order_by('id'))
+    )
     serializer_class = serializers.DefaultRegistrySerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    ordering = ('id',)
+    page_size = 100
+
+    def list(self, request, *args, **kwargs):
+        """
+        Serves the default registries from the versioned catalog cache.
+        """
+        return cached_catalog_response(
+            request, 'default-registries', lambda: super(DefaultRegistryViewSet, self).list(request, *args, **kwargs).data
+        )
+
+    @extend_schema(
+        request=serializers.InstantiateDefaultRegistrySerializer,
+        responses={201: serializers.RegistrySerializer},
+    )
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def instantiate(self, request, pk=None):
+        """
+        Creates a registry for the user from this default registry, copying its default services
+        in one transaction. Each service can be overridden or left out through `services`.
+        """
+        template = self.get_object()
+        serializer = serializers.InstantiateDefaultRegistrySerializer(
+            data=request.data, context={'request': request, 'template': template}
+        )
+        serializer.is_valid(raise_exception=True)
+        registry = serializer.save()
+        output = serializers.RegistrySerializer(registry, context=self.get_serializer_context())
+        return Response(output.data, status=status.HTTP_201_CREATED)
 
 
 class DefaultServiceViewSet(
@@ -391,6 +605,16 @@ class DefaultServiceViewSet(
     queryset = models.DefaultService.objects.all()
     serializer_class = serializers.DefaultServiceSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    ordering = ('id',)
+    page_size = 100
+
+    def list(self, request, *args, **kwargs):
+        """
+        Serves the default services from the versioned catalog cache.
+        """
+        return cached_catalog_response(
+            request, 'default-services', lambda: super(DefaultServiceViewSet, self).list(request, *args, **kwargs).data
+        )
 
 
 class SharedRegistryViewSet(
@@ -405,12 +629,24 @@ class SharedRegistryViewSet(
     queryset = models.SharedRegistry.objects.all()
     serializer_class = serializers.SharedRegistrySerializer
     permission_classes = [permissions.IsAuthenticated]
+    ordering = ('-created_at', '-id')
+    page_size = 20
 
     def get_queryset(self):
         """
         Override the default queryset to filter shared registries based on the user's shared with.
+        The registries, their owners and their services with financial annotations are loaded
+        in batches for the whole page, so the number of queries does not grow with its size.
         """
-        return self.queryset.filter(shared_with=self.request.user)
+        queryset = self.queryset.filter(shared_with=self.request.user).select_related('registry')
+        selection = FieldSelection.from_request(self.request)
+        if selection.includes('registry.owner_first_name'):
+            queryset = queryset.select_related('registry__created_by')
+        if selection.includes('registry.services'):
+            queryset = queryset.prefetch_related(
+                Prefetch('registry__services', queryset=models.Service.objects.with_financials())
+            )
+        return queryset
 
     @extend_schema(
         methods=['get'],
@@ -423,7 +659,7 @@ class SharedRegistryViewSet(
         Custom action to retrieve a service from a shared registry.
         """
         shared_registry = self.get_object()
-        service = shared_registry.registry.services.filter(
+        service = shared_registry.registry.services.with_financials().filter(
             pk=service_pk).first()
         if not service:
             return Response({'detail': 'Service not found.'}, status=404)
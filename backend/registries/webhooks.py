@@ -0,0 +1,340 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from .ledger import RegistryLedger
+from .models import Contribution, Service, StripeEvent
+from . import reservations
+import json
+import logging
+import random
+import zlib
+
+
+logger = logging.getLogger(__name__)
+
+# The number of worker lanes. Events are assigned a lane when they are stored, so this must
+# not change while events are pending.
+LANES = 64
+# The first key of the Postgres advisory locks held on lanes, so they do not collide with other locks.
+LANE_LOCK_NAMESPACE = zlib.crc32(b'registries:stripe-event-lanes') & 0x7fffffff
+
+
+def partition_key(payload):
+    """
+    Returns the ID of the PaymentIntent the event is about, falling back to its charge and
+    then to the event itself, so events about the same payment share a key.
+    """
+    obj = payload['data']['object']
+    for field in ('payment_intent', 'charge'):
+        if obj.get('object') == field:
+            return obj['id']
+        related = obj.get(field)
+        if isinstance(related, dict):
+            related = related.get('id')
+        if related:
+            return related
+    return payload['id']
+
+
+def lane_of(key):
+    """
+    Returns the worker lane of a partition key.
+    """
+    return zlib.crc32(key.encode()) % LANES
+
+
+def store_event(payload):
+    """
+    Stores a verified Stripe event for the background worker with a single insert.
+    A delivery of an event that is already stored is ignored, so Stripe's retries and
+    duplicate deliveries are processed only once.
+    """
+    now = timezone.now()
+    key = partition_key(payload)
+    StripeEvent.objects.bulk_create([
+        StripeEvent(
+            event_id=payload['id'],
+            event_type=payload['type'],
+            payload=payload,
+            stripe_created_at=datetime.fromtimestamp(payload['created'], tz=dt_timezone.utc),
+            partition_key=key,
+            lane=lane_of(key),
+            next_attempt_at=now,
+        )
+    ], ignore_conflicts=True)
+
+
+def payment_intent_allocations(payment_intent):
+    """
+    Returns the (service ID, amount) pairs a PaymentIntent paid for, from its metadata.
+    A cart PaymentIntent lists its amount per service in `allocations`; any other PaymentIntent
+    pays its whole amount to the service in `service_id`.
+    """
+    metadata = payment_intent.get('metadata', {})
+    if metadata.get('allocations'):
+        return [(int(service_id), Decimal(amount)) for service_id, amount in json.loads(metadata['allocations']).items()]
+    if metadata.get('service_id'):
+        return [(int(metadata['service_id']), Decimal(payment_intent.get('amount_received', 0)) / Decimal('100.0'))]
+    return []
+
+
+def handle_payment_intent_succeeded(payment_intent):
+    """
+    Records a contribution for each service the successful PaymentIntent paid for, with one
+    insert, credits the registry's ledger and notifies the registry owner. Contributions are
+    keyed by PaymentIntent and service, so handling the same PaymentIntent again changes nothing.
+    """
+    payment_intent_id = payment_intent.get('id')
+    metadata = payment_intent.get('metadata', {})
+    allocations = payment_intent_allocations(payment_intent)
+    if not allocations:
+        reservations.settle(payment_intent_id, succeeded=True)
+        logger.warning(f"Stripe event for PI {payment_intent_id} is missing 'service_id' in metadata. Skipping.")
+        return
+    allocated = sum(amount for _, amount in allocations)
+    received = Decimal(payment_intent.get('amount_received', 0)) / Decimal('100.0')
+    if allocated != received:
+        logger.warning(f"PI {payment_intent_id} received ${received:.2f} but allocates ${allocated:.2f} to its services.")
+
+    services = Service.objects.select_related('registry').in_bulk([service_id for service_id, _ in allocations])
+    missing = [service_id for service_id, _ in allocations if service_id not in services]
+    if missing:
+        raise Service.DoesNotExist(f"Services {missing} of PI {payment_intent_id} do not exist.")
+    # Lock the registries' ledgers before the contributions are written, and before any
+    # service row is updated, in the same order as the other ledger writers.
+    ledgers = {
+        registry_id: RegistryLedger.lock(registry_id)
+        for registry_id in sorted({service.registry_id for service in services.values()})
+    }
+    # The funding held for the checkout becomes part of the contributed totals below.
+    reservations.settle(payment_intent_id, succeeded=True)
+
+    # Create the initial contribution records. Fee and available_on will be updated later.
+    recorded = set(Contribution.objects.filter(stripe_payment_intent_id=payment_intent_id).values_list('service_id', flat=True))
+    contributions = Contribution.objects.bulk_create([
+        Contribution(
+            service=services[service_id],
+            amount=amount,
+            contributor_name=metadata.get('contributor_name', ''),
+            contributor_email=metadata.get('contributor_email', ''),
+            status='succeeded',
+            stripe_payment_intent_id=payment_intent_id,
+        )
+        for service_id, amount in allocations if service_id not in recorded
+    ])
+    if not contributions:
+        return
+
+    from notifications.models import UserNotification
+    contributor_name = metadata.get('contributor_name', '') or 'An anonymous contributor'
+    for registry_id, ledger in ledgers.items():
+        credited = [contribution for contribution in contributions if contribution.service.registry_id == registry_id]
+        if not credited:
+            continue
+        for contribution in credited:
+            # Keep the service's denormalized funding counters in step with the new contribution.
+            Service.objects.adjust_totals(contribution.service_id, amount=contribution.amount, count=1)
+        ledger.credit_many(credited)
+        if len(credited) == 1:
+            message = f"{contributor_name} just contributed ${credited[0].amount:.2f} to your '{credited[0].service.name}' service!"
+        else:
+            total = sum(contribution.amount for contribution in credited)
+            message = f"{contributor_name} just contributed ${total:.2f} to {len(credited)} of your services!"
+        UserNotification.objects.create(
+            user_id=credited[0].service.registry.created_by_id,
+            title="New Contribution Received!",
+            message=message,
+        )
+
+
+def handle_payment_intent_canceled(payment_intent):
+    """
+    Releases the funding held for a PaymentIntent that was canceled. A failed payment is not
+    final, as the contributor can retry it with another card, so its hold is kept until the
+    PaymentIntent succeeds, or is canceled when the hold expires.
+    """
+    reservations.settle(payment_intent.get('id'), succeeded=False)
+
+
+# Handlers by event type. They receive the event's data object and must be idempotent,
+# as events can be replayed. Events of other types are stored and marked as processed.
+EVENT_HANDLERS = {
+    'payment_intent.succeeded': handle_payment_intent_succeeded,
+    'payment_intent.canceled': handle_payment_intent_canceled,
+}
+
+
+class StripeEventProcessor:
+    """
+    Processes stored Stripe events on a pool of worker threads.
+
+    Events are partitioned by PaymentIntent into lanes. A worker takes a lane by holding a
+    Postgres advisory lock on it and handles the lane's due events in the order Stripe
+    created them, each in its own transaction. Lanes are processed fully in parallel by
+    threads and processes, while events about the same PaymentIntent never race each other.
+    An event that fails is retried with exponential backoff and marked as failed after
+    `max_attempts`; until then the later events of its PaymentIntent wait for it.
+    Without PostgreSQL there are no advisory locks, so a single worker is used.
+    """
+    max_attempts = 8
+    base_delay = timedelta(seconds=30)
+    max_delay = timedelta(hours=1)
+
+    def __init__(self, workers=None, batch_size=100):
+        self.workers = workers or getattr(settings, 'STRIPE_EVENT_WORKERS', 4)
+        if connection.vendor != 'postgresql':
+            self.workers = 1
+        self.batch_size = batch_size
+
+    @staticmethod
+    def due_events(lane, now=None):
+        """
+        Returns the pending events of the lane that are due, in the order Stripe created them.
+        Events held back by an earlier event of their partition that waits for a retry are left out.
+        """
+        now = now or timezone.now()
+        waiting = StripeEvent.objects.filter(
+            Q(stripe_created_at__lt=OuterRef('stripe_created_at'))
+            | Q(stripe_created_at=OuterRef('stripe_created_at'), id__lt=OuterRef('id')),
+            partition_key=OuterRef('partition_key'),
+            status=StripeEvent.PENDING,
+            next_attempt_at__gt=now,
+        )
+        return StripeEvent.objects.filter(
+            lane=lane, status=StripeEvent.PENDING, next_attempt_at__lte=now
+        ).exclude(Exists(waiting)).order_by('stripe_created_at', 'id')
+
+    @staticmethod
+    def acquire_lane(lane):
+        """
+        Takes the lane for this worker's database session unless another worker holds it.
+        """
+        if connection.vendor != 'postgresql':
+            return True
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s, %s)', [LANE_LOCK_NAMESPACE, lane])
+            return cursor.fetchone()[0]
+
+    @staticmethod
+    def release_lane(lane):
+        if connection.vendor != 'postgresql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s, %s)', [LANE_LOCK_NAMESPACE, lane])
+
+    def retry_delay(self, attempts):
+        """
+        Returns how long to wait before the next attempt after the given number of attempts.
+        """
+        return min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+
+    def process(self, event_id):
+        """
+        Handles the event and records the outcome in one transaction.
+        Returns False if the event failed or is no longer pending.
+        """
+        with transaction.atomic():
+            event = StripeEvent.objects.select_for_update().filter(id=event_id, status=StripeEvent.PENDING).first()
+            if event is None:
+                return False
+
+            event.attempts += 1
+            handler = EVENT_HANDLERS.get(event.event_type)
+            try:
+                with transaction.atomic():
+                    if handler is not None:
+                        handler(event.payload['data']['object'])
+            except Exception as e:
+                logger.error(f"Processing Stripe event {event.event_id} failed: {e}", exc_info=True)
+                event.last_error = str(e)
+                if event.attempts >= self.max_attempts:
+                    event.status = StripeEvent.FAILED
+                    event.next_attempt_at = None
+                else:
+                    event.next_attempt_at = timezone.now() + self.retry_delay(event.attempts)
+                succeeded = False
+            else:
+                event.status = StripeEvent.SUCCEEDED
+                event.last_error = ''
+                event.next_attempt_at = None
+                event.processed_at = timezone.now()
+                succeeded = True
+            event.save(update_fields=['status', 'attempts', 'last_error', 'next_attempt_at', 'processed_at', 'updated_at'])
+            return succeeded
+
+    def drain_lane(self, lane, limit):
+        """
+        Processes up to `limit` due events of a lane the worker holds, in order.
+        Once an event fails, the later events of its partition are left for after its retry.
+        Returns the number of events processed.
+        """
+        processed, blocked = 0, set()
+        for event_id, key in self.due_events(lane).values_list('id', 'partition_key')[:limit]:
+            if key in blocked:
+                continue
+            if not self.process(event_id):
+                blocked.add(key)
+            processed += 1
+        return processed
+
+    @staticmethod
+    def busy_lanes():
+        """
+        Returns the lanes that have due events, read from the pending events alone.
+        """
+        return list(
+            StripeEvent.objects.filter(status=StripeEvent.PENDING, next_attempt_at__lte=timezone.now())
+            .values_list('lane', flat=True).distinct()
+        )
+
+    def drain(self):
+        """
+        Visits the lanes with due events that no other worker holds and processes their
+        events, until the batch size is reached. Lanes are visited in random order to spread
+        the workers. Returns the number of events processed.
+        """
+        processed, lanes = 0, self.busy_lanes()
+        random.shuffle(lanes)
+        try:
+            for lane in lanes:
+                if processed >= self.batch_size:
+                    break
+                if not self.acquire_lane(lane):
+                    continue
+                try:
+                    processed += self.drain_lane(lane, self.batch_size - processed)
+                finally:
+                    self.release_lane(lane)
+        finally:
+            connections.close_all()
+        return processed
+
+    def run(self):
+        """
+        Drains the due events on the worker pool and returns the number processed.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return sum(pool.map(lambda _: self.drain(), range(self.workers)))
+
+    @staticmethod
+    def replay(since, until=None, event_type=None):
+        """
+        Queues the events Stripe created in the given time range for processing again.
+        Returns the number of events queued.
+        """
+        events = StripeEvent.objects.filter(stripe_created_at__gte=since)
+        if until is not None:
+            events = events.filter(stripe_created_at__lt=until)
+        if event_type:
+            events = events.filter(event_type=event_type)
+        return events.update(
+            status=StripeEvent.PENDING,
+            attempts=0,
+            last_error='',
+            next_attempt_at=timezone.now(),
+            updated_at=timezone.now(),
+        )
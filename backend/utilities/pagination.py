@@ -0,0 +1,181 @@
+import base64
+from decimal import Decimal
+import json
+from uuid import UUID
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a composite sort key, e.g. (created_at, id).
+
+    A page is fetched by comparing the sort key with the last row of the previous page
+    instead of skipping rows with OFFSET, so with an index on the sort key every page
+    costs the same regardless of its depth. The last ordering field must be unique.
+
+    Views choose their sort key and page size with `ordering` and `page_size` attributes, or
+    pick the sort key per request with a `get_ordering()` method. Sort keys may name
+    annotations of the queryset.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = api_settings.PAGE_SIZE or 50
+    max_page_size = 200
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = self.get_ordering(view)
+        self.page_size = self.get_page_size(request, view)
+        self.base_url = request.build_absolute_uri()
+        values, self.reverse = self.decode_cursor(request, queryset)
+        ordering = self.ordering if not self.reverse else tuple(self.reversed(field) for field in self.ordering)
+
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(self.after(ordering, values))
+
+        # Fetch one extra row to learn whether there is another page.
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+
+        self.page = rows
+        self.has_next = has_more if not self.reverse else values is not None
+        self.has_previous = values is not None if not self.reverse else has_more
+        return rows
+
+    def get_ordering(self, view=None):
+        if hasattr(view, 'get_ordering'):
+            return tuple(view.get_ordering())
+        return tuple(getattr(view, 'ordering', None) or self.ordering)
+
+    def get_page_size(self, request, view=None):
+        page_size = getattr(view, 'page_size', None) or self.page_size
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return page_size
+        return max(1, min(size, self.max_page_size))
+
+    @staticmethod
+    def reversed(field):
+        return field[1:] if field.startswith('-') else f"-{field}"
+
+    @staticmethod
+    def after(ordering, values):
+        """
+        Builds the filter for the rows after the given sort key values in the given ordering.
+        The leading range bound lets the database seek on the index before applying the tie-breaks.
+        """
+        first, descending = ordering[0].lstrip('-'), ordering[0].startswith('-')
+        bound = Q(**{f"{first}__{'lte' if descending else 'gte'}": values[0]})
+        after = Q()
+        for index, field in enumerate(ordering):
+            name, descending = field.lstrip('-'), field.startswith('-')
+            clause = Q(**{f"{name}__{'lt' if descending else 'gt'}": values[index]})
+            for previous, value in zip(ordering[:index], values):
+                clause &= Q(**{previous.lstrip('-'): value})
+            after |= clause
+        return bound & after
+
+    def encode_cursor(self, row, reverse):
+        values = [self.value_to_string(row, field.lstrip('-')) for field in self.ordering]
+        token = base64.urlsafe_b64encode(json.dumps({'v': values, 'r': reverse}).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    @staticmethod
+    def value_to_string(row, name):
+        value = getattr(row, name)
+        if isinstance(value, (Decimal, UUID)):
+            return str(value)
+        return value.isoformat() if hasattr(value, 'isoformat') else value
+
+    def decode_cursor(self, request, queryset):
+        """
+        Returns the sort key values and direction of the request's cursor, or (None, False) without one.
+        """
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+            values = [
+                self.value_to_python(queryset, field.lstrip('-'), value)
+                for field, value in zip(self.ordering, cursor['v'], strict=True)
+            ]
+            return values, bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def value_to_python(queryset, name, value):
+        try:
+            field = queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            annotation = queryset.query.annotations.get(name)
+            if annotation is None:
+                return value
+            field = annotation.output_field
+        try:
+            return field.to_python(value)
+        except Exception as exc:
+            raise ValueError(str(exc))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'The pagination cursor value.',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.page_size_query_param,
+                'required': False,
+                'in': 'query',
+                'description': f'Number of results to return per page, at most {self.max_page_size}.',
+                'schema': {'type': 'integer'},
+            },
+        ]
+
@@ -29,6 +29,9 @@ function Page() {
     const [clientSecret, setClientSecret] = useState<string | null>(null);
     const [contributionAmount, setContributionAmount] = useState<number>(0);
     const [isSubmitting, setIsSubmitting] = useState(false);
+    // Identifies one contribution attempt, so retried requests reuse the same PaymentIntent.
+    const [idempotencyKey, setIdempotencyKey] = useState<string>('');
+    const [paymentError, setPaymentError] = useState<string | null>(null);
 
     const fetchCallbacks = useMemo(() => ({
         onSuccess: () => setStatus('success'),
@@ -50,8 +53,10 @@ function Page() {
             setClientSecret(data.clientSecret);
             setIsPaymentModalOpen(true);
         },
-        onError: (e) => {
+        onError: (e: HulkFetchErrorProps) => {
             console.error("Failed to create payment intent:", e);
+            // e.g. when the amount is more than the service has left to fund.
+            setPaymentError(e.message);
             setIsSubmitting(false);
         }
     }), []);
@@ -68,12 +73,15 @@ function Page() {
 
     const handleOpenContributionModal = useCallback((service: Service) => {
         setSelectedService(service);
+        setIdempotencyKey(crypto.randomUUID());
+        setPaymentError(null);
         setIsInfoModalOpen(true);
     }, []);
 
     const handleInitiatePayment = useCallback((amount: number, name: string, email: string) => {
         if (!selectedService) return;
         setIsSubmitting(true);
+        setPaymentError(null);
         setContributionAmount(amount);
         createPaymentIntent({
             method: 'POST',
@@ -82,9 +90,10 @@ function Page() {
                 amount,
                 contributor_name: name,
                 contributor_email: email,
+                idempotency_key: idempotencyKey,
             })
         });
-    }, [createPaymentIntent, selectedService]);
+    }, [createPaymentIntent, selectedService, idempotencyKey]);
 
     const { availableServices, completedServices, totalRaised, totalCost } = useRegistryData(registriesData);
 
@@ -113,6 +122,7 @@ function Page() {
                     onClose={() => setIsInfoModalOpen(false)}
                     onSubmit={handleInitiatePayment}
                     isSubmitting={isSubmitting}
+                    submitError={paymentError}
                 />
             )}
 
@@ -1,6 +1,7 @@
 "use client";
 
 import { NotificationProps } from '@/lib/services/notification/types';
+import { Paginated } from '@/lib/services/types';
 import { Icon } from '@iconify/react'
 import React, { useEffect } from 'react'
 import { useHulkFetch } from 'hulk-react-utils';
@@ -8,8 +9,9 @@ import { useHulkFetch } from 'hulk-react-utils';
 function Page() {
     const {
         dispatch: goNotifications,
-        data: notificationsData
-    } = useHulkFetch<NotificationProps[]>('/notifications/');
+        data: notificationsPage
+    } = useHulkFetch<Paginated<NotificationProps>>('/notifications/');
+    const notificationsData = notificationsPage?.results;
 
     useEffect(() => {
         goNotifications({ method: 'GET' });
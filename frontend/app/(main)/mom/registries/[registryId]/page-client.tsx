@@ -28,7 +28,7 @@ function PageClient({ accessToken }: PageClientProps) {
     const {
         dispatch: goRegistries,
         data: registriesData
-    } = useHulkFetch<Registry>(`/registries/r/${registryId}/`);
+    } = useHulkFetch<Registry>(`/registries/r/${registryId}/?expand=stripe_balance,total_withdrawn,total_fees`);
 
     const { dispatch: createConnectAccount } = useHulkFetch<{ url: string }>('/registries/r/create-connect-account/', {
         onSuccess: (data) => {
@@ -1,6 +1,7 @@
 'use client'
 
 import { DefaultService } from '@/lib/services/registry/types'
+import { Paginated } from '@/lib/services/types'
 import { useParams, useRouter } from 'next/navigation'
 import React, { useEffect, useRef, useState } from 'react'
 import { Icon } from '@iconify/react'
@@ -24,8 +25,9 @@ function Page() {
     // Fetch default services for suggestions
     const {
         dispatch: fetchDefaultServices,
-        data: defaultServicesData
-    } = useHulkFetch<DefaultService[]>("/registries/services/default/")
+        data: defaultServicesPage
+    } = useHulkFetch<Paginated<DefaultService>>("/registries/services/default/")
+    const defaultServicesData = defaultServicesPage?.results
 
     // Submit services to API
     const {
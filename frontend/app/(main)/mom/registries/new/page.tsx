@@ -1,6 +1,7 @@
 'use client'
 
 import { CreateRegistry, DefaultService, Registry } from '@/lib/services/registry/types'
+import { Paginated } from '@/lib/services/types'
 import { useRouter } from 'next/navigation'
 import React, { useEffect, useRef, useState } from 'react'
 import { Icon } from '@iconify/react'
@@ -31,8 +32,9 @@ function Page() {
     // This must be at the top level
     const {
         dispatch: fetchDefaultServices,
-        data: defaultServicesData
-    } = useHulkFetch<DefaultService[]>("/registries/services/default/")
+        data: defaultServicesPage
+    } = useHulkFetch<Paginated<DefaultService>>("/registries/services/default/")
+    const defaultServicesData = defaultServicesPage?.results
 
     const {
         dispatch: goRegistries,
@@ -1,6 +1,7 @@
 'use client'
 
 import { Registry, SharedRegistry } from '@/lib/services/registry/types'
+import { Paginated } from '@/lib/services/types'
 import { useRouter } from 'next/navigation'
 import React, { useEffect } from 'react'
 import { Icon } from '@iconify/react'
@@ -14,14 +15,16 @@ function Page() {
     // Fetch user's own registries
     const {
         dispatch: goRegistries,
-        data: registriesData
-    } = useHulkFetch<Registry[]>("/registries/r/")
+        data: registriesPage
+    } = useHulkFetch<Paginated<Registry>>("/registries/r/")
 
     // Fetch shared registries
     const {
         dispatch: goShared,
-        data: sharedData
-    } = useHulkFetch<SharedRegistry[]>("/registries/shared/")
+        data: sharedPage
+    } = useHulkFetch<Paginated<SharedRegistry>>("/registries/shared/")
+    const registriesData = registriesPage?.results
+    const sharedData = sharedPage?.results
 
     useEffect(() => {
         goRegistries({ method: 'GET' })
@@ -4,6 +4,7 @@ import { ServiceListCard } from '@/components/cards';
 import { InputField } from '@/components/inputs';
 import { AppLogo } from '@/components/logo';
 import { CreateRegistry, DefaultService } from '@/lib/services/registry/types'
+import { Paginated } from '@/lib/services/types';
 import { useHulkFetch } from 'hulk-react-utils';
 import { useRouter } from 'next/navigation';
 import React, { useEffect, useState } from 'react'
@@ -19,11 +20,12 @@ function Page() {
     // Default services can be fetched from the backend
     // The user can also add custom services
     const {
-        data: defaultServicesData,
+        data: defaultServicesPage,
         dispatch: fetchDefaultServices
-    } = useHulkFetch<DefaultService[]>(
+    } = useHulkFetch<Paginated<DefaultService>>(
         '/registries/services/default/',
     )
+    const defaultServicesData = defaultServicesPage?.results;
     // const _localServices: LocalDefaultService[] = [
     //     { name: 'Childcare Support', description: 'Professional childcare services to help you care for your baby.', hours: 10, cost_per_hour: "20" },
     //     { name: 'Household Help', description: 'Assistance with household chores and errands to ease your daily routine.', hours: 8, cost_per_hour: "15" },
@@ -7,6 +7,7 @@ import { OutlinedButton } from "./buttons";
 import clx from "clsx";
 import { startTransition, useActionState, useEffect } from "react";
 import { Registry, SharedRegistry } from "@/lib/services/registry/types";
+import { Paginated } from "@/lib/services/types";
 import { logout } from "@/lib/services/auth/actions";
 import { useHulk, useHulkAlert, useHulkFetch } from "hulk-react-utils";
 import { LoadingModal } from "./modals";
@@ -24,12 +25,14 @@ export function Menubar(props: {
     const [state, logoutAction, isPending] = useActionState(logout, null)
     const {
         dispatch: goRegistries,
-        data: registriesData
-    } = useHulkFetch<Registry[]>("/registries/r/")
+        data: registriesPage
+    } = useHulkFetch<Paginated<Registry>>("/registries/r/")
     const {
         dispatch: goShared,
-        data: sharedData
-    } = useHulkFetch<SharedRegistry[]>("/registries/shared/")
+        data: sharedPage
+    } = useHulkFetch<Paginated<SharedRegistry>>("/registries/shared/")
+    const registriesData = registriesPage?.results
+    const sharedData = sharedPage?.results
 
 
     useEffect(() => {
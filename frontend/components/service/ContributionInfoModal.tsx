@@ -10,9 +10,10 @@ interface ContributionInfoModalProps {
     onClose: () => void;
     onSubmit: (amount: number, name: string, email: string) => void;
     isSubmitting: boolean;
+    submitError?: string | null;
 }
 
-export function ContributionInfoModal({ service, registryOwnerName, onClose, onSubmit, isSubmitting }: ContributionInfoModalProps) {
+export function ContributionInfoModal({ service, registryOwnerName, onClose, onSubmit, isSubmitting, submitError }: ContributionInfoModalProps) {
     const [amount, setAmount] = useState('');
     const [name, setName] = useState('');
     const [email, setEmail] = useState('');
@@ -68,7 +69,7 @@ export function ContributionInfoModal({ service, registryOwnerName, onClose, onS
                         </div>
                     </div>
 
-                    {error && <p className="text-red-500 text-body-small text-center bg-red-50 p-3 rounded-lg">{error}</p>}
+                    {(error || submitError) && <p className="text-red-500 text-body-small text-center bg-red-50 p-3 rounded-lg">{error || submitError}</p>}
 
                     <button type="submit" disabled={isSubmitting} className="w-full bg-primary-500 text-white font-bold py-3 px-4 rounded-lg mt-6 hover:bg-primary-600 disabled:bg-neutral-300 flex items-center justify-center">
                         {isSubmitting ? (
@@ -6,7 +6,7 @@ export function useServiceDetails(serviceId: string | string[] | undefined) {
     const {
         dispatch: goService,
         data: serviceData
-    } = useHulkFetch<Service>(serviceId ? `/registries/services/${serviceId}/` : null);
+    } = useHulkFetch<Service>(serviceId ? `/registries/services/${serviceId}/?expand=contributions` : null);
 
     useEffect(() => {
         if (serviceId) {
@@ -25,7 +25,8 @@ export interface Service {
     is_completed: boolean;
     is_available: boolean;
     available_withdrawable_amount: string;
-    contributions: Contribution[];
+    // Only included with ?expand=contributions
+    contributions?: Contribution[];
 }
 
 export interface Registry {
@@ -40,14 +41,20 @@ export interface Registry {
     owner_first_name: string;
     created_at: string;
     updated_at: string;
+    // Only included when expanded, e.g. ?expand=stripe_balance,total_withdrawn,total_fees
     stripe_balance?: {
         available: string;
         pending: string;
     };
-    total_withdrawn: string;
-    total_fees: string;
+    total_withdrawn?: string;
+    total_fees?: string;
     payouts_enabled: boolean;
-    services: Service[];
+    // Registry lists only include services with ?expand=services
+    services?: Service[];
+    // Funding progress, only included in registry lists
+    services_count?: number;
+    total_cost?: string;
+    total_contributions?: string;
 }
 
 export interface PublicRegistryProps extends Registry {}
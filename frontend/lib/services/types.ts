@@ -0,0 +1,6 @@
+// A page of a cursor-paginated list endpoint.
+export interface Paginated<T> {
+    next: string | null;
+    previous: string | null;
+    results: T[];
+}